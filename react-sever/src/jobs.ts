@@ -0,0 +1,42 @@
+import axios from "axios";
+
+export const API_BASE = "http://localhost:8000";
+
+const POLL_INTERVAL_MS = 1000;
+
+// Workspace on the server; returned by /upload and sent with every later request
+const SESSION_KEY = "cross-editor-session";
+
+export const getSessionId = (): string | null => sessionStorage.getItem(SESSION_KEY);
+
+export const setSessionId = (sessionId: string) => sessionStorage.setItem(SESSION_KEY, sessionId);
+
+// URL of a session file for <video src> and friends, e.g. withSession("/videos/a.mp4")
+export const withSession = (path: string): string => {
+  const sessionId = getSessionId();
+  const separator = path.includes("?") ? "&" : "?";
+  return `${API_BASE}${path}${sessionId ? `${separator}session=${sessionId}` : ""}`;
+};
+
+// POST /process/* returns a job id right away; poll /jobs/<id> until the job finishes
+// and resolve with its result (rejects when the job failed or was cancelled).
+// onUpdate receives every job state, including per-stage progress in `stages`
+// (the same data is pushed by GET /jobs/<id>/events as Server-Sent Events).
+export const waitForJob = async (jobId: string, onUpdate?: (job: any) => void): Promise<any> => {
+  for (;;) {
+    const { data } = await axios.get(`${API_BASE}/jobs/${jobId}`, { params: { session: getSessionId() } });
+    if (onUpdate) onUpdate(data);
+    if (data.status === "done") {
+      return data.result;
+    }
+    if (data.status === "failed" || data.status === "cancelled") {
+      throw new Error(data.error || `Job ${data.status}`);
+    }
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+};
+
+export const runJob = async (path: string, body?: any, onUpdate?: (job: any) => void): Promise<any> => {
+  const response = await axios.post(`${API_BASE}${path}`, body, { params: { session: getSessionId() } });
+  return waitForJob(response.data.job_id, onUpdate);
+};
@@ -1,14 +1,20 @@
 /* eslint-disable */
 import React, { useState, useRef, useEffect } from 'react';
-import axios from 'axios';
+import { runJob, withSession } from '../jobs';
 import './Upload.css';
 
-const FPS = 24;
+// used only if the analysis did not report the frame rate
+const DEFAULT_FPS = 24;
+// the editor scrubs the low-bitrate proxy of each source; set to "original" for full quality
+const RENDITION = "proxy";
+const sourceUrl = (name: string): string => withSession(`/videos/${name}?rendition=${RENDITION}`);
 
 const Manual: React.FC = () => {
     // Use any to bypass strict type checks that might confuse the old parser
     const manualData = (window as any)['__MANUAL_DATA__'];
     const analysisData = manualData ? manualData.analysisData : null;
+    // converts the analysis frame numbers to seconds (the server probes it from the first video)
+    const fps = (analysisData && analysisData.frame_rate) || DEFAULT_FPS;
 
     // State with simple types
     const [currentVideo, setCurrentVideo] = useState<any>("");
@@ -36,7 +42,7 @@ const Manual: React.FC = () => {
     // Handle preview synchronization
     useEffect(() => {
         if (preview && preview.show && previewCurrentRef.current && previewTargetRef.current) {
-            const startTime = preview.currentFrame / FPS;
+            const startTime = preview.currentFrame / fps;
             // Play from 2 seconds before the cut
             const previewStart = Math.max(0, startTime - 2);
 
@@ -97,7 +103,7 @@ const Manual: React.FC = () => {
     };
 
     const handleVideoSwitch = (targetVideo: string, frame: number) => {
-        const time = frame / FPS;
+        const time = frame / fps;
 
         setSequence(prev => {
             // 1. Remove any existing transition at the exact same time (replace it)
@@ -140,8 +146,8 @@ const Manual: React.FC = () => {
         setRendering(true);
         try {
             console.log("Sending sequence:", sequence);
-            const response = await axios.post("http://localhost:8000/process/render", { sequence });
-            (window as any)['__RESULT_DATA__'] = { videoUrl: response.data.video_url };
+            const result = await runJob("/process/render", { sequence });
+            (window as any)['__RESULT_DATA__'] = { videoUrl: result.video_url };
             window.location.hash = '#/result';
         } catch (error) {
             console.error("Rendering failed:", error);
@@ -160,7 +166,7 @@ const Manual: React.FC = () => {
         for (let i = 0; i < entries.length; i++) {
             const [frameStr, matches] = entries[i];
             const frame = parseInt(frameStr, 10);
-            const time = frame / FPS;
+            const time = frame / fps;
 
             // Filter out points in the past (with a small buffer)
             // User might want to see all points now? 
@@ -231,7 +237,7 @@ const Manual: React.FC = () => {
                         {currentVideo && (
                             <video
                                 ref={videoRef}
-                                src={`http://localhost:8000/videos/${currentVideo}`}
+                                src={sourceUrl(currentVideo)}
                                 style={{ width: '100%', height: '100%', objectFit: 'contain' }}
                                 controls
                                 onTimeUpdate={handleTimeUpdate}
@@ -297,7 +303,7 @@ const Manual: React.FC = () => {
                                                 onClick={() => handleVideoSwitch(videoName, point.frame)}
                                                 style={{
                                                     position: 'absolute',
-                                                    left: `${((point.frame / FPS) / duration) * 100}%`, // Position at specific frame time
+                                                    left: `${((point.frame / fps) / duration) * 100}%`, // Position at specific frame time
                                                     top: '5px',
                                                     bottom: '5px',
                                                     width: '20px', // Fixed width for visibility
@@ -363,7 +369,7 @@ const Manual: React.FC = () => {
                             <span style={{ fontSize: '12px', color: '#888', marginBottom: '5px' }}>Current</span>
                             <video
                                 ref={previewCurrentRef}
-                                src={`http://localhost:8000/videos/${currentVideo}`}
+                                src={sourceUrl(currentVideo)}
                                 style={{ width: '100%', height: '100%', objectFit: 'cover', borderRadius: '5px' }}
                                 muted
                                 loop
@@ -373,7 +379,7 @@ const Manual: React.FC = () => {
                             <span style={{ fontSize: '12px', color: 'var(--flowkitgreen)', marginBottom: '5px' }}>Next</span>
                             <video
                                 ref={previewTargetRef}
-                                src={`http://localhost:8000/videos/${preview.targetVideo}`}
+                                src={sourceUrl(preview.targetVideo)}
                                 style={{ width: '100%', height: '100%', objectFit: 'cover', borderRadius: '5px' }}
                                 muted
                                 loop
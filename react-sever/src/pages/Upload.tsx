@@ -1,6 +1,7 @@
 import React, { useState } from "react";
 // import { useNavigate } from "react-router-dom";
-import axios from "axios";
+import { runJob } from "../jobs";
+import { uploadFiles } from "../uploads";
 import "./Upload.css";
 import "./UploadComponent.css";
 import "./UploadLoader.css";
@@ -16,20 +17,11 @@ const Upload: React.FC = () => {
     }
   };
 
-  const uploadFiles = async () => {
+  const uploadSelectedFiles = async () => {
     if (!selectedFiles) return false;
 
-    const formData = new FormData();
-    for (let i = 0; i < selectedFiles.length; i++) {
-      formData.append("files", selectedFiles[i]);
-    }
-
     try {
-      await axios.post("http://localhost:8000/upload", formData, {
-        headers: {
-          "Content-Type": "multipart/form-data",
-        },
-      });
+      await uploadFiles(selectedFiles);
       return true;
     } catch (error) {
       console.error("Upload failed:", error);
@@ -45,7 +37,7 @@ const Upload: React.FC = () => {
     }
 
     setUploading(true);
-    const uploadSuccess = await uploadFiles();
+    const uploadSuccess = await uploadSelectedFiles();
     if (!uploadSuccess) {
       setUploading(false);
       return;
@@ -55,13 +47,13 @@ const Upload: React.FC = () => {
     window.location.hash = '#/loading';
 
     try {
-      const response = await axios.post("http://localhost:8000/process/auto");
+      const result = await runJob("/process/auto");
       // Assuming response contains video_url or filename
       // Navigate to result with data
       // navigate("/result", { state: { videoUrl: response.data.video_url } });
       // For manual router, we might need a global state or just pass data via localStorage/global var for now
       // Simpler: just go to result, Result component fetches data or we use a simple global
-      (window as any)['__RESULT_DATA__'] = { videoUrl: response.data.video_url };
+      (window as any)['__RESULT_DATA__'] = { videoUrl: result.video_url };
       window.location.hash = '#/result';
     } catch (error) {
       console.error("Auto processing failed:", error);
@@ -80,7 +72,7 @@ const Upload: React.FC = () => {
     }
 
     setUploading(true);
-    const uploadSuccess = await uploadFiles();
+    const uploadSuccess = await uploadSelectedFiles();
     if (!uploadSuccess) {
       setUploading(false);
       return;
@@ -88,10 +80,10 @@ const Upload: React.FC = () => {
 
     try {
       // Call analyze endpoint
-      const response = await axios.post("http://localhost:8000/process/analyze");
+      const analysisData = await runJob("/process/analyze");
       // Navigate to Manual page with analysis data
       // navigate("/manual", { state: { analysisData: response.data } });
-      (window as any)['__MANUAL_DATA__'] = { analysisData: response.data };
+      (window as any)['__MANUAL_DATA__'] = { analysisData };
       window.location.hash = '#/manual';
     } catch (error) {
       console.error("Analysis failed:", error);
@@ -0,0 +1,50 @@
+import axios from "axios";
+import { API_BASE, getSessionId, setSessionId } from "./jobs";
+
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const MAX_RETRIES = 5;
+
+// Resumable upload of one file: the file is sent as ordered byte ranges; after a
+// failed chunk the server tells us how much it has and we continue from there.
+export const uploadFile = async (file: File, onProgress?: (sent: number, total: number) => void) => {
+  const params = { session: getSessionId() };
+  const { data: upload } = await axios.post(`${API_BASE}/uploads`, { filename: file.name, size: file.size }, { params });
+
+  let offset = upload.offset;
+  let retries = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + CHUNK_SIZE);
+    try {
+      const { data } = await axios.put(`${API_BASE}/uploads/${upload.upload_id}`, chunk, {
+        params: { ...params, offset },
+        headers: { "Content-Type": "application/octet-stream" },
+      });
+      offset = data.offset;
+      retries = 0;
+    } catch (error) {
+      if (++retries > MAX_RETRIES) throw error;
+      const { data } = await axios.get(`${API_BASE}/uploads/${upload.upload_id}`, { params });
+      offset = data.offset;
+    }
+    if (onProgress) onProgress(offset, file.size);
+  }
+
+  const { data: result } = await axios.post(`${API_BASE}/uploads/${upload.upload_id}/complete`, null, { params });
+  return result;
+};
+
+// Uploads a new batch of videos into a fresh session workspace.
+export const uploadFiles = async (files: FileList, onProgress?: (sent: number, total: number) => void) => {
+  const { data } = await axios.post(`${API_BASE}/sessions`);
+  setSessionId(data.session_id);
+
+  const total = Array.from(files).reduce((sum, file) => sum + file.size, 0);
+  let done = 0;
+  const results = [];
+  for (let i = 0; i < files.length; i++) {
+    const before = done;
+    results.push(await uploadFile(files[i], (sent) => onProgress && onProgress(before + sent, total)));
+    done += files[i].size;
+  }
+  return results;
+};
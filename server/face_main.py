@@ -7,9 +7,10 @@ import csv
 import time
 from collections import defaultdict, deque
 from multiprocessing import Pool, cpu_count
+from pose.face import face_guide_area, select_face, draw_debug_frame
 
 
-def process_video(video_path):
+def process_video(video_path, debug=False):
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"No file found at {video_path}")
 
@@ -30,14 +31,10 @@ def process_video(video_path):
     app.prepare(ctx_id=0, det_size=(640, 640))
 
     window_name = "Video"
-    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    if debug:
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
 
-    line1_x = int(width * 0.35)
-    line2_x = int(width * 0.65)
-    line1_y = int(height * 0.25)
-    line2_y = int(height * 0.6)
-    target_x = (line1_x + line2_x) // 2
-    target_y = (line1_y + line2_y) // 2
+    guide_area = face_guide_area(width, height)
 
     frame_count = 0
     face_positions = []
@@ -52,60 +49,14 @@ def process_video(video_path):
         frame_count += 1
         if frame_count % 5 != 0:
             continue
-        display_frame = frame.copy()
 
-        cv2.line(display_frame, (line1_x, 0), (line1_x, height), (255, 255, 0), 2)
-        cv2.line(display_frame, (line2_x, 0), (line2_x, height), (255, 255, 0), 2)
-        cv2.line(display_frame, (0, line1_y), (width, line1_y), (255, 255, 0), 2)
-        cv2.line(display_frame, (0, line2_y), (width, line2_y), (255, 255, 0), 2)
+        face = select_face(app.get(frame), guide_area)
 
-        best_face = None
-        largest_face = None
-        largest_face_size = 0  # To track the largest face size
-
-        faces = app.get(frame)
-        for face in faces:
-            bbox = face["bbox"].astype(int)
-            face_size = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-            # Update largest face if this face is bigger
-            if face_size > largest_face_size:
-                largest_face_size = face_size
-                largest_face = face
-
-            face_center_x = bbox[0] + (bbox[2] - bbox[0]) // 2
-            face_center_y = bbox[1] + (bbox[3] - bbox[1]) // 2
-
-            if (
-                line1_x <= face_center_x <= line2_x
-                and line1_y <= face_center_y <= line2_y
-            ):
-                distance = abs(face_center_x - target_x) + abs(face_center_y - target_y)
-                if best_face is None or distance < best_face[1]:
-                    best_face = (face, distance)
-
-        if best_face is None and largest_face is not None:
-            best_face = (
-                largest_face,
-                0,
-            )  # Use the largest face if no face found in area
-
-        if best_face:
-            face = best_face[0]
+        if face is not None:
             bbox = face["bbox"].astype(int)
-            cv2.rectangle(
-                display_frame,
-                (bbox[0], bbox[1]),
-                (bbox[2], bbox[3]),
-                (0, 255, 0),
-                2,
-            )
             if "landmark_2d_106" in face:
                 lmk = face["landmark_2d_106"]
                 lmk = np.round(lmk).astype(np.int64)
-                for point in lmk:
-                    cv2.circle(
-                        display_frame, tuple(point), 2, (0, 0, 255), -1, cv2.LINE_AA
-                    )
                 current_frame_positions = [
                     (bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1])
                 ]
@@ -127,12 +78,14 @@ def process_video(video_path):
             eye_endpoint.append([((0, 0), (0, 0))])  # Use tuple of tuples
             face_recognitions.append([[]])  # This already matches expected structure
 
-        cv2.imshow(window_name, display_frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+        if debug:
+            cv2.imshow(window_name, draw_debug_frame(frame, guide_area, face))
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
 
     cap.release()
-    cv2.destroyAllWindows()
+    if debug:
+        cv2.destroyAllWindows()
 
     input_file_name = os.path.splitext(os.path.basename(video_path))[0]
     output_csv = f"output_{input_file_name}.csv"
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pose import progress
+
+# Background jobs of the API server. The handlers only enqueue work and return a
+# job id; analysis / rendering runs on JOB_WORKERS threads (the models themselves
+# run in the process pools of pose.workers), so the event loop stays free.
+JOB_WORKERS = int(os.environ.get("CROSS_EDITOR_JOB_WORKERS", 2))
+# finished jobs are forgotten after this many seconds
+JOB_TTL = 60 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_jobs = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, owner=None, videos=()):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        # worker progress is reported per video (see pose.progress)
+        self.videos = tuple(videos)
+        self.status = QUEUED
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": {"done": self.done, "total": self.total},
+            "stages": progress.snapshot(self.id, self.videos),
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+def _run(job, fn, args, kwargs):
+    if job.cancel_requested.is_set():
+        job.status = CANCELLED
+        job.finished = time.time()
+        return
+    job.status = RUNNING
+    job.started = time.time()
+    _local.job = job
+    progress.set_scope(job.id)
+    try:
+        job.result = fn(*args, **kwargs)
+        job.status = DONE
+    except JobCancelled:
+        job.status = CANCELLED
+    except Exception as e:
+        traceback.print_exc()
+        job.error = getattr(e, "detail", None) or str(e)
+        job.status = FAILED
+    finally:
+        _local.job = None
+        progress.set_scope(None)
+        job.finished = time.time()
+
+
+def _prune():
+    now = time.time()
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished and now - job.finished > JOB_TTL]:
+        del _jobs[job_id]
+
+
+def submit(kind, fn, *args, owner=None, videos=(), **kwargs):
+    """
+    Run fn(*args, **kwargs) on the job pool; returns the Job right away.
+    owner: e.g. the session id; videos: the videos whose progress belongs to the job.
+    """
+    job = Job(kind, owner, videos)
+    with _lock:
+        _prune()
+        _jobs[job.id] = job
+    job.future = _executor.submit(_run, job, fn, args, kwargs)
+    return job
+
+
+def get(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def active_owners():
+    """Owners of the jobs that are queued or running."""
+    with _lock:
+        return {job.owner for job in _jobs.values() if job.owner is not None and job.status not in FINISHED}
+
+
+def cancel(job_id):
+    """
+    Request cancellation. A queued job never starts; a running job stops at its
+    next checkpoint (see checkpoint()).
+    """
+    job = get(job_id)
+    if job is None:
+        return None
+    job.cancel_requested.set()
+    if job.future is not None and job.future.cancel():
+        job.status = CANCELLED
+        job.finished = time.time()
+    return job
+
+
+def current_job():
+    """The job running on this thread, or None outside of a job."""
+    return getattr(_local, "job", None)
+
+
+def set_stage(stage, total=0):
+    job = current_job()
+    if job is not None:
+        job.stage = stage
+        job.done = 0
+        job.total = total
+
+
+def advance(count=1):
+    job = current_job()
+    if job is not None:
+        job.done += count
+
+
+def checkpoint():
+    """Raise JobCancelled if the current job was cancelled."""
+    job = current_job()
+    if job is not None and job.cancel_requested.is_set():
+        raise JobCancelled()
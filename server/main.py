@@ -2,12 +2,18 @@ import os
 # Set ffmpeg path explicitly for moviepy
 os.environ["IMAGEIO_FFMPEG_EXE"] = "/Users/lee-hong-gi/anaconda3/envs/pose/bin/ffmpeg"
 import glob
-from concurrent.futures import ProcessPoolExecutor
-from pose.pose import process_videos as process_yolo_videos
+from concurrent.futures import wait, FIRST_COMPLETED
+import jobs
+from pose.pose import submit_video as submit_pose_video, collect_video as collect_pose_video, pose_params
 from pose.pose_similarity import calculate_similarities
-from pose.transformation import find_max_transformation_order
-from make_json import generate_json, create_combined_video
-from pose.face import process_video_multiprocessing, find_matching_faces, process_matches, save_verified_matches, frame_difference_detection
+from pose.keypoint_store import person_counts as keypoint_person_counts, keypoint_store_path
+from pose import analysis_cache
+from pose.transformation import find_max_transformation_order, find_weighted_transformation_order, build_transition_scores
+from make_json import generate_json, render_combined_video, DEFAULT_FPS
+from pose.face import submit_video as submit_face_video, collect_video as collect_face_video, find_matching_faces, process_matches, save_verified_matches, face_csv_path, face_params
+from pose.scene import submit_videos as submit_scene_videos, collect_videos as collect_scene_videos, scene_lists
+from pose import proxy
+from pose.video_io import video_metadata
 import torch
 import json
 
@@ -20,6 +26,7 @@ def check_cuda():
 
 
 # 하이퍼파라미터 설정
+# 프레임 크기는 영상마다 probe 한 값 사용; 아래는 probe 실패 시 기본값
 WIDTH = 1920
 HEIGHT = 1080
 THRESHOLD = 8
@@ -27,6 +34,15 @@ POSITION_THRESHOLD = 0.05
 SIZE_THRESHOLD = 0.05
 AVG_SIMILARITY_THRESHOLD = 0.5
 RANDOM_POINT = 10
+# 전환 순서 계획: "count" (전환 횟수 최대) / "weighted" (전환 품질 합 최대, 구간 길이 제한)
+PLANNER = "count"
+PLANNERS = ("count", "weighted")
+MIN_SEGMENT_FRAMES = RANDOM_POINT
+MAX_SEGMENT_FRAMES = None
+# 분석 대기 중 작업 취소 여부를 확인하는 간격 (초)
+CANCEL_POLL_INTERVAL = 0.5
+# 긴 영상은 이 프레임 수 단위(키프레임 기준)로 나눠 여러 worker 에서 분석 (None: 영상 하나당 worker 하나)
+ANALYSIS_CHUNK_FRAMES = 1800
 
 # 절대 경로를 사용하도록 수정
 # 절대 경로를 사용하도록 수정
@@ -62,44 +78,151 @@ def find_intersections(face_verified_matches, results, frame_similarities, frame
 
     return updated_frame_similarities, updated_frame_count
 
-def analyze_videos(video_files):
-    with ProcessPoolExecutor() as executor:
-        print("영상 분석 시작합니다")
-        print("영상 분석 중 입니다")
-        
-        csv_video_mapping = process_yolo_videos(video_files)
-        
+def frame_size(video_file):
+    metadata = video_metadata(video_file)
+    if not metadata or not metadata["width"] or not metadata["height"]:
+        print(f"Could not probe {os.path.basename(video_file)}, assuming {WIDTH}x{HEIGHT}.")
+        return WIDTH, HEIGHT
+    return metadata["width"], metadata["height"]
+
+def reference_fps(video_files):
+    # 분석 프레임 번호 <-> 시간 변환 기준: 첫 번째 영상의 fps (generate_json 과 동일)
+    metadata = video_metadata(video_files[0]) if video_files else None
+    return (metadata or {}).get("fps") or DEFAULT_FPS
+
+def max_person_count(keypoint_file):
+    # person count per frame straight from the keypoint store's frame table
+    _, counts = keypoint_person_counts(keypoint_file)
+    return int(counts.max()) if len(counts) else 0
+
+def wait_cancellable(futures):
+    """Wait for futures, raising JobCancelled as soon as the current job is cancelled."""
+    pending = [future for future in futures if not future.done()]
+    while pending:
+        jobs.checkpoint()
+        pending = list(wait(pending, timeout=CANCEL_POLL_INTERVAL).not_done)
+    jobs.checkpoint()
+
+def run_analysis(video_files):
+    """
+    Pose and face analysis of every video, pipelined: face detection of a video is
+    queued as soon as its pose data shows at most one person, while YOLO keeps
+    running on the remaining videos. Scene cut detection runs alongside on its own
+    workers and only fills the analysis cache (see render_video).
+    All stages decode the low-resolution proxy of each video (see pose.proxy).
+    Returns ({video: keypoint file}, {video: face csv}).
+
+    Cancelling the current job stops the analysis at the next poll and cancels the
+    pool tasks that have not started yet. Staging directories of stages that did
+    not commit (failed or cancelled) are removed on the way out.
+    """
+    submitted = []
+    staging = []
+    try:
+        return _run_analysis(video_files, submitted, staging)
+    except jobs.JobCancelled:
+        cancelled = sum(future.cancel() for future in submitted)
+        print(f"Analysis cancelled ({cancelled} queued tasks dropped).")
+        raise
+    finally:
+        # committed entries already dropped theirs, so this only hits the leftovers
+        analysis_cache.discard(staging)
+
+def _run_analysis(video_files, submitted, staging):
+    if proxy.PROXY_ANALYSIS:
+        # 보통 업로드 직후 이미 만들어져 캐시에 있음
+        proxy.prepare_proxies(video_files)
+    jobs.checkpoint()
+    # what each video's stages decode, resolved once so the cache keys always match
+    # the file that is analysed (the source when its proxy could not be made)
+    inputs = {video_file: proxy.analysis_input(video_file) for video_file in video_files}
+    pose_cache_params = {video_file: pose_params(inputs[video_file][2]) for video_file in video_files}
+    face_cache_params = {video_file: face_params(inputs[video_file][2]) for video_file in video_files}
+
+    scene_cached, scene_pending = submit_scene_videos(video_files, inputs)
+    submitted.extend(future for _, future, _ in scene_pending.values())
+    staging.extend(entry for entry, _, _ in scene_pending.values())
+
+    # YOLO only runs on videos that are not in the analysis cache yet
+    csv_video_mapping, missing_pose = analysis_cache.split_cached(
+        video_files, "pose", pose_cache_params.get, lambda name: os.path.basename(keypoint_store_path(name)))
+    print(f"Pose cache: {len(csv_video_mapping)} cached, {len(missing_pose)} to analyse.")
+    staging.extend(missing_pose.values())
+    pose_futures = {
+        video_file: submit_pose_video(video_file, entry, ANALYSIS_CHUNK_FRAMES, analysis_cache.cache_name(video_file), inputs[video_file])
+        for video_file, entry in missing_pose.items()
+    }
+    submitted.extend(future for futures in pose_futures.values() for future in futures)
+
+    csv_face_mapping = {}
+    face_futures = {}
+    face_entries = {}
+
+    def start_face_detection(video_file, keypoint_file):
         # Filter videos for face detection: only those with max 1 person per frame
-        videos_for_face_detection = []
-        import pandas as pd
-        
-        print("Checking person count in videos...")
-        for video_file, csv_file in csv_video_mapping.items():
-            try:
-                df = pd.read_csv(csv_file)
-                # Group by frame_number and count rows (people)
-                person_counts = df.groupby('frame_number').size()
-                max_people = person_counts.max()
-                
-                if max_people <= 1:
-                    videos_for_face_detection.append(video_file)
-                    print(f"Video {os.path.basename(video_file)} passed check (Max people: {max_people}).")
-                else:
-                    print(f"Skipping face detection for {os.path.basename(video_file)} (Max people: {max_people}).")
-            except Exception as e:
-                print(f"Error checking {csv_file}: {e}")
-
-        # face detection multiprocessing
-        if videos_for_face_detection:
-            print(f"Running face detection on {len(videos_for_face_detection)} videos...")
-            csv_face_mapping = process_video_multiprocessing(videos_for_face_detection)
-        else:
-            print("No videos eligible for face detection.")
-            csv_face_mapping = {}
-
-        if not csv_video_mapping:
-            print("YOLO processing did not return any results.")
-            return None, None, None, None, None, None
+        try:
+            max_people = max_person_count(keypoint_file)
+        except Exception as e:
+            print(f"Error checking {keypoint_file}: {e}")
+            return
+        if max_people > 1:
+            print(f"Skipping face detection for {os.path.basename(video_file)} (Max people: {max_people}).")
+            return
+        print(f"Video {os.path.basename(video_file)} passed check (Max people: {max_people}).")
+
+        cached, missing = analysis_cache.split_cached(
+            [video_file], "face", face_cache_params[video_file], lambda name: os.path.basename(face_csv_path(name)))
+        csv_face_mapping.update(cached)
+        if missing:
+            print(f"Running face detection on {os.path.basename(video_file)}...")
+            face_entries[video_file] = missing[video_file]
+            staging.append(missing[video_file])
+            face_futures[video_file] = submit_face_video(video_file, ANALYSIS_CHUNK_FRAMES, analysis=inputs[video_file])
+            submitted.extend(face_futures[video_file])
+
+    print("Checking person count in videos...")
+    for video_file, keypoint_file in list(csv_video_mapping.items()):
+        start_face_detection(video_file, keypoint_file)
+
+    pending = set(pose_futures)
+    while pending:
+        # only the futures still running; a finished chunk would make wait return at once
+        wait([future for video_file in pending for future in pose_futures[video_file] if not future.done()],
+             timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        jobs.checkpoint()
+        for video_file in [video for video in video_files if video in pending]:
+            if not all(future.done() for future in pose_futures[video_file]):
+                continue
+            pending.discard(video_file)
+            keypoint_file = collect_pose_video(video_file, pose_futures[video_file], missing_pose[video_file], ANALYSIS_CHUNK_FRAMES,
+                                               analysis_cache.cache_name(video_file))
+            if keypoint_file is None:
+                continue
+            keypoint_file, = analysis_cache.commit(video_file, "pose", pose_cache_params[video_file], [keypoint_file])
+            csv_video_mapping[video_file] = keypoint_file
+            start_face_detection(video_file, keypoint_file)
+
+    wait_cancellable([future for futures in face_futures.values() for future in futures])
+    for video_file, futures in face_futures.items():
+        face_csv = collect_face_video(video_file, futures, face_entries[video_file], analysis_cache.cache_name(video_file))
+        face_csv, = analysis_cache.commit(video_file, "face", face_cache_params[video_file], [face_csv])
+        csv_face_mapping[video_file] = face_csv
+
+    if not csv_face_mapping:
+        print("No videos eligible for face detection.")
+    wait_cancellable([future for _, future, _ in scene_pending.values()])
+    collect_scene_videos(scene_cached, scene_pending)
+    return csv_video_mapping, csv_face_mapping
+
+def analyze_videos(video_files, output_dir=""):
+    print("영상 분석 시작합니다")
+    print("영상 분석 중 입니다")
+
+    csv_video_mapping, csv_face_mapping = run_analysis(video_files)
+
+    if not csv_video_mapping:
+        print("YOLO processing did not return any results.")
+        return None, None, None, None, None, None
 
     print("분석을 종료합니다")
 
@@ -110,23 +233,27 @@ def analyze_videos(video_files):
         return None, None, None, None, None, None
 
     # 자동 매핑된 csv 파일 목록을 csv_files 리스트에 추가
-    csv_face_files = [csv_face_mapping[video] for video in video_files if video in csv_face_mapping]
+    face_video_files = [video for video in video_files if video in csv_face_mapping and video in csv_video_mapping]
+    csv_face_files = [csv_face_mapping[video] for video in face_video_files]
     
     face_verified_matches = []
     if csv_face_files:
         # face csv 에서 나온 결괏값을 기반으로 best matching point 찾기
         matched_faces = find_matching_faces(csv_face_files)
         # 검증된 face match 기록 찾기
-        face_verified_matches = process_matches(matched_faces, video_files)
+        # face matches are keyed by the same stream ids (keypoint files) as the pose results
+        face_verified_matches = process_matches(matched_faces, [csv_video_mapping[video] for video in face_video_files])
         # csv파일로 저장 
-        save_verified_matches(face_verified_matches)
+        save_verified_matches(face_verified_matches, os.path.join(output_dir, "verified_matches.csv"))
     else:
         print("No face detection results to process. Skipping face matching.")
 
     video_file_mapping = {csv: video for video, csv in csv_video_mapping.items()}
 
+    # 키포인트는 소스 해상도 좌표 (proxy 분석 결과도 환산됨) → 스트림별 소스 크기로 정규화
+    frame_sizes = [frame_size(video_file_mapping[csv]) for csv in csv_files]
     results, verified_matches, frame_similarities, frame_count, best_vectors = calculate_similarities(
-        csv_files, WIDTH, HEIGHT, THRESHOLD, POSITION_THRESHOLD, SIZE_THRESHOLD, AVG_SIMILARITY_THRESHOLD
+        csv_files, [w for w, h in frame_sizes], [h for w, h in frame_sizes], THRESHOLD, POSITION_THRESHOLD, SIZE_THRESHOLD, AVG_SIMILARITY_THRESHOLD
     )
 
     # TODO : 교집합 찾기
@@ -144,24 +271,46 @@ def analyze_videos(video_files):
         print("No suitable transition points found.")
         return None, None, None, None, None, None
 
-    return n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors
+    # 전환점별 품질 (weighted planner 용)
+    transition_scores = build_transition_scores(results, face_verified_matches, AVG_SIMILARITY_THRESHOLD, POSITION_THRESHOLD)
+
+    return n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores
 
-def render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, output_json='output_pose.json', output_video='combined_video.mp4', custom_order=None):
+def plan_transitions(n_frame_similarities, n_frame_count, video_files, video_file_mapping, transition_scores=None, planner=PLANNER):
+    if planner not in PLANNERS:
+        raise ValueError(f"Unknown planner {planner!r}, expected one of {PLANNERS}")
+    if planner == "weighted":
+        # 결과 영상은 첫 번째 영상으로 시작하므로 첫 전환은 그 스트림에서 나가야 함
+        video_to_csv = {video: csv for csv, video in video_file_mapping.items()}
+        return find_weighted_transformation_order(
+            n_frame_similarities, transition_scores or {}, MIN_SEGMENT_FRAMES, MAX_SEGMENT_FRAMES,
+            first_stream=video_to_csv.get(video_files[0]),
+        )
+    return find_max_transformation_order(n_frame_similarities, n_frame_count, RANDOM_POINT)
+
+def render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores=None, output_json='output_pose.json', output_video='combined_video.mp4', custom_order=None, planner=PLANNER):
     if custom_order:
         print("Using custom transformation order from manual edit.")
         max_transformation_order = custom_order
     else:
-        max_transformation_order = find_max_transformation_order(n_frame_similarities, n_frame_count, RANDOM_POINT)
+        max_transformation_order = plan_transitions(n_frame_similarities, n_frame_count, video_files, video_file_mapping,
+                                                    transition_scores, planner)
+    jobs.checkpoint()
+
+    # 스트림별 장면 전환 시각 (분석 단계에서 캐시됨)
+    scene_list = scene_lists(video_files)
+    jobs.checkpoint()
 
     json_data = generate_json(max_transformation_order, verified_matches, video_files, csv_files, video_file_mapping,
-                              best_vectors)
+                              best_vectors, scene_list)
 
     with open(output_json, 'w') as f:
         json.dump(json_data, f, indent=4)
+    jobs.checkpoint()
 
     print("영상 제작 시작합니다")
     # JSON 파일을 기반으로 비디오 합치기
-    create_combined_video(output_json, output_video)
+    render_combined_video(output_json, output_video)
     print("최종 비디오가 생성되었습니다.")
     return output_video
 
@@ -176,9 +325,9 @@ def main():
         print("Analysis failed or no transition points found.")
         return
 
-    n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors = analysis_results
+    n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores = analysis_results
     
-    render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors)
+    render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores)
 
 if __name__ == "__main__":
     check_cuda()
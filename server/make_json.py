@@ -1,9 +1,20 @@
 import json
+import os
 from moviepy import VideoFileClip, concatenate_videoclips
 import subprocess as sp
 from moviepy.config import FFMPEG_BINARY
 from moviepy.tools import cross_platform_popen_params, ffmpeg_escape_filename
 import moviepy.video.io.ffmpeg_writer
+from proglog import TqdmProgressBarLogger
+from pose.progress import Reporter
+from pose.video_io import video_metadata
+from stream_render import create_stream_copy_video
+
+# frame rate assumed for a video that cannot be probed
+DEFAULT_FPS = 29.97
+# "copy"    - stream copy renderer (stream_render); falls back to moviepy if the sources do not allow it
+# "moviepy" - decode and re-encode everything through moviepy
+RENDERER = "copy"
 
 # Monkeypatch FFMPEG_VideoWriter.__init__ to fix preset=None bug
 def patched_init(
@@ -97,11 +108,29 @@ def patched_init(
 # Apply monkeypatch
 moviepy.video.io.ffmpeg_writer.FFMPEG_VideoWriter.__init__ = patched_init
 
-def generate_json(max_transformation_order, verified_matches, video_files, csv_files, video_file_mapping, best_vectors):
+class RenderProgressLogger(TqdmProgressBarLogger):
+    """moviepy's console progress bar, also forwarded to pose.progress as the "render" stage."""
+
+    def __init__(self):
+        super().__init__()
+        self.reporter = None
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        super().bars_callback(bar, attr, value, old_value)
+        if bar != "frame_index" or attr != "index":
+            return
+        total = self.bars[bar].get("total") or 0
+        if self.reporter is None or self.reporter.total != total:
+            self.reporter = Reporter("render", None, total)
+        self.reporter.update(value + 1)
+
+def generate_json(max_transformation_order, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, scene_list=None):
     num_streams = len(video_files)
-    fps = [29.97] * num_streams  # 각 비디오의 fps (임시 값)
-    total_frames = [774] * num_streams  # 각 비디오의 총 프레임 수 (임시 값)
-    duration = [25.8258] * num_streams  # 각 비디오의 길이 (임시 값)
+    # 각 비디오의 fps / 총 프레임 수 / 길이 (업로드 때 probe 되어 캐시된 값)
+    metadata = [video_metadata(video_file) or {} for video_file in video_files]
+    fps = [meta.get("fps") or DEFAULT_FPS for meta in metadata]
+    total_frames = [meta.get("frame_count") or 0 for meta in metadata]
+    duration = [meta.get("duration") or 0.0 for meta in metadata]
 
     meta_info = {
         "num_stream": num_streams,
@@ -116,7 +145,10 @@ def generate_json(max_transformation_order, verified_matches, video_files, csv_f
         "folder_path": "",  # 폴더 경로 필요 없음
     }
 
-    streams = [{"file": video_file, "start": 0, "end": 0} for video_file in video_files]
+    streams = [
+        {"file": video_file, "start": 0, "end": 0, "frame_rate": stream_fps, "num_frames": stream_frames, "duration": stream_duration}
+        for video_file, stream_fps, stream_frames, stream_duration in zip(video_files, fps, total_frames, duration)
+    ]
 
     cross_points = []
     for frame, start_file, end_file in max_transformation_order:
@@ -139,14 +171,8 @@ def generate_json(max_transformation_order, verified_matches, video_files, csv_f
         "meta_info": meta_info,
         "streams": streams,
         "cross_points": cross_points,
-        "scene_list": [
-        [100, 500, 1000, 1500],
-        [200, 500, 1500, 3000],
-        [100, 510, 1000, 1500],
-        [400, 500, 1000, 1500],
-        [150, 500, 1000, 1500],
-        [800, 500, 1000, 1500],
-    ]
+        # 각 스트림의 장면 전환 시각 (초, 오름차순); pose.scene 참고
+        "scene_list": scene_list if scene_list is not None else [[] for _ in video_files],
     }
 
     return json_data
@@ -157,6 +183,8 @@ def create_combined_video(json_file, output_file):
 
     streams = data['streams']
     cross_points = data['cross_points']
+    # 결과 영상은 기준(첫 번째) 스트림의 프레임 레이트로 렌더링
+    fps = data['meta_info'].get('frame_rate') or DEFAULT_FPS
 
     video_clips = {stream['file']: VideoFileClip(stream['file']) for stream in streams}
 
@@ -179,7 +207,7 @@ def create_combined_video(json_file, output_file):
         next_clip = video_clips[next_stream_file].subclipped(next_clip_start, next_clip_end)
         # Ensure subclip has fps
         if next_clip.fps is None:
-             next_clip.fps = 24.0
+             next_clip.fps = fps
         combined_clips.append(next_clip)
 
     print(f"Concatenating {len(combined_clips)} clips...")
@@ -187,12 +215,23 @@ def create_combined_video(json_file, output_file):
     final_clip = concatenate_videoclips(combined_clips, method="chain")
     
     # Use with_fps to ensure it propagates correctly
-    final_clip = final_clip.with_fps(24)
+    final_clip = final_clip.with_fps(fps)
     print(f"Final clip FPS: {final_clip.fps}")
     
     import moviepy
     print(f"MoviePy version: {moviepy.__version__}")
     
-    # Pass fps as keyword argument
-    final_clip.write_videofile(output_file, fps=24, codec='libopenh264', preset=None)
+    # moviepy 는 기본으로 작업 디렉터리에 임시 오디오 파일을 만들어 동시 세션끼리 충돌함 → 결과 영상 옆에 생성
+    temp_audiofile = os.path.splitext(os.path.abspath(output_file))[0] + "_temp_audio.mp3"
 
+    # Pass fps as keyword argument
+    final_clip.write_videofile(output_file, fps=fps, codec='libopenh264', preset=None, temp_audiofile=temp_audiofile,
+                               logger=RenderProgressLogger())
+
+def render_combined_video(json_file, output_file, renderer=RENDERER):
+    if renderer == "copy" and create_stream_copy_video(json_file, output_file):
+        return output_file
+    if renderer == "copy":
+        print("Falling back to the moviepy renderer.")
+    create_combined_video(json_file, output_file)
+    return output_file
@@ -0,0 +1,156 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+# Persistent per-video analysis cache:
+#   <CACHE_DIR>/<sha256 of the video>/<stage>-<params digest>/
+# holds the artifacts of one analysis stage (YOLO keypoints, face CSV, ...) for
+# one video content and one set of model / detector parameters. An entry is
+# only used once its meta.json has been written, i.e. after the stage finished.
+# Stages write into a private staging directory inside the entry; commit() moves
+# the files into place under a per-entry lock and writes meta.json last.
+CACHE_DIR = os.environ.get(
+    "CROSS_EDITOR_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache"),
+)
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+STAGING_PREFIX = ".staging-"
+# stages that count as analysis for has_video (metadata and proxy entries do not)
+ANALYSIS_STAGES = ("pose", "face", "scene")
+
+# (abspath, size, mtime_ns) -> sha256, so a video is hashed at most once per process
+_hash_memo = {}
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def file_hash(path):
+    signature = _file_signature(path)
+    if signature not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        _hash_memo[signature] = digest.hexdigest()
+    return _hash_memo[signature]
+
+
+def register_hash(path, sha256):
+    """Record a digest computed elsewhere (e.g. while the file was uploaded) so file_hash skips reading it."""
+    _hash_memo[_file_signature(path)] = sha256
+
+
+def has_video(sha256, stages=ANALYSIS_STAGES):
+    """True if a finished entry of one of stages is cached for this video content."""
+    video_dir = os.path.join(CACHE_DIR, sha256)
+    if not os.path.isdir(video_dir):
+        return False
+    return any(
+        name.partition("-")[0] in stages and os.path.exists(os.path.join(video_dir, name, META_FILE))
+        for name in os.listdir(video_dir)
+    )
+
+
+def params_digest(params):
+    encoded = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def entry_dir(video_path, stage, params):
+    return os.path.join(CACHE_DIR, file_hash(video_path), f"{stage}-{params_digest(params)}")
+
+
+def cache_name(video_path):
+    """
+    Stem of the artifact file names of video_path. Derived from the content hash,
+    so the same video uploaded under another file name hits the same artifacts.
+    """
+    return file_hash(video_path)[:16]
+
+
+def lookup(video_path, stage, params, artifact_name):
+    """Path of a finished cached artifact of video_path, or None."""
+    entry = entry_dir(video_path, stage, params)
+    artifact = os.path.join(entry, artifact_name)
+    if os.path.exists(os.path.join(entry, META_FILE)) and os.path.exists(artifact):
+        return artifact
+    return None
+
+
+def split_cached(video_files, stage, params, artifact_name):
+    """
+    Partition video_files into cache hits and misses for one stage.
+
+    params: the stage parameters, or a function of the video returning them when
+    they differ per video. artifact_name maps a cache_name() to the file name the
+    stage writes. Returns
+    ({video: cached artifact path}, {video: staging directory to write into}).
+    Every miss gets its own staging directory; commit() moves the files into the
+    entry, so concurrent runs never see each other's partial files. Misses that
+    are not committed must be dropped with discard().
+    """
+    cached = {}
+    missing = {}
+    for video_file in video_files:
+        video_params = params(video_file) if callable(params) else params
+        artifact = lookup(video_file, stage, video_params, artifact_name(cache_name(video_file)))
+        if artifact is not None:
+            cached[video_file] = artifact
+        else:
+            entry = entry_dir(video_file, stage, video_params)
+            os.makedirs(entry, exist_ok=True)
+            missing[video_file] = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=entry)
+    return cached, missing
+
+
+def commit(video_path, stage, params, artifacts):
+    """
+    Move what the stage wrote into its staging directory (artifacts and their
+    companion files) into the entry and mark it complete; meta.json goes last.
+    Returns the final paths of artifacts. If another run committed the entry
+    first, its files are kept and this run's staging directory is dropped.
+    """
+    entry = entry_dir(video_path, stage, params)
+    staging = os.path.dirname(os.path.abspath(artifacts[0])) if artifacts else None
+    final = [os.path.join(entry, os.path.basename(artifact)) for artifact in artifacts]
+
+    with open(os.path.join(entry, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(os.path.join(entry, META_FILE)):
+                if staging is not None and staging != os.path.abspath(entry):
+                    for name in os.listdir(staging):
+                        os.replace(os.path.join(staging, name), os.path.join(entry, name))
+                meta = {
+                    "video": os.path.basename(video_path),
+                    "sha256": file_hash(video_path),
+                    "stage": stage,
+                    "params": params,
+                    "artifacts": [os.path.basename(artifact) for artifact in artifacts],
+                    "created": time.time(),
+                }
+                temp_meta = os.path.join(entry, META_FILE + ".tmp")
+                with open(temp_meta, "w") as f:
+                    json.dump(meta, f, indent=4, default=str)
+                os.replace(temp_meta, os.path.join(entry, META_FILE))
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    if staging is not None and staging != os.path.abspath(entry):
+        shutil.rmtree(staging, ignore_errors=True)
+    return final
+
+
+def discard(staging_dirs):
+    """Remove the staging directories of misses that were never committed (failed or cancelled stages)."""
+    for staging in staging_dirs:
+        shutil.rmtree(staging, ignore_errors=True)
@@ -4,18 +4,220 @@ import os
 from insightface.app import FaceAnalysis
 import csv
 from collections import defaultdict, deque
-from multiprocessing import Pool, cpu_count
+from pose.video_io import plan_chunks, open_at
+from pose.proxy import analysis_input
+from pose.workers import THREADS_PER_WORKER, get_pool, limit_threads
+from pose import progress
+
+FACE_MODULES = ["detection", "landmark_2d_106"]
+FACE_DET_SIZE = (640, 640)
+# every FACE_FRAME_STEP-th frame (frame number % step == 0) is analysed
+FACE_FRAME_STEP = 5
+# show the analysed frames in an OpenCV window (needs a display; never on the servers)
+FACE_DEBUG = False
+
+# Adaptive detection: once a face is found, the detector only looks at a region of
+# FACE_ROI_MARGIN face sizes around it, at an input size that keeps the face about
+# FACE_ROI_FACE_PX wide. Landmarks always run on the full frame. The full frame is
+# searched again when the face is lost and every FACE_FULL_FRAME_EVERY samples.
+FACE_ADAPTIVE = False
+FACE_ROI_MARGIN = 3.0
+FACE_ROI_FACE_PX = 96
+FACE_MIN_DET_SIZE = 160
+FACE_FULL_FRAME_EVERY = 10
+
+# bump when the face CSV layout changes (part of the analysis cache key, see face_params)
+FACE_OUTPUT_VERSION = 3
+# face CSV layout: one row per sampled frame, eye end points as plain integer columns
+FACE_CSV_HEADERS = ["frame", "x", "y", "w", "h", "eye1_x", "eye1_y", "eye2_x", "eye2_y"]
+
+def face_params(input_key):
+    """
+    Cache key of the face stage: everything that changes its output, plus what it
+    decodes (key of proxy.analysis_input). Built from the module settings at call
+    time, so switching e.g. FACE_ADAPTIVE at runtime changes the key too.
+    """
+    return {
+        "modules": FACE_MODULES,
+        "det_size": FACE_DET_SIZE,
+        "frame_step": FACE_FRAME_STEP,
+        "adaptive": (FACE_ROI_MARGIN, FACE_ROI_FACE_PX, FACE_MIN_DET_SIZE, FACE_FULL_FRAME_EVERY) if FACE_ADAPTIVE else None,
+        "version": FACE_OUTPUT_VERSION,
+        "input": input_key,
+    }
+
+
+def limit_session_threads(app, num_threads):
+    # FaceAnalysis does not forward session options, so rebuild each model's session
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    for model in app.models.values():
+        model.session = onnxruntime.InferenceSession(
+            model.model_file, sess_options=options, providers=model.session.get_providers()
+        )
 
-def initialize_face_analysis():
-    app = FaceAnalysis(allowed_modules=["detection", "landmark_2d_106"], providers=["CUDAExecutionProvider"])
-    app.prepare(ctx_id=0, det_size=(640, 640))
+def initialize_face_analysis(num_threads=None):
+    app = FaceAnalysis(allowed_modules=FACE_MODULES, providers=["CUDAExecutionProvider"])
+    if num_threads:
+        limit_session_threads(app, num_threads)
+    app.prepare(ctx_id=0, det_size=FACE_DET_SIZE)
     return app
 
-def process_video_frames(video_path):
-    if not os.path.exists(video_path):
-        raise FileNotFoundError(f"No file found at {video_path}")
+# FaceAnalysis of the current worker process, loaded once by init_face_worker
+_app = None
+
+def init_face_worker(num_threads=THREADS_PER_WORKER, progress_queue=None):
+    global _app
+    limit_threads(num_threads)
+    progress.attach(progress_queue)
+    _app = initialize_face_analysis(num_threads)
+
+def get_face_analysis():
+    global _app
+    if _app is None:
+        _app = initialize_face_analysis()
+    return _app
+
+def face_guide_area(width, height):
+    # faces whose center lies inside this area are preferred, closest to its center first
+    line1_x = int(width * 0.35)
+    line2_x = int(width * 0.65)
+    line1_y = int(height * 0.25)
+    line2_y = int(height * 0.6)
+    return line1_x, line2_x, line1_y, line2_y
 
-    cap = cv2.VideoCapture(video_path)
+def select_face(faces, guide_area):
+    line1_x, line2_x, line1_y, line2_y = guide_area
+    target_x = (line1_x + line2_x) // 2
+    target_y = (line1_y + line2_y) // 2
+
+    best_face = None
+    largest_face = None
+    largest_face_size = 0  # To track the largest face size
+
+    for face in faces:
+        bbox = face["bbox"].astype(int)
+        face_size = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+        # Update largest face if this face is bigger
+        if face_size > largest_face_size:
+            largest_face_size = face_size
+            largest_face = face
+
+        face_center_x = bbox[0] + (bbox[2] - bbox[0]) // 2
+        face_center_y = bbox[1] + (bbox[3] - bbox[1]) // 2
+
+        if (
+            line1_x <= face_center_x <= line2_x
+            and line1_y <= face_center_y <= line2_y
+        ):
+            distance = abs(face_center_x - target_x) + abs(face_center_y - target_y)
+            if best_face is None or distance < best_face[1]:
+                best_face = (face, distance)
+
+    if best_face is None and largest_face is not None:
+        best_face = (
+            largest_face,
+            0,
+        )  # Use the largest face if no face found in area
+
+    return best_face[0] if best_face else None
+
+def detect_faces(app, frame, region=None, det_size=None):
+    """
+    app.get(frame), with the detector run on region (x0, y0, x1, y1) of the frame at
+    det_size. Boxes and keypoints are moved back to frame coordinates before the
+    landmark models run, so landmarks come from the full resolution frame.
+    """
+    from insightface.app.common import Face
+
+    x0, y0 = 0, 0
+    image = frame
+    if region is not None:
+        x0, y0, x1, y1 = region
+        image = frame[y0:y1, x0:x1]
+
+    bboxes, kpss = app.det_model.detect(image, input_size=det_size, max_num=0, metric="default")
+    faces = []
+    for i in range(bboxes.shape[0]):
+        bbox = bboxes[i, 0:4] + np.array([x0, y0, x0, y0], dtype=bboxes.dtype)
+        kps = kpss[i] + np.array([x0, y0], dtype=kpss.dtype) if kpss is not None else None
+        face = Face(bbox=bbox, kps=kps, det_score=bboxes[i, 4])
+        for taskname, model in app.models.items():
+            if taskname == "detection":
+                continue
+            model.get(frame, face)
+        faces.append(face)
+    return faces
+
+def adaptive_region(bbox, width, height):
+    """Detection region and input size around the face box of the previous sample."""
+    face_side = max(bbox[2] - bbox[0], bbox[3] - bbox[1], 1)
+    side = int(face_side * FACE_ROI_MARGIN)
+    center_x = (bbox[0] + bbox[2]) / 2
+    center_y = (bbox[1] + bbox[3]) / 2
+    x0 = int(max(0, center_x - side / 2))
+    y0 = int(max(0, center_y - side / 2))
+    x1 = int(min(width, center_x + side / 2))
+    y1 = int(min(height, center_y + side / 2))
+
+    # input size at which the face is FACE_ROI_FACE_PX wide, never above the region's own
+    # resolution or the full-frame size; the detector wants multiples of 32
+    region_side = max(x1 - x0, y1 - y0)
+    size = min(region_side, FACE_ROI_FACE_PX * region_side / face_side, FACE_DET_SIZE[0])
+    size = int(np.ceil(max(size, FACE_MIN_DET_SIZE) / 32) * 32)
+    return (x0, y0, x1, y1), (size, size)
+
+def draw_debug_frame(frame, guide_area, face):
+    # visual debugging only: guide lines, the selected face and its 106 landmarks
+    line1_x, line2_x, line1_y, line2_y = guide_area
+    height, width = frame.shape[:2]
+    display_frame = frame.copy()
+
+    cv2.line(display_frame, (line1_x, 0), (line1_x, height), (255, 255, 0), 2)
+    cv2.line(display_frame, (line2_x, 0), (line2_x, height), (255, 255, 0), 2)
+    cv2.line(display_frame, (0, line1_y), (width, line1_y), (255, 255, 0), 2)
+    cv2.line(display_frame, (0, line2_y), (width, line2_y), (255, 255, 0), 2)
+
+    if face is not None:
+        bbox = face["bbox"].astype(int)
+        cv2.rectangle(
+            display_frame,
+            (bbox[0], bbox[1]),
+            (bbox[2], bbox[3]),
+            (0, 255, 0),
+            2,
+        )
+        if "landmark_2d_106" in face:
+            lmk = np.round(face["landmark_2d_106"]).astype(np.int64)
+            for point in lmk:
+                cv2.circle(
+                    display_frame, tuple(point), 2, (0, 0, 255), -1, cv2.LINE_AA
+                )
+    return display_frame
+
+def process_video_frames(video_path, start_frame=0, end_frame=None, debug=FACE_DEBUG, frame_step=FACE_FRAME_STEP, adaptive=FACE_ADAPTIVE,
+                         decode_path=None, scale=None):
+    """
+    Face analysis of the frames of video_path in [start_frame, end_frame) whose frame
+    number is a multiple of frame_step. Only those frames are retrieved; the others
+    are grabbed (demuxed and decoded) without conversion or copy.
+
+    adaptive=True runs the detector on a region around the previous face (see
+    FACE_ADAPTIVE) instead of on the whole frame.
+
+    The default path is headless: no GUI calls and no per-frame copy or drawing.
+    debug=True shows the frames with the guide area and the selected face in a window.
+
+    decode_path: file actually decoded (the proxy); scale (sx, sy) maps its pixel
+    coordinates back to video_path, so boxes and eye points are in source pixels.
+    """
+    decode_path = decode_path or video_path
+    if not os.path.exists(decode_path):
+        raise FileNotFoundError(f"No file found at {decode_path}")
+
+    cap = open_at(decode_path, start_frame)
     if not cap.isOpened():
         raise Exception("Failed to open video file.")
 
@@ -24,98 +226,60 @@ def process_video_frames(video_path):
     fps = cap.get(cv2.CAP_PROP_FPS)
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     duration = total_frames / fps if fps else 0
+    if end_frame is None:
+        end_frame = total_frames
+    reporter = progress.Reporter("face", video_path, end_frame - start_frame, start_frame)
 
-    app = initialize_face_analysis()
+    app = get_face_analysis()
 
     window_name = "Video"
-    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    if debug:
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
 
-    line1_x = int(width * 0.35)
-    line2_x = int(width * 0.65)
-    line1_y = int(height * 0.25)
-    line2_y = int(height * 0.6)
-    target_x = (line1_x + line2_x) // 2
-    target_y = (line1_y + line2_y) // 2
+    guide_area = face_guide_area(width, height)
 
-    frame_count = 0
+    # frame_number is the global frame number, so a chunk samples the same frames as a full run
+    frame_number = start_frame
+    frame_numbers = []
     face_positions = []
-    face_recognitions = []
     eye_endpoint = []
+    # adaptive mode: face box of the previous sample and samples since the last full-frame pass
+    last_bbox = None
+    since_full_frame = 0
+
+    while frame_number < end_frame:
+        if frame_number % frame_step != 0:
+            if not cap.grab():
+                break
+            frame_number += 1
+            reporter.update(frame_number - start_frame)
+            continue
 
-    while frame_count < total_frames:
         ret, frame = cap.read()
         if not ret:
             break
 
-        frame_count += 1
-        if frame_count % 5 != 0:
-            continue
-        display_frame = frame.copy()
-
-        cv2.line(display_frame, (line1_x, 0), (line1_x, height), (255, 255, 0), 2)
-        cv2.line(display_frame, (line2_x, 0), (line2_x, height), (255, 255, 0), 2)
-        cv2.line(display_frame, (0, line1_y), (width, line1_y), (255, 255, 0), 2)
-        cv2.line(display_frame, (0, line2_y), (width, line2_y), (255, 255, 0), 2)
-
-        best_face = None
-        largest_face = None
-        largest_face_size = 0  # To track the largest face size
-
-        faces = app.get(frame)
-        for face in faces:
-            bbox = face["bbox"].astype(int)
-            face_size = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
-            # Update largest face if this face is bigger
-            if face_size > largest_face_size:
-                largest_face_size = face_size
-                largest_face = face
-
-            face_center_x = bbox[0] + (bbox[2] - bbox[0]) // 2
-            face_center_y = bbox[1] + (bbox[3] - bbox[1]) // 2
-
-            if (
-                line1_x <= face_center_x <= line2_x
-                and line1_y <= face_center_y <= line2_y
-            ):
-                distance = abs(face_center_x - target_x) + abs(face_center_y - target_y)
-                if best_face is None or distance < best_face[1]:
-                    best_face = (face, distance)
-
-        if best_face is None and largest_face is not None:
-            best_face = (
-                largest_face,
-                0,
-            )  # Use the largest face if no face found in area
-
-        if best_face:
-            face = best_face[0]
-            bbox = face["bbox"].astype(int)
-            cv2.rectangle(
-                display_frame,
-                (bbox[0], bbox[1]),
-                (bbox[2], bbox[3]),
-                (0, 255, 0),
-                2,
-            )
-            if "landmark_2d_106" in face:
-                lmk = face["landmark_2d_106"]
-                lmk = np.round(lmk).astype(np.int64)
-                for point in lmk:
-                    cv2.circle(
-                        display_frame, tuple(point), 2, (0, 0, 255), -1, cv2.LINE_AA
-                    )
-                current_frame_positions = [
-                    (bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1])
-                ]
-                current_frame_face_data = [lmk.tolist()]
-                eye_point1 = tuple(lmk[35])
-                eye_point2 = tuple(lmk[93])
-                current_frame_eye_data = [(eye_point1, eye_point2)]
-
-                face_positions.append(current_frame_positions)
-                eye_endpoint.append(current_frame_eye_data)
-                face_recognitions.append(current_frame_face_data)
-
+        face = None
+        if adaptive and last_bbox is not None and since_full_frame < FACE_FULL_FRAME_EVERY:
+            region, det_size = adaptive_region(last_bbox, width, height)
+            face = select_face(detect_faces(app, frame, region, det_size), guide_area)
+            since_full_frame += 1
+        if face is None:
+            face = select_face(app.get(frame), guide_area)
+            since_full_frame = 0
+        last_bbox = face["bbox"] if face is not None else None
+
+        frame_numbers.append(frame_number)
+        if face is not None and "landmark_2d_106" in face:
+            bbox = face["bbox"]
+            lmk = face["landmark_2d_106"]
+            if scale is not None:
+                bbox = bbox * (scale[0], scale[1], scale[0], scale[1])
+                lmk = lmk * scale
+            bbox = bbox.astype(int)
+            lmk = np.round(lmk).astype(np.int64)
+            face_positions.append([(bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1])])
+            eye_endpoint.append([(tuple(lmk[35]), tuple(lmk[93]))])
         else:
             # Append zeros if no face is detected
             # Ensure that the structure matches the expected unpacking structure in CSV writing.
@@ -123,36 +287,78 @@ def process_video_frames(video_path):
                 [(0, 0, 0, 0)]
             )  # Enclose in an additional list to match structure
             eye_endpoint.append([((0, 0), (0, 0))])  # Use tuple of tuples
-            face_recognitions.append([[]])  # This already matches expected structure
 
-        cv2.imshow(window_name, display_frame)
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            break
+        if debug:
+            cv2.imshow(window_name, draw_debug_frame(frame, guide_area, face))
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
 
-    cap.release()
-    cv2.destroyAllWindows()
-    return video_path, duration, face_positions, eye_endpoint
+        frame_number += 1
+        reporter.update(frame_number - start_frame)
 
-def save_results_to_csv(results):
-    for result in results:
-        video_path, duration, face_positions, eye_endpoint = result
-        base_name = os.path.splitext(os.path.basename(video_path))[0]
-        output_csv = f"output_{base_name}.csv"
+    reporter.update(frame_number - start_frame, force=True)
+    cap.release()
+    if debug:
+        cv2.destroyAllWindows()
+    return video_path, duration, face_positions, eye_endpoint, frame_numbers
+
+def face_csv_path(video_path, output_dir=""):
+    base_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_dir, f"output_{base_name}.csv")
+
+def save_results_to_csv(results, output_dirs=None):
+    if output_dirs is None:
+        output_dirs = [""] * len(results)
+    output_csvs = []
+    for result, output_dir in zip(results, output_dirs):
+        video_path, duration, face_positions, eye_endpoint, frame_numbers = result
+        output_csv = face_csv_path(video_path, output_dir)
 
         with open(output_csv, "w", newline="") as csvfile:
             csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(["frame", "x", "y", "w", "h", "eye_point1", "eye_point2"])
-            for i, (positions, eye_points) in enumerate(zip(face_positions, eye_endpoint)):
+            csvwriter.writerow(FACE_CSV_HEADERS)
+            for frame_number, positions, eye_points in zip(frame_numbers, face_positions, eye_endpoint):
                 for position, eye_point in zip(positions, eye_points):
                     x, y, w, h = position  # Unpack position
-                    eye_point1, eye_point2 = eye_point  # Unpack eye points
-                    csvwriter.writerow([i * 5, x, y, w, h, eye_point1, eye_point2])
-
-def process_video_multiprocessing(video_files):
-    with Pool(cpu_count()) as pool:
-        results = pool.map(process_video_frames, video_files)
-    save_results_to_csv(results)
-    return results
+                    (eye1_x, eye1_y), (eye2_x, eye2_y) = eye_point  # Unpack eye points
+                    csvwriter.writerow([frame_number, x, y, w, h, eye1_x, eye1_y, eye2_x, eye2_y])
+        output_csvs.append(output_csv)
+    return output_csvs
+
+def submit_video(video_file, chunk_frames=None, frame_step=None, analysis=None):
+    """
+    Queue the face analysis of one video on the face worker pool; returns its futures.
+    analysis: proxy.analysis_input of the video if already resolved.
+    """
+    # read when called, like face_params, so the output always matches the cache key
+    if frame_step is None:
+        frame_step = FACE_FRAME_STEP
+    pool = get_pool("face", init_face_worker, (THREADS_PER_WORKER, progress.get_queue()))
+    decode_path, scale, _ = analysis or analysis_input(video_file)
+    ranges = plan_chunks(decode_path, chunk_frames) if chunk_frames else [(0, None)]
+    return [pool.submit(process_video_frames, video_file, start, end, FACE_DEBUG, frame_step, FACE_ADAPTIVE, decode_path, scale)
+            for start, end in ranges]
+
+def collect_video(video_file, futures, output_dir="", name=None):
+    """
+    Wait for the futures of submit_video, stitch the chunks in order and save the
+    face CSV (named after name, default the video's file name).
+    """
+    chunks = [future.result() for future in futures]
+    face_positions = [position for chunk in chunks for position in chunk[2]]
+    eye_endpoint = [eye for chunk in chunks for eye in chunk[3]]
+    frame_numbers = [frame_number for chunk in chunks for frame_number in chunk[4]]
+    return save_results_to_csv([(name or video_file, chunks[0][1], face_positions, eye_endpoint, frame_numbers)], [output_dir])[0]
+
+def process_video_multiprocessing(video_files, output_dirs=None, chunk_frames=None):
+    if output_dirs is None:
+        output_dirs = [""] * len(video_files)
+    # frame ranges of one video run on separate workers; sampled frames are stitched in order
+    futures = [submit_video(video_file, chunk_frames) for video_file in video_files]
+    return {
+        video_file: collect_video(video_file, video_futures, output_dir)
+        for video_file, output_dir, video_futures in zip(video_files, output_dirs, futures)
+    }
 
 def intersection_over_union(x1, y1, w1, h1, x2, y2, w2, h2):
     x1_max = x1 + w1
@@ -180,119 +386,109 @@ def intersection_over_union(x1, y1, w1, h1, x2, y2, w2, h2):
     return iou
 
 def load_csv_data(file_path):
-    face_positions = []
-    eye_endpoints = []
+    """
+    Face CSV as NumPy arrays: frame numbers (F,), boxes (F, 4) x, y, w, h and eye
+    end points (F, 4) eye1_x, eye1_y, eye2_x, eye2_y. Reads the older layout with
+    "(x, y)" eye columns as well.
+    """
     with open(file_path, "r") as csvfile:
-        csvreader = csv.reader(csvfile)
-        next(csvreader)  # Skip header
-        for row in csvreader:
-            video_path, duration, frame, x, y, w, h, eye_point1, eye_point2 = row
-            face_positions.append([(int(x), int(y), int(w), int(h))])
-            eye_endpoints.append(
-                [
-                    (
-                        (
-                            int(eye_point1[1:-1].split(", ")[0]),
-                            int(eye_point1[1:-1].split(", ")[1]),
-                        ),
-                        (
-                            int(eye_point2[1:-1].split(", ")[0]),
-                            int(eye_point2[1:-1].split(", ")[1]),
-                        ),
-                    )
-                ]
-            )
-    return face_positions, eye_endpoints
+        header = csvfile.readline().strip().split(",")
+        if header == FACE_CSV_HEADERS:
+            data = np.loadtxt(csvfile, delimiter=",", dtype=np.int64, ndmin=2).reshape(-1, len(FACE_CSV_HEADERS))
+        else:
+            data = np.array(
+                [[int(value.strip("() ")) for value in ",".join(row).split(",")] for row in csv.reader(csvfile)],
+                dtype=np.int64,
+            ).reshape(-1, len(FACE_CSV_HEADERS))
+    return data[:, 0], data[:, 1:5], data[:, 5:9]
+
+def load_face_data(face_data):
+    """(frames, boxes, eyes) of a face CSV path, or face_data itself if already loaded."""
+    if isinstance(face_data, (str, os.PathLike)):
+        return load_csv_data(face_data)
+    frames, boxes, eyes = face_data
+    return np.asarray(frames, dtype=np.int64), np.asarray(boxes, dtype=np.int64), np.asarray(eyes, dtype=np.int64)
+
+def face_pair_matrices(boxes, max_area_ratio=1.5):
+    """
+    Pairwise comparison of the face boxes of all streams, for every sampled frame.
+
+    boxes: (streams, frames, 4) x, y, w, h. Returns two (frames, streams, streams)
+    arrays: comparable (the area ratio is at most max_area_ratio, or one of the
+    boxes is empty) and the IoU of every box pair.
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).transpose(1, 0, 2)
+    x, y, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    area = w * h
+
+    inter_w = np.maximum(0, np.minimum((x + w)[:, :, None], (x + w)[:, None, :]) - np.maximum(x[:, :, None], x[:, None, :]))
+    inter_h = np.maximum(0, np.minimum((y + h)[:, :, None], (y + h)[:, None, :]) - np.maximum(y[:, :, None], y[:, None, :]))
+    inter_area = inter_w * inter_h
+    union_area = area[:, :, None] + area[:, None, :] - inter_area
+    iou = np.divide(inter_area, union_area, out=np.zeros(union_area.shape), where=union_area != 0)
 
-def find_matching_faces(csv_files, THRESHOLD = 0.6):
-    all_face_positions = []
-    all_eye_endpoints = []
-    for csv_file in csv_files:
-        face_positions, eye_endpoints = load_csv_data(csv_file)
-        all_face_positions.append(face_positions)
-        all_eye_endpoints.append(eye_endpoints)
+    area1 = area[:, :, None]
+    area2 = area[:, None, :]
+    both = (area1 > 0) & (area2 > 0)
+    larger = np.maximum(area1, area2)
+    smaller = np.where(both, np.minimum(area1, area2), 1)
+    comparable = ~both | (larger / smaller <= max_area_ratio)
+    return comparable, iou
 
-    matched_faces = []
-    min_length = min(len(positions) for positions in all_face_positions)
-    last_matched_index = 0  # Track the last matched file index
+def find_matching_faces(csv_files, THRESHOLD = 0.6):
+    """
+    csv_files: face CSV paths or (frames, boxes, eyes) arrays as returned by
+    load_csv_data, one per stream.
 
-    for frame_index in range(min_length):
-        frame_faces = [
-            face_positions[frame_index] for face_positions in all_face_positions
-        ]
-        frame_eyes = [eye_endpoints[frame_index] for eye_endpoints in all_eye_endpoints]
+    Frames in which the selected faces of two streams overlap, as
+    [(frame, stream1, stream2, iou, eye_vector1, eye_vector2), ...].
 
-        if not all(frame_eyes):
-            continue  # Skip frames without valid eye endpoint data
+    Streams are visited starting at the stream of the last match. Every stream is
+    compared with the next stream (in that order) whose face has a similar size,
+    and the pair matches when their IoU is above THRESHOLD.
+    """
+    streams = [load_face_data(face_data) for face_data in csv_files]
 
-        current_frame = frame_index * 5
+    num_streams = len(streams)
+    min_length = min(len(frames) for frames, _, _ in streams)
+    frame_numbers = streams[0][0]
+    boxes = np.stack([stream_boxes[:min_length] for _, stream_boxes, _ in streams])
+    eyes = np.stack([stream_eyes[:min_length] for _, _, stream_eyes in streams])
 
-        # Re-arrange faces to start matching from the last matched index
-        arranged_faces = (
-            frame_faces[last_matched_index:] + frame_faces[:last_matched_index]
-        )
-        arranged_eyes = (
-            frame_eyes[last_matched_index:] + frame_eyes[:last_matched_index]
-        )
+    comparable, iou = face_pair_matrices(boxes)
+    # only frames where some comparable pair overlaps enough can produce a match
+    candidate_frames = np.flatnonzero((comparable & (iou > THRESHOLD)).any(axis=(1, 2)))
 
-        face_pairs = []
-        for i, faces in enumerate(arranged_faces):
-            adjusted_index = (last_matched_index + i) % len(csv_files)
-            for face in faces:
-                face_pairs.append((adjusted_index, face))
-
-        face_pairs_count = len(face_pairs)
-        for i in range(face_pairs_count):
-            for j in range(i + 1, face_pairs_count):
-                index1, face1 = face_pairs[i]
-                index2, face2 = face_pairs[j]
-
-                eye1 = arranged_eyes[index1 - last_matched_index][0]
-                eye2 = arranged_eyes[index2 - last_matched_index][0]
-
-                # Check if the faces or eyes are zero (no detection)
-                if (
-                    face1 == [(0, 0, 0, 0)]
-                    or face2 == [(0, 0, 0, 0)]
-                    or eye1 == [((0, 0), (0, 0))]
-                    or eye2 == [((0, 0), (0, 0))]
-                ):
-                    continue  # Skip processing for zero data
-
-                if eye1 and eye2:
-                    x1, y1, w1, h1 = face1
-                    x2, y2, w2, h2 = face2
-
-                    area1 = w1 * h1
-                    area2 = w2 * h2
-
-                    if area1 > 0 and area2 > 0:
-                        area_ratio = max(area1, area2) / min(area1, area2)
-                        if area_ratio > 1.5:
-                            continue  # Skip this frame if area size difference is more than 1.5
-
-                    iou_score = intersection_over_union(x1, y1, w1, h1, x2, y2, w2, h2)
-                    if iou_score > THRESHOLD:
-                        eye1_vector = [eye1[0][0], eye1[0][1], eye1[1][0], eye1[1][1]]
-                        eye2_vector = [eye2[0][0], eye2[0][1], eye2[1][0], eye2[1][1]]
-                        matched_faces.append(
-                            (
-                                current_frame,
-                                index1,
-                                index2,
-                                iou_score,
-                                eye1_vector,
-                                eye2_vector,
-                            )
-                        )
-                        last_matched_index = index2  # Update last matched index
-                        print(
-                            f"Matched Face at Frame {current_frame}: IOU {iou_score:.2f}"
-                        )
-                        break  # Exit loop once a match is found in this frame
-                else:
-                    continue
-                break
+    matched_faces = []
+    last_matched_index = 0  # Track the last matched file index
+    for frame_index in candidate_frames:
+        current_frame = int(frame_numbers[frame_index])
+        frame_comparable = comparable[frame_index]
+        frame_iou = iou[frame_index]
+
+        # Re-arrange streams to start matching from the last matched index
+        order = [(last_matched_index + i) % num_streams for i in range(num_streams)]
+        for i, index1 in enumerate(order):
+            # the first later stream whose face size is comparable is the only one checked
+            index2 = next((index for index in order[i + 1:] if frame_comparable[index1, index]), None)
+            if index2 is None:
+                continue
+            iou_score = float(frame_iou[index1, index2])
+            if iou_score > THRESHOLD:
+                matched_faces.append(
+                    (
+                        current_frame,
+                        index1,
+                        index2,
+                        iou_score,
+                        eyes[index1, frame_index].tolist(),
+                        eyes[index2, frame_index].tolist(),
+                    )
+                )
+                last_matched_index = index2  # Update last matched index
+                print(
+                    f"Matched Face at Frame {current_frame}: IOU {iou_score:.2f}"
+                )
 
     return matched_faces
 
@@ -321,61 +517,3 @@ def save_verified_matches(verified_matches, filename="verified_matches.csv"):
         writer.writerow(["검증된 매칭 결과:"])
         for match in verified_matches:
             writer.writerow(match)
-
-
-def frame_difference_detection(
-    video_path, threshold=20, resize_factor=1, aggregation_window=18
-):
-    frame_list = []
-    cap = cv2.VideoCapture(video_path)
-    transition_count = 0
-    total_frames = 0
-    added_frames = 0  # To keep track of how many times we've added an extra frame
-
-    ret, frame1 = cap.read()
-    if not ret:
-        print("Error: Failed to read video file.")
-        return 0
-
-    # Resize frame to speed up processing
-    frame1 = cv2.resize(frame1, (0, 0), fx=resize_factor, fy=resize_factor)
-    prev_gray = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-    last_cut_frame = (
-        -aggregation_window
-    )  # Initialize to a value outside possible frame index
-
-    while True:
-        ret, frame2 = cap.read()
-        if not ret:
-            break
-
-        frame2 = cv2.resize(frame2, (0, 0), fx=resize_factor, fy=resize_factor)
-        total_frames += 1
-        gray = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-
-        # Compute the absolute difference between the current frame and the previous frame
-        frame_diff = cv2.absdiff(prev_gray, gray)
-        mean_diff = np.mean(frame_diff)
-
-        # Correct frame count at every 1000th frame
-        if total_frames % 1000 == 0 and total_frames // 1000 > added_frames:
-            total_frames += 1
-            added_frames += 1  # Update the counter for added frames
-
-        # If the average intensity difference exceeds the threshold, it's likely a cut
-        if mean_diff > threshold:
-            # Aggregate close detections as a single cut
-            if total_frames - last_cut_frame > aggregation_window:
-                transition_count += 1
-                last_cut_frame = total_frames
-
-                # print(
-                #     f"Cut detected at frame {total_frames} with average frame difference {mean_diff}"
-                # )
-
-                frame_list.append(total_frames)
-                print((total_frames) * (1 / 29.97))
-        prev_gray = gray
-
-    cap.release()
-    return frame_list
@@ -0,0 +1,116 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+NUM_KEYPOINTS = 16
+KEYPOINT_SUFFIX = "_keypoints.npy"
+FRAME_INDEX_SUFFIX = "_frames.npy"
+
+CSV_HEADERS = [
+    'frame_number',
+    'face_x0', 'face_y0', 'face_conf0', 'face_x1', 'face_y1', 'face_conf1', 'face_x2', 'face_y2', 'face_conf2', 'face_x3', 'face_y3', 'face_conf3', 'face_x4', 'face_y4', 'face_conf4',
+    'body_x5', 'body_y5', 'body_conf5', 'body_x6', 'body_y6', 'body_conf6', 'body_x7', 'body_y7', 'body_conf7', 'body_x8', 'body_y8', 'body_conf8', 'body_x9', 'body_y9', 'body_conf9',
+    'body_x10', 'body_y10', 'body_conf10', 'body_x11', 'body_y11', 'body_conf11',
+    'leg_x12', 'leg_y12', 'leg_conf12', 'leg_x13', 'leg_y13', 'leg_conf13', 'leg_x14', 'leg_y14', 'leg_conf14', 'leg_x15', 'leg_y15', 'leg_conf15'
+]
+
+# On-disk layout of one video's keypoints:
+#   <name>_keypoints.npy  float32 (rows, 16, 3) x / y / conf, rows sorted by frame
+#   <name>_frames.npy     int64 (frames, 2) frame_number / first row of that frame
+# The keypoint block is memory-mapped by every consumer.
+
+
+def keypoint_store_path(video_path, output_dir=""):
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_dir, f"{video_name}{KEYPOINT_SUFFIX}")
+
+
+def frame_index_path(path):
+    return path[:-len(KEYPOINT_SUFFIX)] + FRAME_INDEX_SUFFIX
+
+
+def is_keypoint_store(path):
+    return path.endswith(KEYPOINT_SUFFIX)
+
+
+def build_frame_index(frames):
+    """
+    Group the rows of one keypoint table by frame number in a single pass.
+
+    Returns (order, frame_numbers, offsets): rows order[offsets[k]:offsets[k + 1]] belong
+    to frame_numbers[k], in their original file order.
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    order = np.argsort(frames, kind='stable')
+    frame_numbers, starts = np.unique(frames[order], return_index=True)
+    offsets = np.append(starts, len(frames)).astype(np.int64)
+    return order, frame_numbers, offsets
+
+
+def save_keypoints(path, frame_data):
+    """
+    Write (frame_number, (persons, 16, 3) keypoints) tuples, given in frame order.
+
+    Frames without any person are kept in the frame table with an empty row range.
+    """
+    frame_index = np.zeros((len(frame_data), 2), dtype=np.int64)
+    blocks = []
+    offset = 0
+    for k, (frame_number, keypoints) in enumerate(frame_data):
+        block = np.asarray(keypoints, dtype=np.float32).reshape(-1, NUM_KEYPOINTS, 3)
+        frame_index[k] = (frame_number, offset)
+        blocks.append(block)
+        offset += len(block)
+
+    keypoints = np.concatenate(blocks) if blocks else np.zeros((0, NUM_KEYPOINTS, 3), dtype=np.float32)
+    np.save(path, keypoints)
+    np.save(frame_index_path(path), frame_index)
+    return path
+
+
+def load_keypoints(path, mmap=True):
+    """
+    Open a keypoint store. Returns (frame_numbers, offsets, keypoints) where
+    keypoints[offsets[k]:offsets[k + 1]] are the persons of frame_numbers[k].
+    """
+    keypoints = np.load(path, mmap_mode="r" if mmap else None)
+    frame_index = np.load(frame_index_path(path))
+    offsets = np.append(frame_index[:, 1], len(keypoints)).astype(np.int64)
+    return frame_index[:, 0], offsets, keypoints
+
+
+def load_keypoint_table(path):
+    """
+    Same as load_keypoints, but also accepts a debug CSV export (or a legacy
+    <video>.csv from the YOLO stage), which is parsed and grouped by frame.
+    """
+    if is_keypoint_store(path):
+        return load_keypoints(path)
+
+    data = pd.read_csv(path)
+    values = np.zeros((len(data), NUM_KEYPOINTS * 3), dtype=np.float32)
+    columns = data.iloc[:, 1:1 + NUM_KEYPOINTS * 3].to_numpy(dtype=np.float32)
+    values[:, :columns.shape[1]] = columns
+    order, frame_numbers, offsets = build_frame_index(data.iloc[:, 0].to_numpy())
+    return frame_numbers, offsets, values.reshape(-1, NUM_KEYPOINTS, 3)[order]
+
+
+def person_counts(path):
+    frame_numbers, offsets, _ = load_keypoint_table(path)
+    return frame_numbers, np.diff(offsets)
+
+
+def export_csv(path, csv_path=None):
+    """Debug export of a keypoint store in the former 49 column CSV layout."""
+    if csv_path is None:
+        csv_path = path[:-len(KEYPOINT_SUFFIX)] + ".csv"
+
+    frame_numbers, offsets, keypoints = load_keypoints(path)
+    with open(csv_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_HEADERS)
+        for frame_number, start, end in zip(frame_numbers, offsets[:-1], offsets[1:]):
+            for person in keypoints[start:end]:
+                writer.writerow([int(frame_number)] + person.reshape(-1).tolist())
+    return csv_path
@@ -1,98 +1,217 @@
 import cv2
 from ultralytics import YOLO
-import csv
 import os
-from multiprocessing import Pool, cpu_count
+import numpy as np
+from pose.workers import THREADS_PER_WORKER, get_pool, limit_threads
+from pose.video_io import plan_chunks, open_at
+from pose.keypoint_store import NUM_KEYPOINTS, keypoint_store_path, save_keypoints, export_csv
+from pose import progress
+from pose.proxy import analysis_input
 
 fourcc = cv2.VideoWriter_fourcc(*'mp4v')
 
-def split_data(data):
-    faces = []
-    bodies = []
-    legs = []
-
-    for person in data:
-        face = person[:5].tolist()
-        body = person[5:12].tolist()
-        leg = person[12:16].tolist()
-
-        faces.append(face)
-        bodies.append(body)
-        legs.append(leg)
-
-    return faces, bodies, legs
-
-def save_to_csv(filename, frame_data):
-    headers = [
-        'frame_number',
-        'face_x0', 'face_y0', 'face_conf0', 'face_x1', 'face_y1', 'face_conf1', 'face_x2', 'face_y2', 'face_conf2', 'face_x3', 'face_y3', 'face_conf3', 'face_x4', 'face_y4', 'face_conf4',
-        'body_x5', 'body_y5', 'body_conf5', 'body_x6', 'body_y6', 'body_conf6', 'body_x7', 'body_y7', 'body_conf7', 'body_x8', 'body_y8', 'body_conf8', 'body_x9', 'body_y9', 'body_conf9',
-        'body_x10', 'body_y10', 'body_conf10', 'body_x11', 'body_y11', 'body_conf11',
-        'leg_x12', 'leg_y12', 'leg_conf12', 'leg_x13', 'leg_y13', 'leg_conf13', 'leg_x14', 'leg_y14', 'leg_conf14', 'leg_x15', 'leg_y15', 'leg_conf15'
-    ]
-
-    with open(filename, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(headers)
-        for frame_number, faces, bodies, legs in frame_data:
-            for face, body, leg in zip(faces, bodies, legs):
-                flattened_row = [frame_number] + [item for sublist in face + body + leg for item in sublist]
-                writer.writerow(flattened_row)
-
-def process_video(video_path):
-    model = YOLO("yolov8n-pose.pt")
-    cap = cv2.VideoCapture(video_path)
-
-    if not cap.isOpened():
-        # print(f"Error: Could not open video {video_path}.")
-        return None
-
+# also write the keypoints as <video>.csv (debugging only, nothing reads it)
+EXPORT_CSV = False
+
+POSE_MODEL = "yolov8n-pose.pt"
+POSE_CONF = 0.5
+# everything that changes the keypoint output; part of the analysis cache key (see pose_params)
+POSE_PARAMS = {"model": POSE_MODEL, "conf": POSE_CONF}
+# frames decoded and sent through the model at once
+POSE_BATCH_SIZE = 16
+
+# Annotated <video>_output.mp4 for eyeballing the detections (nothing downstream reads it):
+#   None       - no plotting / encoding at all (production)
+#   "full"     - every frame at source resolution
+#   "preview"  - every PREVIEW_STRIDE-th frame, downscaled to PREVIEW_WIDTH
+ANNOTATE_MODE = None
+PREVIEW_STRIDE = 10
+PREVIEW_WIDTH = 640
+
+# model of the current worker process, loaded once by init_pose_worker
+_model = None
+
+def pose_params(input_key):
+    """Cache key of the pose stage: POSE_PARAMS plus what it decodes (key of proxy.analysis_input)."""
+    return {**POSE_PARAMS, "input": input_key}
+
+
+def init_pose_worker(num_threads=THREADS_PER_WORKER, progress_queue=None):
+    global _model
+    import torch
+    limit_threads(num_threads)
+    progress.attach(progress_queue)
+    torch.set_num_threads(num_threads)
+    _model = YOLO(POSE_MODEL)
+
+def get_pose_model():
+    global _model
+    if _model is None:
+        _model = YOLO(POSE_MODEL)
+    return _model
+
+def open_annotated_writer(output_video_path, fps, frame_width, frame_height, annotate):
+    if annotate == "preview":
+        scale = min(1.0, PREVIEW_WIDTH / frame_width) if frame_width else 1.0
+        size = (int(frame_width * scale) // 2 * 2, int(frame_height * scale) // 2 * 2)
+        return cv2.VideoWriter(output_video_path, fourcc, max(fps / PREVIEW_STRIDE, 1), size), size, PREVIEW_STRIDE
+    return cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height)), None, 1
+
+def track_frames(cap, start_frame=0, end_frame=None, batch_size=POSE_BATCH_SIZE, out=None, preview_size=None, preview_stride=1, reporter=None):
+    """
+    Run the pose model over cap from start_frame up to (not including) end_frame.
+    Returns [(frame_number, (persons, 16, 3) keypoints), ...] in frame order.
+    reporter (progress.Reporter) gets the number of frames done after every batch.
+    """
+    model = get_pose_model()
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-
-    video_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_video_path = f"{video_name}_output.mp4"
-    output_csv_path = f"{video_name}.csv"
 
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (frame_width, frame_height))
-
-    frame_number = 0
+    frame_number = start_frame
     frame_data = []
 
-    while cap.isOpened():
-        success, frame = cap.read()
-        if success:
-            results = model.track(frame, conf=0.5,verbose=False)
+    # decoded frames of one batch; cap.read() writes into it in place
+    frame_buffer = np.empty((max(batch_size, 1), frame_height, frame_width, 3), dtype=np.uint8)
 
-            if results:
-                annotated_frame = results[0].plot()
-                data = results[0].keypoints.data
-                faces, bodies, legs = split_data(data)
+    while cap.isOpened():
+        batch_limit = len(frame_buffer)
+        if end_frame is not None:
+            batch_limit = min(batch_limit, end_frame - frame_number)
+        frames = []
+        while len(frames) < batch_limit:
+            success, frame = cap.read(frame_buffer[len(frames)])
+            if not success:
+                break
+            frames.append(frame)
+        if not frames:
+            break
 
-                frame_data.append((frame_number, faces, bodies, legs))
+        # Without persist the tracker is reset for every image of the batch, so each frame
+        # gets exactly the detections (and order) of a single-frame track() call.
+        results = model.track(frames, conf=POSE_CONF, verbose=False, batch=len(frames))
+
+        for result in results:
+            keypoints = result.keypoints
+            if keypoints is not None:
+                data = keypoints.data[:, :NUM_KEYPOINTS].cpu().numpy()
+            else:
+                data = np.zeros((0, NUM_KEYPOINTS, 3), dtype=np.float32)
+
+            frame_data.append((frame_number, data))
+            if out is not None and frame_number % preview_stride == 0:
+                annotated_frame = result.plot()
+                if preview_size is not None:
+                    annotated_frame = cv2.resize(annotated_frame, preview_size, interpolation=cv2.INTER_AREA)
                 out.write(annotated_frame)
                 # cv2.imshow("YOLOv8 Tracking", annotated_frame)
-            # else:
-                # print(f"Warning: No results found for frame {frame_number}.")
 
             frame_number += 1
 
-            # if cv2.waitKey(1) & 0xFF == ord("q"):
-            #     break
-        else:
+        if reporter is not None:
+            reporter.update(frame_number - start_frame)
+        if len(frames) < batch_limit:
             break
 
+    if reporter is not None:
+        reporter.update(frame_number - start_frame, force=True)
+    return frame_data
+
+def scale_keypoints(frame_data, scale):
+    """Keypoints detected on the proxy in source pixel coordinates (scale: (sx, sy) or None)."""
+    if scale is None:
+        return frame_data
+    factors = np.array([scale[0], scale[1], 1.0], dtype=np.float32)
+    return [(frame_number, keypoints * factors) for frame_number, keypoints in frame_data]
+
+def write_keypoints(video_path, output_dir, frame_data):
+    output_keypoint_path = keypoint_store_path(video_path, output_dir)
+    save_keypoints(output_keypoint_path, frame_data)
+    if EXPORT_CSV:
+        export_csv(output_keypoint_path)
+    return output_keypoint_path
+
+def process_video(video_path, output_dir="", batch_size=POSE_BATCH_SIZE, annotate=ANNOTATE_MODE, decode_path=None, scale=None, name=None):
+    """
+    Keypoints of video_path. decode_path: file actually decoded (the proxy), whose
+    coordinates scale maps back to video_path. name: stem of the keypoint store
+    (default: the video's file name).
+    """
+    cap = cv2.VideoCapture(decode_path or video_path)
+
+    if not cap.isOpened():
+        # print(f"Error: Could not open video {video_path}.")
+        return None
+
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    output_video_path = os.path.join(output_dir, f"{video_name}_output.mp4")
+
+    out, preview_size, preview_stride = None, None, 1
+    if annotate:
+        out, preview_size, preview_stride = open_annotated_writer(output_video_path, fps, frame_width, frame_height, annotate)
+
+    reporter = progress.Reporter("pose", video_path, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    frame_data = track_frames(cap, batch_size=batch_size, out=out, preview_size=preview_size, preview_stride=preview_stride,
+                              reporter=reporter)
+
     cap.release()
-    out.release()
+    if out is not None:
+        out.release()
     # cv2.destroyAllWindows()
 
-    save_to_csv(output_csv_path, frame_data)
-    # print(f"Processed {video_path} and saved to {output_csv_path} and {output_video_path}.")
+    # print(f"Processed {video_path} and saved to {output_keypoint_path} and {output_video_path}.")
+    return write_keypoints(name or video_path, output_dir, scale_keypoints(frame_data, scale))
 
-    return output_csv_path
-
-def process_videos(video_files):
-    with Pool(processes=cpu_count()) as pool:
-        csv_files = pool.map(process_video, video_files)
-    return {video_files[i]: csv_files[i] for i in range(len(video_files)) if csv_files[i] is not None}
+def process_video_chunk(video_path, start_frame, end_frame, batch_size=POSE_BATCH_SIZE, decode_path=None, scale=None):
+    cap = open_at(decode_path or video_path, start_frame)
+    if not cap.isOpened():
+        return None
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    reporter = progress.Reporter("pose", video_path, (end_frame if end_frame is not None else total_frames) - start_frame, start_frame)
+    frame_data = track_frames(cap, start_frame, end_frame, batch_size, reporter=reporter)
+    cap.release()
+    return scale_keypoints(frame_data, scale)
+
+def submit_video(video_file, output_dir="", chunk_frames=None, name=None, analysis=None):
+    """
+    Queue the pose analysis of one video on the pose worker pool; returns its futures.
+    analysis: proxy.analysis_input of the video if already resolved.
+    """
+    pool = get_pool("pose", init_pose_worker, (THREADS_PER_WORKER, progress.get_queue()))
+    decode_path, scale, _ = analysis or analysis_input(video_file)
+    if not chunk_frames:
+        return [pool.submit(process_video, video_file, output_dir, decode_path=decode_path, scale=scale, name=name)]
+    return [pool.submit(process_video_chunk, video_file, start, end, decode_path=decode_path, scale=scale)
+            for start, end in plan_chunks(decode_path, chunk_frames)]
+
+def collect_video(video_file, futures, output_dir="", chunk_frames=None, name=None):
+    """Wait for the futures of submit_video; returns the keypoint store path or None."""
+    results = [future.result() for future in futures]
+    if not chunk_frames:
+        return results[0]
+    if any(chunk is None for chunk in results):
+        return None
+    frame_data = [frame for chunk in results for frame in chunk]
+    return write_keypoints(name or video_file, output_dir, frame_data)
+
+def process_videos(video_files, output_dirs=None, chunk_frames=None):
+    """
+    YOLO keypoints of every video, {video: keypoint store path}.
+
+    With chunk_frames each video is split into keyframe aligned ranges of about that
+    many frames which run on separate workers and are stitched back in frame order.
+    The tracker is reset on every frame (see track_frames), so the per-frame output
+    does not depend on where a chunk starts and no track ids need reconciling.
+    """
+    if output_dirs is None:
+        output_dirs = [""] * len(video_files)
+    futures = [submit_video(video_file, output_dir, chunk_frames) for video_file, output_dir in zip(video_files, output_dirs)]
+    keypoint_files = {}
+    for video_file, output_dir, video_futures in zip(video_files, output_dirs, futures):
+        keypoint_file = collect_video(video_file, video_futures, output_dir, chunk_frames)
+        if keypoint_file is not None:
+            keypoint_files[video_file] = keypoint_file
+    return keypoint_files
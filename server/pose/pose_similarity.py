@@ -1,119 +1,206 @@
 import numpy as np
-from scipy.spatial.distance import euclidean, cosine
-from fastdtw import fastdtw
-import pandas as pd
 from tqdm import tqdm
+from pose.keypoint_store import NUM_KEYPOINTS, load_keypoint_table
+from pose.progress import Reporter
+
+# (first keypoint, keypoint count) of the face / body / leg groups
+KEYPOINT_GROUPS = ((0, 5), (5, 7), (12, 4))
+# keypoints 5 and 6 (shoulders) are used as the adjustment vector of a match
+VECTOR_KEYPOINTS = (5, 6)
+# number of frames compared per batch in calculate_similarities
+FRAME_BATCH_SIZE = 256
+DTW_RADIUS = 1
+
+
+def load_keypoint_array(tables):
+    """
+    Stack per-stream keypoint tables into one (stream, frame, person, 16, 2) array.
+
+    tables are (frame_numbers, offsets, keypoints) tuples as returned by
+    pose.keypoint_store.load_keypoint_table. Returns the NaN padded keypoint array,
+    the (stream, frame) person counts and the sorted frame numbers the frame axis
+    refers to. Persons keep their row order within a frame.
+    """
+    # frames without any detected person take no part in the comparison
+    tables = [(stream_frames[np.diff(offsets) > 0], offsets, keypoints)
+              for stream_frames, offsets, keypoints in tables]
+    frame_numbers = np.unique(np.concatenate([stream_frames for stream_frames, _, _ in tables])).astype(np.int64)
+    max_persons = max([int(np.diff(offsets).max()) for _, offsets, _ in tables if len(offsets) > 1], default=0)
+
+    keypoints = np.full((len(tables), len(frame_numbers), max_persons, NUM_KEYPOINTS, 2), np.nan)
+    person_counts = np.zeros((len(tables), len(frame_numbers)), dtype=np.int64)
+    for stream, (stream_frames, offsets, stream_keypoints) in enumerate(tables):
+        counts = np.diff(offsets)
+        counts = counts[counts > 0]
+        positions = np.searchsorted(frame_numbers, stream_frames)
+        slots = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+        keypoints[stream, np.repeat(positions, counts), slots] = stream_keypoints[offsets[0]:offsets[-1], :, :2]
+        person_counts[stream, positions] = counts
+
+    return keypoints, person_counts, frame_numbers
+
+
+def _batch_dtw(x, y, window=None, with_path=False):
+    # Same recurrence (and tie order) as fastdtw.__dtw, evaluated for every pair at once.
+    count, len_x, len_y = x.shape[0], x.shape[1], y.shape[1]
+    cost = np.sqrt(((x[:, :, None, :] - y[:, None, :, :]) ** 2).sum(axis=-1))
+
+    D = np.full((count, len_x + 1, len_y + 1), np.inf)
+    D[:, 0, 0] = 0.0
+    steps = np.zeros((count, len_x + 1, len_y + 1), dtype=np.int8)
+    rows = np.arange(count)
+    for i in range(1, len_x + 1):
+        for j in range(1, len_y + 1):
+            previous = np.stack((D[:, i - 1, j], D[:, i, j - 1], D[:, i - 1, j - 1]), axis=1)
+            step = previous.argmin(axis=1)
+            value = previous[rows, step] + cost[:, i - 1, j - 1]
+            if window is not None:
+                value = np.where(window[:, i - 1, j - 1], value, np.inf)
+            D[:, i, j] = value
+            steps[:, i, j] = step
+
+    distance = D[:, len_x, len_y]
+    if not with_path:
+        return distance, None
+
+    path = np.zeros((count, len_x, len_y), dtype=bool)
+    i = np.full(count, len_x)
+    j = np.full(count, len_y)
+    active = np.ones(count, dtype=bool)
+    while active.any():
+        path[rows[active], i[active] - 1, j[active] - 1] = True
+        step = steps[rows, i, j]
+        i = np.where(active & (step != 1), i - 1, i)
+        j = np.where(active & (step != 0), j - 1, j)
+        active = (i != 0) | (j != 0)
+    return distance, path
+
+
+def _expand_window(path, len_x, len_y, radius):
+    # Dilate the coarse path by radius, then upsample every coarse cell to a 2x2 block.
+    count, coarse_x, coarse_y = path.shape
+    padded = np.zeros((count, coarse_x + 2 * radius, coarse_y + 2 * radius), dtype=bool)
+    for a in range(-radius, radius + 1):
+        for b in range(-radius, radius + 1):
+            padded[:, radius + a:radius + a + coarse_x, radius + b:radius + b + coarse_y] |= path
+    window = padded.repeat(2, axis=1).repeat(2, axis=2)
+    return window[:, 2 * radius:2 * radius + len_x, 2 * radius:2 * radius + len_y]
+
+
+def _batch_fastdtw(x, y, radius=DTW_RADIUS, with_path=False):
+    # Vectorised port of fastdtw.fastdtw(x, y, radius, dist=euclidean) over a batch of sequences.
+    len_x, len_y = x.shape[1], y.shape[1]
+    if len_x < radius + 2 or len_y < radius + 2:
+        return _batch_dtw(x, y, with_path=with_path)
+
+    x_shrinked = (x[:, 0:len_x - len_x % 2:2] + x[:, 1:len_x - len_x % 2:2]) / 2
+    y_shrinked = (y[:, 0:len_y - len_y % 2:2] + y[:, 1:len_y - len_y % 2:2]) / 2
+    _, path = _batch_fastdtw(x_shrinked, y_shrinked, radius, with_path=True)
+    window = _expand_window(path, len_x, len_y, radius)
+    return _batch_dtw(x, y, window, with_path=with_path)
+
+
+def _batch_cosine(u, v):
+    uu = (u * u).sum(axis=1)
+    vv = (v * v).sum(axis=1)
+    uv = (u * v).sum(axis=1)
+    degenerate = (uu == 0) | (vv == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = np.clip(1.0 - uv / np.sqrt(uu * vv), 0.0, 2.0)
+    return np.where(degenerate, 1.0, distance)
+
+
+def _frame_scale(width, height):
+    # (2,) for one frame size, (N, 2) for one per pair
+    return np.stack([np.asarray(width, dtype=np.float64), np.asarray(height, dtype=np.float64)], axis=-1)
+
+
+def _select_scale(scale, mask):
+    return scale[mask][:, None, :] if scale.ndim == 2 else scale
+
+
+def batch_pose_similarity(keypoints1, keypoints2, width, height, position_threshold, size_threshold, frame_size2=None):
+    """
+    Compare N person pairs given as two (N, 16, 2) keypoint arrays.
+
+    width / height: frame size of keypoints1, a scalar or one value per pair;
+    frame_size2: (width, height) of keypoints2 if it differs.
+
+    Returns (similarity, position_diff, size_diff). Pairs rejected by the position/size
+    filter get an infinite similarity, exactly like the former per-row implementation.
+    """
+    keypoints1 = np.nan_to_num(keypoints1, nan=0.0, posinf=0.0, neginf=0.0)
+    keypoints2 = np.nan_to_num(keypoints2, nan=0.0, posinf=0.0, neginf=0.0)
+    scale1 = _frame_scale(width, height)
+    scale2 = scale1 if frame_size2 is None else _frame_scale(*frame_size2)
+
+    centroid1 = keypoints1.sum(axis=1) / NUM_KEYPOINTS / scale1
+    centroid2 = keypoints2.sum(axis=1) / NUM_KEYPOINTS / scale2
+    size1 = (keypoints1.max(axis=1) - keypoints1.min(axis=1)) / scale1
+    size2 = (keypoints2.max(axis=1) - keypoints2.min(axis=1)) / scale2
+
+    position_diff = np.sqrt(((centroid1 - centroid2) ** 2).sum(axis=1))
+    size_diff = np.sqrt(((size1 - size2) ** 2).sum(axis=1))
+    is_similar = (position_diff < position_threshold) & (size_diff < size_threshold)
+
+    similarity = np.full(len(keypoints1), np.inf)
+    if is_similar.any():
+        normalized1 = keypoints1[is_similar] / _select_scale(scale1, is_similar)
+        normalized2 = keypoints2[is_similar] / _select_scale(scale2, is_similar)
+        group_scores = []
+        for start, count in KEYPOINT_GROUPS:
+            part1 = normalized1[:, start:start + count]
+            part2 = normalized2[:, start:start + count]
+            dtw_distance, _ = _batch_fastdtw(part1, part2)
+            cosine_distance = _batch_cosine(part1.reshape(len(part1), -1), part2.reshape(len(part2), -1))
+            group_scores.append(dtw_distance + cosine_distance)
+        similarity[is_similar] = (group_scores[0] + group_scores[1] + group_scores[2]) / 3
+
+    return similarity, position_diff, size_diff
+
+
+def _frame_batch_pairs(person_counts, frame_positions, stream_pairs):
+    # Enumerate every (frame, stream i, stream j, person a, person b) comparison of a frame batch,
+    # ordered frame -> stream pair -> person a -> person b.
+    counts1 = person_counts[stream_pairs[:, 0]][:, frame_positions].T
+    counts2 = person_counts[stream_pairs[:, 1]][:, frame_positions].T
+    group_sizes = (counts1 * counts2).ravel()
+    group_frames = np.repeat(frame_positions, len(stream_pairs))
+    group_pairs = np.tile(np.arange(len(stream_pairs)), len(frame_positions))
+
+    total = int(group_sizes.sum())
+    group_ids = np.repeat(np.arange(len(group_sizes)), group_sizes)
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    offsets = np.arange(total) - group_starts[group_ids]
+    right_counts = counts2.ravel()[group_ids]
+
+    return {
+        "group": group_ids,
+        "group_starts": group_starts,
+        "group_sizes": group_sizes,
+        "frame": group_frames[group_ids],
+        "pair": group_pairs[group_ids],
+        "person1": offsets // right_counts,
+        "person2": offsets % right_counts,
+    }
+
+
+def _ordered_vector(keypoints):
+    vector = [keypoints[VECTOR_KEYPOINTS[0], 0], keypoints[VECTOR_KEYPOINTS[0], 1],
+              keypoints[VECTOR_KEYPOINTS[1], 0], keypoints[VECTOR_KEYPOINTS[1], 1]]
+    vector = [float(value) for value in vector]
+    # Ensure the coordinates are in the correct order
+    if vector[0] > vector[2]:
+        vector = [vector[2], vector[3], vector[0], vector[1]]
+    return vector
 
 
 def calculate_similarities(csv_files, width, height, threshold, position_threshold, size_threshold,
                            avg_similarity_threshold):
-    def get_keypoints(row, start_index, count):
-        keypoints = []
-        for i in range(count):
-            x_index = start_index + i * 3 + 1
-            y_index = start_index + i * 3 + 2
-            if x_index < len(row) and y_index < len(row):
-                x = row[x_index]
-                y = row[y_index]
-                if np.isnan(x) or np.isinf(x):
-                    x = 0.0
-                if np.isnan(y) or np.isinf(y):
-                    y = 0.0
-                keypoints.append((x, y))
-            else:
-                keypoints.append((0.0, 0.0))
-        return keypoints
-
-    def normalize_keypoints(keypoints, width, height):
-        return [(x / width, y / height) for x, y in keypoints]
-
-    def calculate_dtw_distance(keypoints1, keypoints2):
-        distance, _ = fastdtw(keypoints1, keypoints2, dist=euclidean)
-        return distance
-
-    def calculate_cosine_similarity(keypoints1, keypoints2):
-        flat1 = np.array(keypoints1).flatten()
-        flat2 = np.array(keypoints2).flatten()
-        uu = np.dot(flat1, flat1)
-        vv = np.dot(flat2, flat2)
-        if uu == 0 or vv == 0:
-            return 1.0
-        return cosine(flat1, flat2)
-
-    def calculate_centroid(keypoints):
-        x_coords = [x for x, y in keypoints]
-        y_coords = [y for x, y in keypoints]
-        centroid = (sum(x_coords) / len(x_coords), sum(y_coords) / len(y_coords))
-        return centroid
-
-    def calculate_size(keypoints):
-        x_coords = [x for x, y in keypoints]
-        y_coords = [y for x, y in keypoints]
-        width = max(x_coords) - min(x_coords)
-        height = max(y_coords) - min(y_coords)
-        return width, height
-
-    def filter_by_position_and_size(keypoints1, keypoints2, width, height, position_threshold=0.1, size_threshold=0.1):
-        centroid1 = calculate_centroid(keypoints1)
-        centroid2 = calculate_centroid(keypoints2)
-
-        size1 = calculate_size(keypoints1)
-        size2 = calculate_size(keypoints2)
-
-        norm_centroid1 = (centroid1[0] / width, centroid1[1] / height)
-        norm_centroid2 = (centroid2[0] / width, centroid2[1] / height)
-
-        norm_size1 = (size1[0] / width, size1[1] / height)
-        norm_size2 = (size2[0] / width, size2[1] / height)
-
-        position_diff = euclidean(norm_centroid1, norm_centroid2)
-        size_diff = euclidean(norm_size1, norm_size2)
-
-        is_similar = position_diff < position_threshold and size_diff < size_threshold
-        return is_similar, position_diff, size_diff
-
-    def calculate_combined_similarity_with_filter(row1, row2, width, height, position_threshold, size_threshold):
-        face1 = get_keypoints(row1, 0, 5)
-        face2 = get_keypoints(row2, 0, 5)
-        body1 = get_keypoints(row1, 15, 7)
-        body2 = get_keypoints(row2, 15, 7)
-        leg1 = get_keypoints(row1, 36, 4)
-        leg2 = get_keypoints(row2, 36, 4)
-
-        keypoints1 = face1 + body1 + leg1
-        keypoints2 = face2 + body2 + leg2
-
-        is_similar, position_diff, size_diff = filter_by_position_and_size(keypoints1, keypoints2, width, height,
-                                                                           position_threshold, size_threshold)
-        if not is_similar:
-            return float('inf'), position_diff, size_diff
-
-        similarity = calculate_combined_similarity(row1, row2, width, height)
-        return similarity, position_diff, size_diff
-
-    def calculate_combined_similarity(row1, row2, width, height):
-        face1 = get_keypoints(row1, 0, 5)
-        body1 = get_keypoints(row1, 15, 7)
-        leg1 = get_keypoints(row1, 36, 4)
-
-        face2 = get_keypoints(row2, 0, 5)
-        body2 = get_keypoints(row2, 15, 7)
-        leg2 = get_keypoints(row2, 36, 4)
-
-        face1 = normalize_keypoints(face1, width, height)
-        body1 = normalize_keypoints(body1, width, height)
-        leg1 = normalize_keypoints(leg1, width, height)
-
-        face2 = normalize_keypoints(face2, width, height)
-        body2 = normalize_keypoints(body2, width, height)
-        leg2 = normalize_keypoints(leg2, width, height)
-
-        face_similarity = calculate_dtw_distance(face1, face2) + calculate_cosine_similarity(face1, face2)
-        body_similarity = calculate_dtw_distance(body1, body2) + calculate_cosine_similarity(body1, body2)
-        leg_similarity = calculate_dtw_distance(leg1, leg2) + calculate_cosine_similarity(leg1, leg2)
-
-        return (face_similarity + body_similarity + leg_similarity) / 3
-
+    """
+    width / height: frame size the keypoints are normalised by, one value for all
+    streams or one per csv file.
+    """
     def get_similar_frames_dict(results):
         frame_similarities = {}
         for frame_num in results:
@@ -125,74 +212,66 @@ def calculate_similarities(csv_files, width, height, threshold, position_thresho
                     frame_similarities[file].append((frame_num, file_pair))
         return frame_similarities
 
-    data_list = [pd.read_csv(file) for file in csv_files]
+    tables = [load_keypoint_table(file) for file in csv_files]
 
     similar_frames = {}
     best_vectors = {}
 
-    all_frame_numbers = set()
-    for data in data_list:
-        # Ensure frame_number is int
-        data.iloc[:, 0] = data.iloc[:, 0].astype(int)
-        all_frame_numbers.update(data.iloc[:, 0].unique())
-
-    total_comparisons = sum(
-        len(data1[data1.iloc[:, 0] == frame_num]) * len(data2[data2.iloc[:, 0] == frame_num])
-        for frame_num in all_frame_numbers
-        for i, data1 in enumerate(data_list)
-        for j, data2 in enumerate(data_list) if i < j
-    )
+    keypoints, person_counts, frame_numbers = load_keypoint_array(tables)
+    stream_pairs = np.array([(i, j) for i in range(len(csv_files)) for j in range(i + 1, len(csv_files))],
+                            dtype=np.int64).reshape(-1, 2)
+    widths = np.broadcast_to(np.asarray(width, dtype=np.float64), (len(csv_files),))
+    heights = np.broadcast_to(np.asarray(height, dtype=np.float64), (len(csv_files),))
 
+    total_comparisons = int((person_counts[stream_pairs[:, 0]] * person_counts[stream_pairs[:, 1]]).sum())
     progress = tqdm(total=total_comparisons, desc="전환점을 찾고있습니다")
+    reporter = Reporter("similarity", None, total_comparisons)
+
+    for batch_start in range(0, len(frame_numbers), FRAME_BATCH_SIZE):
+        frame_positions = np.arange(batch_start, min(batch_start + FRAME_BATCH_SIZE, len(frame_numbers)))
+        pairs = _frame_batch_pairs(person_counts, frame_positions, stream_pairs)
+        if len(pairs["group"]) == 0:
+            continue
 
-    for frame_num in all_frame_numbers:
-        for i, data1 in enumerate(data_list):
-            frame1_rows = data1[data1.iloc[:, 0] == frame_num].to_numpy()
-            for j, data2 in enumerate(data_list):
-                if i >= j:
-                    continue
-
-                frame2_rows = data2[data2.iloc[:, 0] == frame_num].to_numpy()
-
-                best_similarity = float('inf')
-                best_vector1 = None
-                best_vector2 = None
-
-                for row1 in frame1_rows:
-                    for row2 in frame2_rows:
-                        similarity, position_diff, size_diff = calculate_combined_similarity_with_filter(row1, row2,
-                                                                                                         width, height,
-                                                                                                         position_threshold,
-                                                                                                         size_threshold)
-
-                        if similarity < threshold:
-                            key = (frame_num, csv_files[i], csv_files[j])
-                            reverse_key = (frame_num, csv_files[j], csv_files[i])
-                            if key not in similar_frames:
-                                similar_frames[key] = []
-                            if reverse_key not in similar_frames:
-                                similar_frames[reverse_key] = []
-                            similar_frames[key].append((similarity, position_diff, size_diff))
-                            similar_frames[reverse_key].append((similarity, position_diff, size_diff))
-
-                        if similarity < best_similarity:
-                            best_similarity = similarity
-                            best_vector1 = [row1[16], row1[17], row1[19], row1[20]]
-                            best_vector2 = [row2[16], row2[17], row2[19], row2[20]]
-
-                            # Ensure the coordinates are in the correct order
-                            if best_vector1[0] > best_vector1[2]:
-                                best_vector1 = [best_vector1[2], best_vector1[3], best_vector1[0], best_vector1[1]]
-                            if best_vector2[0] > best_vector2[2]:
-                                best_vector2 = [best_vector2[2], best_vector2[3], best_vector2[0], best_vector2[1]]
-
-                        progress.update(1)
-
-                if best_vector1 is not None and best_vector2 is not None:
-                    best_vectors[(frame_num, csv_files[i], csv_files[j])] = (best_vector1, best_vector2)
-                    best_vectors[(frame_num, csv_files[j], csv_files[i])] = (best_vector2, best_vector1)
+        stream1 = stream_pairs[pairs["pair"], 0]
+        stream2 = stream_pairs[pairs["pair"], 1]
+        keypoints1 = keypoints[stream1, pairs["frame"], pairs["person1"]]
+        keypoints2 = keypoints[stream2, pairs["frame"], pairs["person2"]]
+
+        similarity, position_diff, size_diff = batch_pose_similarity(keypoints1, keypoints2, widths[stream1], heights[stream1],
+                                                                     position_threshold, size_threshold,
+                                                                     (widths[stream2], heights[stream2]))
+
+        for k in np.flatnonzero(similarity < threshold):
+            frame_num = int(frame_numbers[pairs["frame"][k]])
+            key = (frame_num, csv_files[stream1[k]], csv_files[stream2[k]])
+            reverse_key = (frame_num, csv_files[stream2[k]], csv_files[stream1[k]])
+            if key not in similar_frames:
+                similar_frames[key] = []
+            if reverse_key not in similar_frames:
+                similar_frames[reverse_key] = []
+            value = (float(similarity[k]), float(position_diff[k]), float(size_diff[k]))
+            similar_frames[key].append(value)
+            similar_frames[reverse_key].append(value)
+
+        # best pair of a (frame, i, j) group: first comparison with the lowest finite similarity
+        nonempty = pairs["group_sizes"] > 0
+        group_min = np.full(len(pairs["group_sizes"]), np.inf)
+        group_min[nonempty] = np.minimum.reduceat(similarity, pairs["group_starts"][nonempty])
+        candidates = np.flatnonzero(np.isfinite(similarity) & (similarity == group_min[pairs["group"]]))
+        _, first = np.unique(pairs["group"][candidates], return_index=True)
+        for k in candidates[first]:
+            frame_num = int(frame_numbers[pairs["frame"][k]])
+            best_vector1 = _ordered_vector(keypoints1[k])
+            best_vector2 = _ordered_vector(keypoints2[k])
+            best_vectors[(frame_num, csv_files[stream1[k]], csv_files[stream2[k]])] = (best_vector1, best_vector2)
+            best_vectors[(frame_num, csv_files[stream2[k]], csv_files[stream1[k]])] = (best_vector2, best_vector1)
+
+        progress.update(len(pairs["group"]))
+        reporter.update(progress.n)
 
     progress.close()
+    reporter.update(progress.n, force=True)
 
     results = {}
     verified_matches = []
@@ -218,6 +297,6 @@ def calculate_similarities(csv_files, width, height, threshold, position_thresho
         verified_matches.append((frame_num, csv_file1, csv_file2, avg_similarity))
 
     frame_similarities = get_similar_frames_dict(results)
-    frame_count = max(all_frame_numbers) + 1
+    frame_count = int(frame_numbers.max()) + 1
 
     return results, verified_matches, frame_similarities, frame_count, best_vectors
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import threading
+import time
+
+# Structured progress of the analysis / render loops.
+#
+# Loops report (stage, video, chunk, done, total). Model workers put their events
+# on a multiprocessing queue handed to them by the pool initializer; a listener
+# thread in the server process folds them into _state. Work that runs in-process
+# (similarity, render) reports directly and is tagged with the scope of the
+# calling thread (the job id), since it belongs to a job rather than a video.
+STAGES = ("pose", "face", "scene", "similarity", "render")
+# minimum seconds between two reports of the same loop
+REPORT_INTERVAL = 0.5
+# entries not updated for this long are dropped
+ENTRY_TTL = 60 * 60
+
+_queue = None
+_is_worker = False
+_listener = None
+_state = {}
+_state_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_queue():
+    """Queue for the worker pools (see attach); starts the listener on first use."""
+    global _queue, _listener
+    if _queue is None:
+        _queue = multiprocessing.Queue()
+        _listener = threading.Thread(target=_listen, name="progress-listener", daemon=True)
+        _listener.start()
+    return _queue
+
+
+def attach(queue):
+    """Pool initializer side: send this worker's reports to the server process."""
+    global _queue, _is_worker
+    _queue = queue
+    _is_worker = queue is not None
+
+
+def set_scope(scope):
+    _local.scope = scope
+
+
+def current_scope():
+    return getattr(_local, "scope", None)
+
+
+def report(stage, video, done, total, chunk=0):
+    event = (current_scope(), stage, video, chunk, done, total, time.time())
+    if _is_worker:
+        try:
+            _queue.put_nowait(event)
+        except Exception:
+            pass
+    else:
+        _apply(event)
+
+
+class Reporter:
+    """Throttled report() for one loop: call update(done) as often as convenient."""
+
+    def __init__(self, stage, video, total, chunk=0):
+        self.stage = stage
+        self.video = video
+        self.total = total
+        self.chunk = chunk
+        self.last = 0.0
+        report(stage, video, 0, total, chunk)
+
+    def update(self, done, force=False):
+        now = time.monotonic()
+        if force or now - self.last >= REPORT_INTERVAL or (self.total and done >= self.total):
+            self.last = now
+            report(self.stage, self.video, done, self.total, self.chunk)
+
+
+def _listen():
+    while True:
+        try:
+            _apply(_queue.get())
+        except (EOFError, OSError):
+            return
+
+
+def _apply(event):
+    scope, stage, video, chunk, done, total, timestamp = event
+    key = (scope, stage, video, chunk)
+    with _state_lock:
+        entry = _state.get(key)
+        if entry is None or done < entry["done"]:
+            # first report, or the same loop started over
+            entry = {"started": timestamp}
+            _state[key] = entry
+        entry.update(done=done, total=total, updated=timestamp)
+        for stale in [k for k, e in _state.items() if timestamp - e["updated"] > ENTRY_TTL]:
+            del _state[stale]
+
+
+def snapshot(scope=None, videos=()):
+    """
+    Progress of everything reported under scope or for one of videos, per stage
+    and video (chunks summed): [{stage, video, done, total, fps, eta}, ...].
+    video is the file name only (the payload goes to clients, see job status / SSE);
+    eta is in seconds, None until there is a rate to extrapolate from.
+    """
+    videos = set(videos)
+    grouped = {}
+    with _state_lock:
+        for (entry_scope, stage, video, chunk), entry in _state.items():
+            if (scope is None or entry_scope != scope) and video not in videos:
+                continue
+            group = grouped.setdefault((stage, video), {"done": 0, "total": 0, "started": entry["started"], "updated": entry["updated"]})
+            group["done"] += entry["done"]
+            group["total"] += entry["total"] or 0
+            group["started"] = min(group["started"], entry["started"])
+            group["updated"] = max(group["updated"], entry["updated"])
+
+    result = []
+    for (stage, video), group in grouped.items():
+        elapsed = group["updated"] - group["started"]
+        rate = group["done"] / elapsed if elapsed > 0 and group["done"] else None
+        remaining = max(group["total"] - group["done"], 0)
+        result.append({
+            "stage": stage,
+            "video": os.path.basename(video) if video else video,
+            "done": group["done"],
+            "total": group["total"],
+            "fps": rate,
+            "eta": remaining / rate if rate else (0.0 if group["total"] and not remaining else None),
+        })
+    order = {stage: index for index, stage in enumerate(STAGES)}
+    result.sort(key=lambda item: (order.get(item["stage"], len(order)), item["video"] or ""))
+    return result
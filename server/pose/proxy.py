@@ -0,0 +1,139 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from pose import analysis_cache
+from pose.video_io import ffmpeg_binary, video_metadata
+
+# Low-resolution proxy of an uploaded video: small frames, constant frame rate
+# (the source's average rate) and a short GOP. The preview player seeks in it and
+# the analysis stages decode it instead of the source; detections are scaled back
+# to source pixels (see analysis_input). Built once per video content and kept in
+# the analysis cache.
+PROXY_WIDTH = 640
+# keyframe every PROXY_GOP frames
+PROXY_GOP = 12
+PROXY_CRF = 30
+PROXY_MAXRATE = "800k"
+PROXY_AUDIO_BITRATE = "64k"
+PROXY_PARAMS = {
+    "width": PROXY_WIDTH,
+    "gop": PROXY_GOP,
+    "crf": PROXY_CRF,
+    "maxrate": PROXY_MAXRATE,
+    "audio": PROXY_AUDIO_BITRATE,
+    "cfr": True,
+}
+# decode the proxy in pose / face / scene analysis instead of the source
+PROXY_ANALYSIS = True
+# proxies encoded at once (ffmpeg is multi-threaded itself)
+PROXY_WORKERS = 2
+PROXY_NAME = "proxy.mp4"
+# cache key of analysis results decoded from the source instead of the proxy
+SOURCE_INPUT = "source"
+# encoders tried in order; not every ffmpeg build ships libx264
+PROXY_ENCODERS = (
+    ("libx264", ["-preset", "veryfast", "-crf", str(PROXY_CRF), "-maxrate", PROXY_MAXRATE, "-bufsize", PROXY_MAXRATE]),
+    ("libopenh264", ["-b:v", PROXY_MAXRATE]),
+)
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def make_proxy(video_path, output_path):
+    """Encode the proxy rendition of video_path; True on success."""
+    try:
+        ffmpeg = ffmpeg_binary()
+    except FileNotFoundError as e:
+        print(f"Proxy of {video_path} not made: {e}")
+        return False
+    temp_path = output_path + ".tmp.mp4"
+    metadata = video_metadata(video_path)
+    # constant frame rate, so frame n of the proxy is frame n of a CFR source
+    rate_args = ["-r", f"{metadata['fps']:.6f}"] if metadata and metadata["fps"] else []
+    for codec, codec_args in PROXY_ENCODERS:
+        cmd = [
+            ffmpeg, "-y", "-v", "error", "-i", video_path,
+            # never upscale sources that are already small
+            "-vf", f"scale=w='min({PROXY_WIDTH},iw)':h=-2",
+            *rate_args, "-c:v", codec, *codec_args,
+            "-g", str(PROXY_GOP), "-keyint_min", str(PROXY_GOP), "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", PROXY_AUDIO_BITRATE,
+            # moov atom in front, so the player can start and seek before the download finishes
+            "-movflags", "+faststart",
+            temp_path,
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, "stderr", None)
+            print(f"Proxy encoding of {video_path} with {codec} failed: {stderr.decode(errors='replace').strip() if stderr else e}")
+            continue
+        os.replace(temp_path, output_path)
+        return True
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return False
+
+
+def proxy_path(video_path):
+    """
+    Path of the proxy rendition of video_path, encoding it on first use; None if
+    it cannot be made.
+    """
+    cached = analysis_cache.lookup(video_path, "proxy", PROXY_PARAMS, PROXY_NAME)
+    if cached is not None:
+        return cached
+
+    with _locks_lock:
+        lock = _locks.setdefault(analysis_cache.file_hash(video_path), threading.Lock())
+    # concurrent requests for the same video wait for one encode
+    with lock:
+        cached = analysis_cache.lookup(video_path, "proxy", PROXY_PARAMS, PROXY_NAME)
+        if cached is not None:
+            return cached
+        _, missing = analysis_cache.split_cached([video_path], "proxy", PROXY_PARAMS, lambda name: PROXY_NAME)
+        output_path = os.path.join(missing[video_path], PROXY_NAME)
+        print(f"Creating proxy of {video_path}...")
+        if not make_proxy(video_path, output_path):
+            analysis_cache.discard(missing.values())
+            return None
+        output_path, = analysis_cache.commit(video_path, "proxy", PROXY_PARAMS, [output_path])
+        return output_path
+
+
+def prepare_proxies(video_files):
+    """Encode the missing proxies of video_files side by side; {video: proxy path or None}."""
+    with ThreadPoolExecutor(max_workers=PROXY_WORKERS) as executor:
+        return dict(zip(video_files, executor.map(proxy_path, video_files)))
+
+
+def _frame_size(video_path):
+    # as decoded by OpenCV (rotation applied), i.e. the frame the detectors see
+    cap = cv2.VideoCapture(video_path)
+    size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return size
+
+
+def analysis_input(video_path):
+    """
+    (path to decode, scale, key) for analysing video_path: the proxy and the
+    factors (sx, sy) that map its pixel coordinates to the source, or the source
+    itself and None when the proxy is disabled or cannot be made. key names what
+    is decoded and goes into the stages' cache keys, so it always matches the file
+    that was actually analysed.
+    """
+    if not PROXY_ANALYSIS:
+        return video_path, None, SOURCE_INPUT
+    proxy_file = proxy_path(video_path)
+    if proxy_file is None:
+        print(f"Analysing {os.path.basename(video_path)} at source resolution (no proxy).")
+        return video_path, None, SOURCE_INPUT
+    source_width, source_height = _frame_size(video_path)
+    proxy_width, proxy_height = _frame_size(proxy_file)
+    if not (source_width and source_height and proxy_width and proxy_height):
+        return video_path, None, SOURCE_INPUT
+    return proxy_file, (source_width / proxy_width, source_height / proxy_height), PROXY_PARAMS
@@ -0,0 +1,191 @@
+import json
+import os
+import cv2
+import numpy as np
+from pose import analysis_cache, progress
+from pose.workers import CORE_SHARES, get_pool, limit_threads, worker_count
+from pose.proxy import analysis_input
+
+# Frames are compared at this width (grayscale, aspect ratio kept)
+SCENE_WIDTH = 160
+# frames decoded and compared at once
+SCENE_BATCH_SIZE = 64
+# "mean"      - mean absolute pixel difference (0-255)
+# "histogram" - 1 - intersection of the normalised 32-bin histograms (0-1); robust to motion
+# "block"     - share of SCENE_BLOCKS x SCENE_BLOCKS blocks whose mean difference exceeds
+#               SCENE_BLOCK_DIFF (0-1); robust to local motion and flashes
+SCENE_METHOD = "mean"
+SCENE_THRESHOLDS = {"mean": 20, "histogram": 0.4, "block": 0.5}
+SCENE_HIST_BINS = 32
+SCENE_BLOCKS = 8
+SCENE_BLOCK_DIFF = 30
+# detections closer than this many frames to the previous cut belong to the same cut
+SCENE_MIN_GAP = 18
+SCENE_SUFFIX = "_scenes.json"
+
+
+def init_scene_worker(num_threads=1, progress_queue=None):
+    limit_threads(num_threads)
+    progress.attach(progress_queue)
+
+
+def scene_path(video_path, output_dir=""):
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_dir, f"{video_name}{SCENE_SUFFIX}")
+
+
+def frame_scores(frames, method=SCENE_METHOD):
+    """
+    Difference between consecutive frames of a (n, h, w) uint8 grayscale stack;
+    returns n - 1 scores, score i belonging to frame i + 1.
+    """
+    if method == "histogram":
+        count = len(frames)
+        shift = 8 - int(np.log2(SCENE_HIST_BINS))
+        bins = (frames.reshape(count, -1) >> shift).astype(np.int64)
+        bins += SCENE_HIST_BINS * np.arange(count)[:, None]
+        hist = np.bincount(bins.ravel(), minlength=SCENE_HIST_BINS * count).reshape(count, SCENE_HIST_BINS)
+        hist = hist / frames[0].size
+        return 1.0 - np.minimum(hist[:-1], hist[1:]).sum(axis=1)
+
+    diff = np.abs(frames[1:].astype(np.int16) - frames[:-1].astype(np.int16))
+    if method == "block":
+        count, height, width = diff.shape
+        block_h, block_w = height // SCENE_BLOCKS, width // SCENE_BLOCKS
+        blocks = diff[:, :block_h * SCENE_BLOCKS, :block_w * SCENE_BLOCKS].reshape(
+            count, SCENE_BLOCKS, block_h, SCENE_BLOCKS, block_w
+        ).mean(axis=(2, 4))
+        return (blocks > SCENE_BLOCK_DIFF).mean(axis=(1, 2))
+    return diff.mean(axis=(1, 2))
+
+
+def detect_scene_cuts(video_path, method=None, threshold=None, batch_size=SCENE_BATCH_SIZE, decode_path=None):
+    """
+    Frame numbers at which a new scene starts in video_path, and the video's fps.
+    decode_path: file actually decoded (the proxy of video_path).
+    """
+    # defaults are read when called, like scene_params, so the output matches the cache key
+    if method is None:
+        method = SCENE_METHOD
+    if threshold is None:
+        threshold = SCENE_THRESHOLDS[method]
+
+    cap = cv2.VideoCapture(decode_path or video_path)
+    if not cap.isOpened():
+        print(f"Error: Could not open video {video_path}.")
+        return [], 0
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    reporter = progress.Reporter("scene", video_path, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    size = (SCENE_WIDTH, max(1, round(frame_height * SCENE_WIDTH / frame_width))) if frame_width else None
+
+    # slot 0 holds the last frame of the previous batch, so every batch is compared with its predecessor
+    gray = np.empty((batch_size + 1, size[1], size[0]), dtype=np.uint8) if size else None
+    cuts = []
+    last_cut = -SCENE_MIN_GAP
+    frame_number = 0  # frame number of gray[1]
+    have_previous = False
+
+    while size is not None:
+        count = 0
+        while count < batch_size:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            gray[count + 1] = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            count += 1
+        if count == 0:
+            break
+
+        first = 0 if have_previous else 1
+        scores = frame_scores(gray[first:count + 1], method)
+        for offset in np.flatnonzero(scores > threshold):
+            cut = frame_number + first + int(offset)
+            if cut - last_cut > SCENE_MIN_GAP:
+                cuts.append(cut)
+                last_cut = cut
+
+        gray[0] = gray[count]
+        have_previous = True
+        frame_number += count
+        reporter.update(frame_number)
+        if count < batch_size:
+            break
+
+    reporter.update(frame_number, force=True)
+    cap.release()
+    return cuts, fps
+
+
+def process_video(video_path, output_dir="", decode_path=None, name=None):
+    cuts, fps = detect_scene_cuts(video_path, decode_path=decode_path)
+    output_path = scene_path(name or video_path, output_dir)
+    with open(output_path, "w") as f:
+        json.dump({"fps": fps, "frames": cuts, "times": [cut / fps for cut in cuts] if fps else []}, f)
+    return output_path
+
+
+def load_scene_list(path):
+    """Scene start times (seconds) of a scene file, as used for the edit JSON's scene_list."""
+    with open(path, "r") as f:
+        return json.load(f)["times"]
+
+
+def scene_params(input_key):
+    """
+    Cache key of the scene stage: everything that changes its output, plus what it
+    decodes (key of proxy.analysis_input). Built at call time, so changing e.g.
+    SCENE_METHOD at runtime also changes the key.
+    """
+    return {
+        "method": SCENE_METHOD,
+        "threshold": SCENE_THRESHOLDS[SCENE_METHOD],
+        "width": SCENE_WIDTH,
+        "min_gap": SCENE_MIN_GAP,
+        "bins": SCENE_HIST_BINS,
+        "blocks": (SCENE_BLOCKS, SCENE_BLOCK_DIFF),
+        "input": input_key,
+    }
+
+
+def submit_videos(video_files, inputs=None):
+    """
+    Queue scene detection of every video that is not in the analysis cache, one
+    worker per stream. inputs: {video: proxy.analysis_input} if already resolved.
+    Returns ({video: cached scene file}, {video: (cache entry, future, cache params)}).
+    """
+    if inputs is None:
+        inputs = {video_file: analysis_input(video_file) for video_file in video_files}
+    params = {video_file: scene_params(inputs[video_file][2]) for video_file in video_files}
+    cached, missing = analysis_cache.split_cached(
+        video_files, "scene", params.get, lambda name: os.path.basename(scene_path(name)))
+    # one thread per worker (see init_scene_worker)
+    pool = get_pool("scene", init_scene_worker, (1, progress.get_queue()), worker_count(1, CORE_SHARES["scene"]))
+    pending = {
+        video_file: (entry, pool.submit(process_video, video_file, entry, inputs[video_file][0],
+                                        analysis_cache.cache_name(video_file)), params[video_file])
+        for video_file, entry in missing.items()
+    }
+    return cached, pending
+
+
+def collect_videos(cached, pending):
+    """Wait for submit_videos; returns {video: scene file} and commits the new ones to the cache."""
+    scene_files = dict(cached)
+    for video_file, (entry, future, params) in pending.items():
+        try:
+            scene_file = future.result()
+        except Exception as e:
+            print(f"Scene detection failed for {video_file}: {e}")
+            analysis_cache.discard([entry])
+            continue
+        scene_files[video_file], = analysis_cache.commit(video_file, "scene", params, [scene_file])
+    return scene_files
+
+
+def scene_lists(video_files):
+    """Per-stream scene start times (seconds) of video_files; cached results are reused."""
+    scene_files = collect_videos(*submit_videos(video_files))
+    return [load_scene_list(scene_files[video_file]) if video_file in scene_files else [] for video_file in video_files]
@@ -1,37 +1,158 @@
 import numpy as np
+from collections import defaultdict, deque
+
+# weighted planner: value of one transition = "cut" + weighted quality terms in [0, 1]
+# (see build_transition_scores)
+PLAN_WEIGHTS = {"cut": 1.0, "similarity": 1.0, "position": 0.5, "face": 1.0}
+
 def find_max_transformation_order(frame_similarities, frame_count, random_point):
+    """
+    Longest chain of transitions [(frame, start_csv, end_csv), ...] with at least
+    random_point frames between consecutive transitions, where each transition
+    starts from a stream the previous one switched into.
+
+    DP over the candidate frames in order. For every stream we keep the best chain
+    so far that can continue from that stream (prefix max over frames at least
+    random_point earlier), so each frame costs O(its transitions + streams).
+    """
     frames = sorted(frame_similarities.keys())
     n = len(frames)
+    if n == 0:
+        return []
+
+    # 각 프레임에서 전환되어 들어가는 스트림 (pair[1]) 집합
+    targets = [{pair[1] for pair in frame_similarities[frame]} for frame in frames]
 
     # DP 테이블 초기화: 전환 횟수를 저장하는 테이블
-    dp = np.zeros(n)
+    dp = [0] * n
     path = [None] * n
 
+    # stream -> (max dp, first frame index with it) over the frames added so far that switch into stream
+    best = {}
+    added = 0
     for i in range(n):
-        for j in range(i):
-            if frames[i] - frames[j] >= random_point:
-                for transition in frame_similarities[frames[i]]:
-                    if transition[0] in [pair[1] for pair in frame_similarities[frames[j]]]:
-                        if dp[i] < dp[j] + 1:
-                            dp[i] = dp[j] + 1
-                            path[i] = (frames[j], transition[0], transition[1])
+        while added < i and frames[i] - frames[added] >= random_point:
+            for stream in targets[added]:
+                if stream not in best or dp[added] > best[stream][0]:
+                    best[stream] = (dp[added], added)
+            added += 1
+
+        # highest dp, then the earliest frame, among the frames leading into a start stream of frame i
+        candidate = None
+        for transition in frame_similarities[frames[i]]:
+            entry = best.get(transition[0])
+            if entry is not None and (candidate is None or entry[0] > candidate[0] or (entry[0] == candidate[0] and entry[1] < candidate[1])):
+                candidate = entry
+        if candidate is None:
+            continue
+
+        value, j = candidate
+        transition = next(t for t in frame_similarities[frames[i]] if t[0] in targets[j])
+        dp[i] = value + 1
+        path[i] = (frames[j], transition[0], transition[1])
 
     # 최대 전환 횟수 및 해당 경로 추적
-    max_transitions = max(dp)
-    max_index = np.argmax(dp)
+    max_index = max(range(n), key=dp.__getitem__)
+    frame_index = {frame: index for index, frame in enumerate(frames)}
 
     # 경로 재구성
     optimal_path = []
     while max_index is not None and path[max_index] is not None:
         frame, start_csv, end_csv = frames[max_index], path[max_index][1], path[max_index][2]
         optimal_path.append((frame, start_csv, end_csv))
-        next_frame = path[max_index][0]
-        max_index = frames.index(next_frame) if next_frame in frames else None
+        max_index = frame_index.get(path[max_index][0])
 
     optimal_path.reverse()
 
     return optimal_path
 
+def build_transition_scores(results, face_verified_matches, similarity_threshold, position_threshold):
+    """
+    Quality terms of every transition (frame, csv1, csv2) found by the analysis,
+    each normalised to [0, 1] (1 is best): pose similarity and position match
+    relative to their thresholds, and the face IoU where the faces matched.
+    """
+    face_iou = {}
+    for frame, file1, file2, iou, *_ in face_verified_matches or []:
+        iou = max(float(iou), face_iou.get((frame, file1, file2), 0.0))
+        face_iou[(frame, file1, file2)] = iou
+        face_iou[(frame, file2, file1)] = iou
+
+    transition_scores = {}
+    for frame_num, result_list in results.items():
+        for result in result_list:
+            csv_file1, csv_file2 = result["similar_files"]
+            transition_scores[(frame_num, csv_file1, csv_file2)] = {
+                "similarity": max(0.0, 1.0 - result["avg_similarity"] / similarity_threshold) if similarity_threshold else 0.0,
+                "position": max(0.0, 1.0 - result["avg_position_diff"] / position_threshold) if position_threshold else 0.0,
+                "face": face_iou.get((frame_num, csv_file1, csv_file2), 0.0),
+            }
+    return transition_scores
+
+def transition_quality(score, weights=PLAN_WEIGHTS):
+    score = score or {}
+    return weights["cut"] + sum(weights[term] * score.get(term, 0.0) for term in ("similarity", "position", "face"))
+
+def find_weighted_transformation_order(frame_similarities, transition_scores, min_gap, max_gap=None, first_stream=None, weights=PLAN_WEIGHTS):
+    """
+    Chain of transitions [(frame, start_csv, end_csv), ...] with the highest total
+    transition_quality, where every transition starts from the stream the previous
+    one switched into and consecutive transitions are min_gap to max_gap frames
+    apart (max_gap None: no upper limit). The start of the video opens the first
+    segment, so a chain can only start min_gap to max_gap frames into the video;
+    with first_stream its first transition also has to leave that stream.
+
+    DP over the transitions in frame order (a DAG over (frame, stream) states).
+    Each stream keeps a monotonic deque of the chains ending in it, so the best
+    predecessor inside the [frame - max_gap, frame - min_gap] window is at its front
+    and every transition costs amortised O(1).
+    """
+    transitions = [
+        (frame, pair[0], pair[1])
+        for frame in sorted(frame_similarities.keys())
+        for pair in dict.fromkeys(tuple(pair) for pair in frame_similarities[frame])
+    ]
+    if not transitions:
+        return []
+    min_gap = max(min_gap, 1)
+
+    best = [-np.inf] * len(transitions)
+    previous = [None] * len(transitions)
+    # end stream -> indices of reachable transitions with frame <= current frame - min_gap, best decreasing
+    windows = defaultdict(deque)
+    added = 0
+    for i, (frame, start_csv, end_csv) in enumerate(transitions):
+        while added < i and transitions[added][0] <= frame - min_gap:
+            if best[added] > -np.inf:
+                window = windows[transitions[added][2]]
+                while window and best[window[-1]] <= best[added]:
+                    window.pop()
+                window.append(added)
+            added += 1
+
+        window = windows.get(start_csv)
+        if window and max_gap is not None:
+            while window and transitions[window[0]][0] < frame - max_gap:
+                window.popleft()
+
+        quality = transition_quality(transition_scores.get((frame, start_csv, end_csv)), weights)
+        if window:
+            best[i] = best[window[0]] + quality
+            previous[i] = window[0]
+        elif (first_stream is None or start_csv == first_stream) and min_gap <= frame and (max_gap is None or frame <= max_gap):
+            best[i] = quality
+
+    index = int(np.argmax(best))
+    if best[index] == -np.inf:
+        return []
+
+    optimal_path = []
+    while index is not None:
+        optimal_path.append(transitions[index])
+        index = previous[index]
+    optimal_path.reverse()
+    return optimal_path
+
 def get_similar_frames_dict(results):
     frame_similarities = {}
     for frame_num in results:
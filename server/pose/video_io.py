@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import subprocess
+import cv2
+from pose import analysis_cache
+
+# Frames per chunk when one video is split across several workers.
+CHUNK_FRAMES = 1800
+# video_metadata is kept in the analysis cache as <entry>/metadata.json
+METADATA_NAME = "metadata.json"
+METADATA_PARAMS = {"version": 1}
+
+# sha256 -> metadata, so a video is probed at most once per process
+_metadata_memo = {}
+
+
+def ffmpeg_binary():
+    """Path of the ffmpeg executable; FileNotFoundError if there is none."""
+    # moviepy / imageio are pointed at a specific ffmpeg build (see main.py); prefer it
+    ffmpeg = os.environ.get("IMAGEIO_FFMPEG_EXE")
+    if ffmpeg and os.path.exists(ffmpeg):
+        return ffmpeg
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError("ffmpeg not found: install it on PATH or set IMAGEIO_FFMPEG_EXE")
+    return ffmpeg
+
+
+def ffprobe_binary():
+    # moviepy / imageio are pointed at a specific ffmpeg build (see main.py); use its ffprobe
+    ffmpeg = os.environ.get("IMAGEIO_FFMPEG_EXE")
+    if ffmpeg:
+        candidate = os.path.join(os.path.dirname(ffmpeg), "ffprobe")
+        if os.path.exists(candidate):
+            return candidate
+    return shutil.which("ffprobe") or "ffprobe"
+
+
+def keyframe_times(video_path):
+    """
+    Keyframe times (seconds, relative to the first frame) read from the packets
+    without decoding.
+    """
+    cmd = [
+        ffprobe_binary(), "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path,
+    ]
+    try:
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not list keyframes of {video_path}: {e}")
+        return []
+
+    times = []
+    first = None
+    for line in output.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 2 or fields[0] in ("", "N/A"):
+            continue
+        pts_time = float(fields[0])
+        first = pts_time if first is None else min(first, pts_time)
+        if "K" in fields[1]:
+            times.append(pts_time)
+    return sorted(t - first for t in times)
+
+
+def probe_metadata(video_path):
+    """
+    Stream and container metadata read by ffprobe from the headers only (no
+    decoding): width, height (as displayed, rotation applied), fps, frame_count,
+    duration, codec. None if the file cannot be probed (yet), e.g. a partial
+    upload whose moov atom has not arrived.
+    """
+    cmd = [
+        ffprobe_binary(), "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate,nb_frames,codec_name,duration:stream_tags=rotate"
+        ":stream_side_data=rotation:format=duration",
+        "-of", "json", video_path,
+    ]
+    try:
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stdout
+        info = json.loads(output)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+    if not info.get("streams"):
+        return None
+
+    stream = info["streams"][0]
+
+    def rate(value):
+        num, _, den = (value or "0/0").partition("/")
+        try:
+            return float(num) / float(den or 1) if float(den or 1) else 0.0
+        except ValueError:
+            return 0.0
+
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    fps = rate(stream.get("avg_frame_rate")) or rate(stream.get("r_frame_rate"))
+    duration = number(stream.get("duration")) or number(info.get("format", {}).get("duration"))
+    frame_count = int(number(stream.get("nb_frames"))) or int(round(duration * fps))
+    width, height = int(stream.get("width") or 0), int(stream.get("height") or 0)
+    # phone footage is stored sideways with a rotation flag; decoders (and the detectors) see it upright
+    rotation = number(stream.get("tags", {}).get("rotate"))
+    for side_data in stream.get("side_data_list", []):
+        rotation = rotation or number(side_data.get("rotation"))
+    if int(abs(rotation)) % 180 == 90:
+        width, height = height, width
+    return {
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": duration,
+        "codec": stream.get("codec_name"),
+    }
+
+
+def opencv_metadata(video_path):
+    """probe_metadata from OpenCV's container properties, for when ffprobe is not available."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+    metadata = {
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": frame_count / fps if fps else 0.0,
+        "codec": "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00 ") or None,
+    }
+    cap.release()
+    return metadata
+
+
+def video_metadata(video_path):
+    """
+    Metadata of video_path (see probe_metadata), probed once per video content:
+    kept in memory and in the analysis cache. None if the file cannot be read.
+    """
+    sha256 = analysis_cache.file_hash(video_path)
+    if sha256 in _metadata_memo:
+        return _metadata_memo[sha256]
+
+    cached = analysis_cache.lookup(video_path, "metadata", METADATA_PARAMS, METADATA_NAME)
+    if cached is not None:
+        with open(cached, "r") as f:
+            metadata = json.load(f)
+    else:
+        metadata = probe_metadata(video_path) or opencv_metadata(video_path)
+        if metadata is None:
+            return None
+        _, missing = analysis_cache.split_cached([video_path], "metadata", METADATA_PARAMS, lambda name: METADATA_NAME)
+        output_path = os.path.join(missing[video_path], METADATA_NAME)
+        with open(output_path, "w") as f:
+            json.dump(metadata, f, indent=4)
+        analysis_cache.commit(video_path, "metadata", METADATA_PARAMS, [output_path])
+
+    _metadata_memo[sha256] = metadata
+    return metadata
+
+
+def plan_chunks(video_path, chunk_frames=CHUNK_FRAMES):
+    """
+    Split a video into [start_frame, end_frame) ranges of about chunk_frames frames.
+
+    Boundaries are moved to the closest keyframe so that every worker can seek
+    without decoding into the previous range. The last range has end_frame None
+    (read to the end of the file).
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if not chunk_frames or total_frames <= chunk_frames or not fps:
+        return [(0, None)]
+
+    keyframes = sorted({int(round(t * fps)) for t in keyframe_times(video_path)})
+    boundaries = []
+    for target in range(chunk_frames, total_frames - chunk_frames // 2, chunk_frames):
+        if keyframes:
+            target = min(keyframes, key=lambda frame: abs(frame - target))
+        if target > (boundaries[-1] if boundaries else 0) and target < total_frames:
+            boundaries.append(target)
+
+    starts = [0] + boundaries
+    ends = boundaries + [None]
+    return list(zip(starts, ends))
+
+
+def open_at(video_path, start_frame=0):
+    cap = cv2.VideoCapture(video_path)
+    if cap.isOpened() and start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    return cap
@@ -0,0 +1,49 @@
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+
+# Intra-op threads of every model worker (torch for YOLO, onnxruntime for InsightFace).
+THREADS_PER_WORKER = int(os.environ.get("CROSS_EDITOR_THREADS_PER_WORKER", 4))
+# The pose, face and scene pools run at the same time, so they split one budget of
+# cpu_count() cores: a pool gets (its share of the cores) // (threads per worker)
+# workers and the models never compete for more cores than the machine has.
+CORE_SHARES = {"pose": 0.5, "face": 0.35, "scene": 0.15}
+
+_pools = {}
+
+
+def worker_count(threads_per_worker=THREADS_PER_WORKER, share=1.0):
+    return max(1, int(cpu_count() * share) // max(threads_per_worker, 1))
+
+
+def limit_threads(num_threads):
+    """Cap the native thread pools of the current (worker) process."""
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(num_threads)
+    import cv2
+    cv2.setNumThreads(num_threads)
+
+
+def get_pool(name, initializer, initargs=(), max_workers=None):
+    """
+    Long-lived process pool for one model type. The initializer runs once per
+    worker, which is where the model gets loaded; tasks then reuse it.
+    max_workers defaults to the pool's CORE_SHARES share of the cores.
+    """
+    pool = _pools.get(name)
+    if pool is None or getattr(pool, "_broken", False):
+        if max_workers is None:
+            max_workers = worker_count(THREADS_PER_WORKER, CORE_SHARES.get(name, 1.0))
+        pool = ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+        _pools[name] = pool
+    return pool
+
+
+def shutdown_pools():
+    for pool in _pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+    _pools.clear()
+
+
+atexit.register(shutdown_pools)
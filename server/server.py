@@ -1,15 +1,21 @@
 import os
-import shutil
+import asyncio
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import json
 
 # Import refactored logic from main.py
-from main import analyze_videos, render_video, get_video_files, VIDEO_EXTENSIONS
+from main import analyze_videos, render_video, get_video_files, reference_fps, VIDEO_EXTENSIONS, PLANNER, PLANNERS
+from pose.video_io import video_metadata
+import jobs
+import sessions
+import uploads
+import media
+from pose import proxy
 import numpy as np
 
 def convert_numpy(obj):
@@ -39,15 +45,32 @@ app.add_middleware(
 )
 
 # Directories
-# Since we moved everything to server/, these should be relative to the current working directory when running server.py
-# We assume server.py is run from the server/ directory or we adjust accordingly.
-# Best practice: use absolute paths based on __file__
+# Uploads, analysis state and outputs live in a per-session workspace (see sessions.py),
+# so concurrent users never touch each other's files.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_DIR = os.path.join(BASE_DIR, "data")
-OUTPUT_DIR = BASE_DIR
 
-# Ensure upload directory exists
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+def optional_session(session: Optional[str] = Query(None), x_session_id: Optional[str] = Header(None)):
+    # session id from the ?session= query parameter (needed for <video src>) or the X-Session-Id header
+    session_id = session or x_session_id
+    if session_id and not sessions.exists(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired. Please upload videos again.")
+    if session_id:
+        sessions.touch(session_id)
+    return session_id
+
+def require_session(session_id: Optional[str] = Depends(optional_session)):
+    if not session_id:
+        raise HTTPException(status_code=400, detail="Missing session. Please upload videos first.")
+    return session_id
+
+@app.on_event("startup")
+async def start_session_cleanup():
+    async def cleanup_loop():
+        while True:
+            for session_id in await asyncio.to_thread(sessions.cleanup_expired, jobs.active_owners()):
+                uploads.discard_session(session_id)
+            await asyncio.sleep(sessions.CLEANUP_INTERVAL)
+    asyncio.create_task(cleanup_loop())
 
 class RenderRequest(BaseModel):
     # For manual rendering, we might need to pass specific transition points
@@ -56,204 +79,326 @@ class RenderRequest(BaseModel):
     pass
 
 @app.post("/upload")
-async def upload_videos(files: List[UploadFile] = File(...)):
-    # Clear existing videos in data directory to ensure clean state for new session
-    # Note: In a production multi-user env, we'd use session IDs or separate folders
-    for f in os.listdir(UPLOAD_DIR):
-        file_path = os.path.join(UPLOAD_DIR, f)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f"Failed to delete {file_path}. Reason: {e}")
+async def upload_videos(files: List[UploadFile] = File(...), session_id: Optional[str] = Depends(optional_session)):
+    # A new upload starts from a clean upload directory, but only within the caller's session
+    if session_id:
+        uploads.discard_session(session_id)
+        sessions.clear_uploads(session_id)
+    else:
+        session_id = sessions.create_session()
 
+    # files are streamed to disk in chunks and hashed on the way (see uploads.py)
     saved_files = []
+    details = []
     for file in files:
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        saved_files.append(file.filename)
+        try:
+            detail = await uploads.save_stream(session_id, file.filename, file.read, VIDEO_EXTENSIONS)
+        except uploads.UploadError as e:
+            raise upload_error(e)
+        saved_files.append(detail["file"])
+        details.append(detail)
     
-    return {"message": "Files uploaded successfully", "files": saved_files}
+    return {"message": "Files uploaded successfully", "files": saved_files, "details": details, "session_id": session_id}
 
-@app.post("/process/auto")
-async def process_auto():
-    video_files = get_video_files(UPLOAD_DIR, VIDEO_EXTENSIONS)
-    if not video_files:
-        raise HTTPException(status_code=400, detail="No video files found. Please upload videos first.")
+@app.post("/sessions")
+async def create_session():
+    # fresh workspace, e.g. before a new batch of resumable uploads
+    return {"session_id": sessions.create_session()}
+
+class UploadInit(BaseModel):
+    filename: str
+    size: Optional[int] = None
 
+def upload_error(e):
+    return HTTPException(status_code=e.status_code, detail=e.detail)
+
+# Resumable upload: POST /uploads -> PUT /uploads/{id}?offset=N (raw bytes, repeat) -> POST /uploads/{id}/complete.
+# After a failed PUT, GET /uploads/{id} gives the offset to continue from.
+@app.post("/uploads")
+async def create_upload(body: UploadInit, session_id: Optional[str] = Depends(optional_session)):
+    if not session_id:
+        session_id = sessions.create_session()
     try:
-        # Step 1: Analyze
-        analysis_results = analyze_videos(video_files)
-        if analysis_results[0] is None:
-             raise HTTPException(status_code=500, detail="Analysis failed or no transition points found.")
-        
-        n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors = analysis_results
+        upload = uploads.create(session_id, body.filename, VIDEO_EXTENSIONS, body.size)
+    except uploads.UploadError as e:
+        raise upload_error(e)
+    return {**uploads.status(upload), "session_id": session_id}
 
-        # Step 2: Render
-        output_video = render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors)
-        
-        return {"message": "Processing complete", "video_url": f"/result/{output_video}"}
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, session_id: str = Depends(require_session)):
+    try:
+        return uploads.status(uploads.get(session_id, upload_id))
+    except uploads.UploadError as e:
+        raise upload_error(e)
 
-@app.post("/process/analyze")
-async def process_analyze():
-    video_files = get_video_files(UPLOAD_DIR, VIDEO_EXTENSIONS)
+@app.put("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, offset: int = 0, session_id: str = Depends(require_session)):
+    try:
+        return await uploads.append(uploads.get(session_id, upload_id), offset, request.stream())
+    except uploads.UploadError as e:
+        raise upload_error(e)
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, session_id: str = Depends(require_session)):
+    try:
+        return await uploads.complete(uploads.get(session_id, upload_id))
+    except uploads.UploadError as e:
+        raise upload_error(e)
+
+def session_video_files(session_id):
+    video_files = get_video_files(sessions.upload_dir(session_id), VIDEO_EXTENSIONS)
     if not video_files:
         raise HTTPException(status_code=400, detail="No video files found. Please upload videos first.")
+    return video_files
 
-    try:
-        analysis_results = analyze_videos(video_files)
-        if analysis_results[0] is None:
-             raise HTTPException(status_code=500, detail="Analysis failed or no transition points found.")
-        
-        n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors = analysis_results
-        
-        # Serialize data for frontend visualization
-        # We need to convert keys (frame numbers) to strings for JSON compatibility if they aren't already
-        # And ensure tuples are lists
-        
-        # Save intermediate data for the render step (in a real app, use a database or cache)
-        # For this single-user demo, we can rely on re-running analyze or saving to a temp file
-        # To keep it simple, we'll save to a pickle or just rely on the frontend passing data back? 
-        # Actually, passing complex data back and forth is risky. 
-        # Save state for rendering
-        import pickle
-        with open("analysis_state.pkl", "wb") as f:
-            pickle.dump({
-                "n_frame_similarities": n_frame_similarities,
-                "n_frame_count": n_frame_count,
-                "verified_matches": verified_matches,
-                "video_files": video_files,
-                "csv_files": csv_files,
-                "video_file_mapping": video_file_mapping,
-                "best_vectors": best_vectors
-            }, f)
-
-        # Convert frame_similarities to use video basenames instead of CSV filenames
-        # video_file_mapping maps CSV path -> Video path
-        frontend_frame_similarities = {}
+def result_url(session_id, output_video):
+    return f"/result/{os.path.basename(output_video)}?session={session_id}"
+
+def check_planner(planner):
+    if planner not in PLANNERS:
+        raise HTTPException(status_code=400, detail=f"Unknown planner '{planner}'. Use one of: {', '.join(PLANNERS)}")
+    return planner
+
+def run_auto(session_id, video_files, planner):
+    output_dir = sessions.output_dir(session_id)
+
+    # Step 1: Analyze
+    jobs.set_stage("analyze")
+    analysis_results = analyze_videos(video_files, output_dir)
+    if analysis_results[0] is None:
+         raise HTTPException(status_code=500, detail="Analysis failed or no transition points found.")
+    jobs.checkpoint()
+
+    n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores = analysis_results
+
+    # Step 2: Render
+    jobs.set_stage("render")
+    output_video = render_video(n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors,
+                                transition_scores,
+                                output_json=os.path.join(output_dir, "output_pose.json"),
+                                output_video=os.path.join(output_dir, "combined_video.mp4"),
+                                planner=planner)
+
+    return {"message": "Processing complete", "video_url": result_url(session_id, output_video)}
+
+def job_response(job):
+    return {"message": "Job queued", "job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}
+
+@app.post("/process/auto")
+async def process_auto(planner: str = PLANNER, session_id: str = Depends(require_session)):
+    check_planner(planner)
+    video_files = session_video_files(session_id)
+    return job_response(jobs.submit("auto", run_auto, session_id, video_files, planner, owner=session_id, videos=video_files))
+
+def run_analyze(session_id, video_files):
+    jobs.set_stage("analyze")
+    analysis_results = analyze_videos(video_files, sessions.output_dir(session_id))
+    if analysis_results[0] is None:
+         raise HTTPException(status_code=500, detail="Analysis failed or no transition points found.")
+    jobs.checkpoint()
+    
+    n_frame_similarities, n_frame_count, verified_matches, video_files, csv_files, video_file_mapping, best_vectors, transition_scores = analysis_results
+    
+    # Serialize data for frontend visualization
+    # We need to convert keys (frame numbers) to strings for JSON compatibility if they aren't already
+    # And ensure tuples are lists
+    
+    # Save state for the render step in the session workspace
+    import pickle
+    with open(sessions.state_path(session_id), "wb") as f:
+        pickle.dump({
+            "n_frame_similarities": n_frame_similarities,
+            "n_frame_count": n_frame_count,
+            "verified_matches": verified_matches,
+            "video_files": video_files,
+            "csv_files": csv_files,
+            "video_file_mapping": video_file_mapping,
+            "best_vectors": best_vectors,
+            "transition_scores": transition_scores
+        }, f)
+
+    # Convert frame_similarities to use video basenames instead of CSV filenames
+    # video_file_mapping maps CSV path -> Video path
+    frontend_frame_similarities = {}
+    
+    # Create a quick lookup for csv_basename -> video_basename
+    csv_to_video_name = {}
+    for csv_path, video_path in video_file_mapping.items():
+        csv_to_video_name[os.path.basename(csv_path)] = os.path.basename(video_path)
         
-        # Create a quick lookup for csv_basename -> video_basename
-        csv_to_video_name = {}
-        for csv_path, video_path in video_file_mapping.items():
-            csv_to_video_name[os.path.basename(csv_path)] = os.path.basename(video_path)
+    for frame, matches in n_frame_similarities.items():
+        new_matches = []
+        for pair in matches:
+            # pair is [csv1, csv2] (could be full paths or basenames depending on main.py)
+            # main.py usually returns full paths in similar_files
             
-        for frame, matches in n_frame_similarities.items():
-            new_matches = []
-            for pair in matches:
-                # pair is [csv1, csv2] (could be full paths or basenames depending on main.py)
-                # main.py usually returns full paths in similar_files
-                
-                f1 = os.path.basename(pair[0])
-                f2 = os.path.basename(pair[1])
-                
-                v1 = csv_to_video_name.get(f1, f1)
-                v2 = csv_to_video_name.get(f2, f2)
-                
-                new_matches.append([v1, v2])
-            frontend_frame_similarities[frame] = new_matches
-
-        response_data = {
-            "message": "Analysis complete",
-            "frame_similarities": frontend_frame_similarities, 
-            "frame_count": n_frame_count,
-            "video_files": [os.path.basename(f) for f in video_files]
-        }
-        
-        return convert_numpy(response_data)
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+            f1 = os.path.basename(pair[0])
+            f2 = os.path.basename(pair[1])
+            
+            v1 = csv_to_video_name.get(f1, f1)
+            v2 = csv_to_video_name.get(f2, f2)
+            
+            new_matches.append([v1, v2])
+        frontend_frame_similarities[frame] = new_matches
+
+    response_data = {
+        "message": "Analysis complete",
+        "frame_similarities": frontend_frame_similarities, 
+        "frame_count": n_frame_count,
+        "video_files": [os.path.basename(f) for f in video_files],
+        # frame numbers above are converted to seconds with this rate
+        "frame_rate": reference_fps(video_files),
+        "metadata": {os.path.basename(f): video_metadata(f) for f in video_files},
+    }
+    
+    return convert_numpy(response_data)
+
+@app.post("/process/analyze")
+async def process_analyze(session_id: str = Depends(require_session)):
+    video_files = session_video_files(session_id)
+    return job_response(jobs.submit("analyze", run_analyze, session_id, video_files, owner=session_id, videos=video_files))
 
 class RenderRequest(BaseModel):
     sequence: list = None # Optional list of {video: str, start: float}
+    planner: str = PLANNER # used when no sequence is given ("count" or "weighted")
 
-@app.post("/process/render")
-async def process_render(request: RenderRequest = None):
-    try:
-        import pickle
-        if not os.path.exists("analysis_state.pkl"):
-             raise HTTPException(status_code=400, detail="Analysis data not found. Please upload and analyze videos first.")
+def run_render(session_id, request):
+    jobs.set_stage("render")
+    import pickle
+    if not os.path.exists(sessions.state_path(session_id)):
+         raise HTTPException(status_code=400, detail="Analysis data not found. Please upload and analyze videos first.")
+    
+    with open(sessions.state_path(session_id), "rb") as f:
+        state = pickle.load(f)
+    jobs.checkpoint()
         
-        with open("analysis_state.pkl", "rb") as f:
-            state = pickle.load(f)
+    custom_order = None
+    if request and request.sequence:
+        print(f"Received manual sequence: {request.sequence}")
+        # Convert sequence to max_transformation_order format: (frame, start_csv, end_csv)
+        # sequence is [{video: basename, start: seconds}, ...]
+        
+        # Create reverse mapping: basename -> csv_file
+        # state['video_file_mapping'] maps csv_path -> video_path
+        video_to_csv = {}
+        for csv_path, video_path in state['video_file_mapping'].items():
+            video_basename = os.path.basename(video_path)
+            video_to_csv[video_basename] = csv_path
             
-        custom_order = None
-        if request and request.sequence:
-            print(f"Received manual sequence: {request.sequence}")
-            # Convert sequence to max_transformation_order format: (frame, start_csv, end_csv)
-            # sequence is [{video: basename, start: seconds}, ...]
+        custom_order = []
+        fps = reference_fps(state['video_files'])
+        
+        for i in range(1, len(request.sequence)):
+            prev_seg = request.sequence[i-1]
+            curr_seg = request.sequence[i]
             
-            # Create reverse mapping: basename -> csv_file
-            # state['video_file_mapping'] maps csv_path -> video_path
-            video_to_csv = {}
-            for csv_path, video_path in state['video_file_mapping'].items():
-                video_basename = os.path.basename(video_path)
-                video_to_csv[video_basename] = csv_path
-                
-            custom_order = []
-            FPS = 24 # Assuming 24 FPS as per main.py
+            frame = int(round(float(curr_seg['start']) * fps))
+            start_video = prev_seg['video']
+            end_video = curr_seg['video']
             
-            for i in range(1, len(request.sequence)):
-                prev_seg = request.sequence[i-1]
-                curr_seg = request.sequence[i]
-                
-                frame = int(float(curr_seg['start']) * FPS)
-                start_video = prev_seg['video']
-                end_video = curr_seg['video']
-                
-                if start_video in video_to_csv and end_video in video_to_csv:
-                    start_csv = video_to_csv[start_video]
-                    end_csv = video_to_csv[end_video]
-                    custom_order.append((frame, start_csv, end_csv))
-                else:
-                    print(f"Warning: Could not map video files {start_video} or {end_video}")
-
-        # Handle single video case (no transitions)
-        if request and request.sequence and len(request.sequence) == 1:
-             print("Single video sequence detected. Returning original video.")
-             video_name = request.sequence[0]['video']
-             return {"message": "Video rendered successfully", "video_url": f"/videos/{video_name}"}
-
-        output_json, output_video = render_video(
-            state['n_frame_similarities'],
-            state['n_frame_count'],
-            state['verified_matches'],
-            state['video_files'],
-            state['csv_files'],
-            state['video_file_mapping'],
-            state['best_vectors'],
-            output_json=os.path.join(OUTPUT_DIR, "output_pose.json"),
-            output_video=os.path.join(OUTPUT_DIR, "combined_video.mp4"),
-            custom_order=custom_order
-        )
-        
-        return {"message": "Video rendered successfully", "video_url": f"/result/{os.path.basename(output_video)}"}
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+            if start_video in video_to_csv and end_video in video_to_csv:
+                start_csv = video_to_csv[start_video]
+                end_csv = video_to_csv[end_video]
+                custom_order.append((frame, start_csv, end_csv))
+            else:
+                print(f"Warning: Could not map video files {start_video} or {end_video}")
+
+    # Handle single video case (no transitions)
+    if request and request.sequence and len(request.sequence) == 1:
+         print("Single video sequence detected. Returning original video.")
+         video_name = request.sequence[0]['video']
+         return {"message": "Video rendered successfully", "video_url": f"/videos/{video_name}?session={session_id}"}
+
+    output_video = render_video(
+        state['n_frame_similarities'],
+        state['n_frame_count'],
+        state['verified_matches'],
+        state['video_files'],
+        state['csv_files'],
+        state['video_file_mapping'],
+        state['best_vectors'],
+        state.get('transition_scores'),
+        output_json=os.path.join(sessions.output_dir(session_id), "output_pose.json"),
+        output_video=os.path.join(sessions.output_dir(session_id), "combined_video.mp4"),
+        custom_order=custom_order,
+        planner=request.planner if request else PLANNER
+    )
+    
+    return {"message": "Video rendered successfully", "video_url": result_url(session_id, output_video)}
+
+@app.post("/process/render")
+async def process_render(request: RenderRequest = None, session_id: str = Depends(require_session)):
+    if request:
+        check_planner(request.planner)
+    return job_response(jobs.submit("render", run_render, session_id, request, owner=session_id))
+
+def owned_job(job_id, session_id):
+    # jobs of other sessions are reported as missing, so their ids cannot be probed
+    job = jobs.get(job_id)
+    if job is None or job.owner != session_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, session_id: str = Depends(require_session)):
+    return convert_numpy(owned_job(job_id, session_id).to_dict())
+
+# interval of the progress event stream
+PROGRESS_INTERVAL = 0.5
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, session_id: str = Depends(require_session)):
+    """
+    Server-Sent Events: the job status with per-stage, per-video progress
+    (frames done / total, fps, eta) every PROGRESS_INTERVAL seconds until it finishes.
+    """
+    job = owned_job(job_id, session_id)
+
+    async def events():
+        while True:
+            state = job.to_dict()
+            if state["status"] not in jobs.FINISHED:
+                state.pop("result")
+            yield f"data: {json.dumps(convert_numpy(state))}\n\n"
+            if state["status"] in jobs.FINISHED:
+                break
+            await asyncio.sleep(PROGRESS_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, session_id: str = Depends(require_session)):
+    owned_job(job_id, session_id)
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return convert_numpy(job.to_dict())
+
+RENDITIONS = ("original", "proxy")
+
+async def media_response(request, file_path, rendition):
+    if rendition not in RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown rendition '{rendition}', expected one of {list(RENDITIONS)}")
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    if rendition == "proxy":
+        # encoded on first request, then served from the analysis cache
+        proxy_file = await asyncio.to_thread(proxy.proxy_path, file_path)
+        if proxy_file is not None:
+            file_path = proxy_file
+        else:
+            print(f"No proxy for {file_path}, serving the original")
+    return media.file_response(request, file_path)
 
 @app.get("/result/{filename}")
-async def get_result(filename: str):
-    file_path = os.path.join(OUTPUT_DIR, filename)
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="File not found")
+async def get_result(filename: str, request: Request, rendition: str = "original", session_id: str = Depends(require_session)):
+    file_path = os.path.join(sessions.output_dir(session_id), os.path.basename(filename))
+    return await media_response(request, file_path, rendition)
 
 @app.get("/videos/{filename}")
-async def get_source_video(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(file_path):
-        return FileResponse(file_path)
-    raise HTTPException(status_code=404, detail="File not found")
+async def get_source_video(filename: str, request: Request, rendition: str = "original", session_id: str = Depends(require_session)):
+    file_path = os.path.join(sessions.upload_dir(session_id), os.path.basename(filename))
+    return await media_response(request, file_path, rendition)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,74 @@
+import os
+import re
+import shutil
+import time
+import uuid
+
+# One workspace per client session:
+#   <SESSIONS_DIR>/<session id>/data/     uploaded videos
+#   <SESSIONS_DIR>/<session id>/output/   edit json, rendered video, verified matches
+#   <SESSIONS_DIR>/<session id>/state.pkl analysis state for the render step
+# Analysis artifacts stay in the shared, content addressed analysis cache.
+SESSIONS_DIR = os.environ.get(
+    "CROSS_EDITOR_SESSIONS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions"),
+)
+# sessions untouched for this many seconds are deleted (unless a job still runs for them)
+SESSION_TTL = int(os.environ.get("CROSS_EDITOR_SESSION_TTL", 6 * 60 * 60))
+CLEANUP_INTERVAL = 10 * 60
+
+_SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def create_session():
+    session_id = uuid.uuid4().hex
+    os.makedirs(upload_dir(session_id))
+    os.makedirs(output_dir(session_id))
+    return session_id
+
+
+def session_dir(session_id):
+    return os.path.join(SESSIONS_DIR, session_id)
+
+
+def upload_dir(session_id):
+    return os.path.join(session_dir(session_id), "data")
+
+
+def output_dir(session_id):
+    return os.path.join(session_dir(session_id), "output")
+
+
+def state_path(session_id):
+    return os.path.join(session_dir(session_id), "state.pkl")
+
+
+def exists(session_id):
+    return bool(session_id) and _SESSION_ID.match(session_id) is not None and os.path.isdir(session_dir(session_id))
+
+
+def touch(session_id):
+    os.utime(session_dir(session_id))
+
+
+def clear_uploads(session_id):
+    shutil.rmtree(upload_dir(session_id), ignore_errors=True)
+    os.makedirs(upload_dir(session_id), exist_ok=True)
+
+
+def cleanup_expired(active_sessions=()):
+    """Delete the workspaces of sessions idle for longer than SESSION_TTL."""
+    if not os.path.isdir(SESSIONS_DIR):
+        return []
+    now = time.time()
+    removed = []
+    for session_id in os.listdir(SESSIONS_DIR):
+        path = session_dir(session_id)
+        if session_id in active_sessions or not os.path.isdir(path):
+            continue
+        if now - os.path.getmtime(path) > SESSION_TTL:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(session_id)
+    if removed:
+        print(f"Removed {len(removed)} expired session(s).")
+    return removed
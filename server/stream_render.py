@@ -0,0 +1,264 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import jobs
+from pose.progress import Reporter
+from pose.video_io import ffmpeg_binary, ffprobe_binary, keyframe_times
+
+# Renderer for the edit JSON that does not decode whole sources: each segment is
+# copied packet for packet between keyframes, and only the frames between a cut
+# and the next keyframe are re-encoded. Pieces are written as MPEG-TS (parameter
+# sets in-band, so copied and re-encoded pieces can follow each other) and joined
+# with the concat demuxer and -c copy.
+#   "smart"    - frame accurate; re-encodes the partial GOPs at both ends of a segment
+#   "keyframe" - moves every cut to the closest keyframe of its stream; no encoding
+COPY_MODE = "smart"
+# encoders for the re-encoded GOP heads / tails (h264 sources only):
+# (codec, args, {ffprobe profile: -profile:v value}, pixel formats it can write).
+# The re-encoded frames must use the source's profile, level and pixel format, or
+# the decoder would meet a different SPS in the middle of the joined stream.
+COPY_ENCODERS = (
+    ("libx264", ["-preset", "veryfast", "-crf", "18"], {
+        "Constrained Baseline": "baseline",
+        "Baseline": "baseline",
+        "Main": "main",
+        "High": "high",
+        "High 10": "high10",
+        "High 4:2:2": "high422",
+        "High 4:4:4 Predictive": "high444",
+    }, ("yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p", "yuv420p10le", "yuv422p10le", "yuv444p10le")),
+    ("libopenh264", ["-b:v", "8M"], {
+        "Constrained Baseline": "constrained_baseline",
+        "Main": "main",
+        "High": "high",
+    }, ("yuv420p",)),
+)
+# sources are only joined if their frame rates differ by less than this
+FPS_TOLERANCE = 0.01
+ANNEXB_FILTERS = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+
+
+def stream_info(video_path):
+    """Codec parameters of the first video / audio stream that must match for a stream copy join."""
+    cmd = [
+        ffprobe_binary(), "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,profile,level,width,height,pix_fmt,avg_frame_rate,sample_rate,channels",
+        "-of", "json", video_path,
+    ]
+    try:
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stdout
+        streams = json.loads(output).get("streams", [])
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    audio = next((stream for stream in streams if stream.get("codec_type") == "audio"), None)
+    if video is None:
+        return None
+    num, _, den = (video.get("avg_frame_rate") or "0/1").partition("/")
+    fps = float(num) / float(den) if float(den or 0) else 0.0
+    return {
+        "codec": video.get("codec_name"),
+        "profile": video.get("profile"),
+        "level": video.get("level"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "pix_fmt": video.get("pix_fmt"),
+        "fps": fps,
+        "audio": None if audio is None else {
+            "codec": audio.get("codec_name"),
+            "sample_rate": audio.get("sample_rate"),
+            "channels": audio.get("channels"),
+        },
+    }
+
+
+def incompatibility(infos, mode=COPY_MODE):
+    """Why the sources cannot be joined by stream copy, or None if they can."""
+    if any(info is None for info in infos):
+        return "a source could not be probed"
+    first = infos[0]
+    if not first["fps"]:
+        return "unknown frame rate"
+    for info in infos[1:]:
+        for key in ("codec", "profile", "level", "width", "height", "pix_fmt"):
+            if info[key] != first[key]:
+                return f"{key} differs ({first[key]} / {info[key]})"
+        if abs(info["fps"] - first["fps"]) >= FPS_TOLERANCE:
+            return f"frame rate differs ({first['fps']:.3f} / {info['fps']:.3f})"
+        if info["audio"] != first["audio"]:
+            return "audio streams differ"
+    if mode == "smart":
+        if first["codec"] != "h264":
+            return f"cannot re-encode GOP heads for {first['codec']}"
+        if not _piece_encoders(first):
+            return f"no encoder matches {first['profile']} / {first['pix_fmt']}"
+        if _level_arg(first["level"]) is None:
+            return f"unknown level {first['level']}"
+    return None
+
+
+def _piece_encoders(info):
+    """[(codec, args), ...] of COPY_ENCODERS that can write the source's profile and pixel format."""
+    return [
+        (codec, [*codec_args, "-profile:v", profiles[info["profile"]], "-pix_fmt", info["pix_fmt"]])
+        for codec, codec_args, profiles, pix_fmts in COPY_ENCODERS
+        if info["profile"] in profiles and info["pix_fmt"] in pix_fmts
+    ]
+
+
+def _level_arg(level):
+    # ffprobe reports level_idc, e.g. 31 for level 3.1 (9 is level 1b)
+    if not isinstance(level, int) or level <= 0:
+        return None
+    return "1b" if level == 9 else f"{level // 10}.{level % 10}"
+
+
+def timeline(data):
+    """[(file, start, end), ...] of the edit JSON, end None meaning the end of the stream."""
+    streams = data["streams"]
+    cross_points = data["cross_points"]
+    if not cross_points:
+        return [(streams[0]["file"], 0.0, None)]
+    segments = [(streams[0]["file"], 0.0, cross_points[0]["time_stamp"])]
+    for i, cross_point in enumerate(cross_points):
+        end = cross_points[i + 1]["time_stamp"] if i < len(cross_points) - 1 else None
+        segments.append((streams[cross_point["next_stream"]]["file"], cross_point["time_stamp"], end))
+    return [(file, start, end) for file, start, end in segments if end is None or end > start]
+
+
+def segment_pieces(keyframes, start, end, fps, mode=COPY_MODE):
+    """
+    Split the segment [start, end) (end None: to the end of the stream) into
+    ("copy" | "encode", start, end) pieces. Copied pieces start on a keyframe and end
+    on the next piece's keyframe, so no reference frame is cut off.
+    """
+    half = 0.5 / fps
+    if mode == "keyframe":
+        def snap(t):
+            return min(keyframes, key=lambda k: abs(k - t)) if keyframes else t
+        start = snap(start)
+        end = snap(end) if end is not None else None
+        return [("copy", start, end)] if end is None or end > start else []
+
+    # keyframes of the segment, including one right on its end
+    inside = [k for k in keyframes if start - half <= k and (end is None or k <= end + half)]
+    if not inside:
+        return [("encode", start, end)]
+    first, last = inside[0], inside[-1]
+    pieces = []
+    if first - start > half:
+        pieces.append(("encode", start, first))
+    if end is None:
+        # nothing is cut off at the end of the stream
+        pieces.append(("copy", first, None))
+        return pieces
+    if last > first:
+        pieces.append(("copy", first, last))
+    if end - last > half:
+        if pieces and pieces[-1][0] == "encode":
+            # single keyframe inside the segment: one encode instead of two
+            return [("encode", start, end)]
+        pieces.append(("encode", last, end))
+    return pieces
+
+
+def _run(cmd, description):
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None)
+        print(f"{description} failed: {stderr.decode(errors='replace').strip() if stderr else e}")
+        return False
+
+
+def _copy_piece(video_file, start, end, info, output_path):
+    half = 0.5 / info["fps"]
+    # seek just past the keyframe so the demuxer starts exactly on it
+    cmd = [ffmpeg_binary(), "-y", "-v", "error", "-ss", f"{start + half:.6f}", "-i", video_file]
+    if end is not None:
+        cmd += ["-t", f"{end - start - half:.6f}"]
+    cmd += ["-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"]
+    if info["codec"] in ANNEXB_FILTERS:
+        cmd += ["-bsf:v", ANNEXB_FILTERS[info["codec"]]]
+    cmd += ["-avoid_negative_ts", "make_zero", "-f", "mpegts", output_path]
+    return _run(cmd, f"Copying {os.path.basename(video_file)} [{start:.3f}, {end})")
+
+
+def _encode_piece(video_file, start, end, info, output_path):
+    for codec, codec_args in _piece_encoders(info):
+        cmd = [ffmpeg_binary(), "-y", "-v", "error", "-ss", f"{start:.6f}", "-i", video_file]
+        if end is not None:
+            cmd += ["-t", f"{end - start:.6f}"]
+        # only the video is re-encoded; the source audio is copied as in the copied pieces
+        cmd += ["-map", "0:v:0", "-map", "0:a:0?", "-c:v", codec, *codec_args,
+                "-level", _level_arg(info["level"]), "-r", f"{info['fps']:.6f}", "-c:a", "copy"]
+        cmd += ["-f", "mpegts", output_path]
+        if _run(cmd, f"Encoding {os.path.basename(video_file)} [{start:.3f}, {end}) with {codec}"):
+            return True
+    return False
+
+
+def create_stream_copy_video(json_file, output_file, mode=COPY_MODE):
+    """
+    Render the edit JSON by stream copy. Returns False, without writing output_file,
+    if the sources cannot be joined this way (the caller then falls back to moviepy).
+    """
+    try:
+        ffmpeg_binary()
+    except FileNotFoundError as e:
+        print(f"Stream copy rendering not possible: {e}.")
+        return False
+
+    with open(json_file, "r") as f:
+        data = json.load(f)
+
+    segments = timeline(data)
+    files = list(dict.fromkeys(file for file, _, _ in segments))
+    infos = {file: stream_info(file) for file in files}
+    reason = incompatibility([infos[file] for file in files], mode)
+    if reason is not None:
+        print(f"Stream copy rendering not possible: {reason}.")
+        return False
+
+    keyframes = {file: keyframe_times(file) for file in files}
+    pieces = [
+        (file, kind, piece_start, piece_end)
+        for file, start, end in segments
+        for kind, piece_start, piece_end in segment_pieces(keyframes[file], start, end, infos[file]["fps"], mode)
+    ]
+    copied = sum(1 for piece in pieces if piece[1] == "copy")
+    print(f"Stream copy rendering: {len(segments)} segments, {copied} copied / {len(pieces) - copied} re-encoded pieces.")
+
+    reporter = Reporter("render", None, len(pieces) + 1)
+    work_dir = tempfile.mkdtemp(prefix="render_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        piece_files = []
+        for index, (file, kind, start, end) in enumerate(pieces):
+            jobs.checkpoint()
+            piece_file = os.path.join(work_dir, f"{index:05d}.ts")
+            write_piece = _copy_piece if kind == "copy" else _encode_piece
+            if not write_piece(file, start, end, infos[file], piece_file):
+                return False
+            piece_files.append(piece_file)
+            reporter.update(index + 1)
+
+        list_file = os.path.join(work_dir, "pieces.txt")
+        with open(list_file, "w") as f:
+            for piece_file in piece_files:
+                escaped = piece_file.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        cmd = [ffmpeg_binary(), "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy"]
+        audio = infos[files[0]]["audio"]
+        if audio is not None and audio["codec"] == "aac":
+            cmd += ["-bsf:a", "aac_adtstoasc"]
+        cmd += ["-movflags", "+faststart", output_file]
+        if not _run(cmd, "Joining the pieces"):
+            return False
+        reporter.update(len(pieces) + 1, force=True)
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import pytest
+import jobs
+from pose import analysis_cache
+
+PARAMS = {"model": "yolov8n-pose.pt", "conf": 0.5}
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def write_video(path, content=b"\x00\x00\x00\x18ftypmp42" * 1000):
+    path.write_bytes(content)
+    return str(path)
+
+
+def artifact_name(name):
+    return f"{name}_keypoints.npy"
+
+
+def run_stage(video, params=PARAMS, payload=b"keypoints"):
+    """split_cached + write + commit, as the analysis stages do; returns the artifact path."""
+    cached, missing = analysis_cache.split_cached([video], "pose", params, artifact_name)
+    if video in cached:
+        return cached[video], True
+    artifact = os.path.join(missing[video], artifact_name(analysis_cache.cache_name(video)))
+    with open(artifact, "wb") as f:
+        f.write(payload)
+    artifact, = analysis_cache.commit(video, "pose", params, [artifact])
+    return artifact, False
+
+
+def test_miss_then_hit(cache_dir, tmp_path):
+    video = write_video(tmp_path / "a.mp4")
+    sha256 = analysis_cache.file_hash(video)
+    assert not analysis_cache.has_video(sha256)
+
+    cached, missing = analysis_cache.split_cached([video], "pose", PARAMS, artifact_name)
+    assert cached == {}
+    staging = missing[video]
+    assert os.path.basename(staging).startswith(analysis_cache.STAGING_PREFIX)
+    # 커밋 전에는 미완성 항목이므로 캐시 미스
+    assert not analysis_cache.has_video(sha256)
+
+    artifact = os.path.join(staging, artifact_name(analysis_cache.cache_name(video)))
+    with open(artifact, "wb") as f:
+        f.write(b"keypoints")
+    committed, = analysis_cache.commit(video, "pose", PARAMS, [artifact])
+
+    entry = analysis_cache.entry_dir(video, "pose", PARAMS)
+    assert committed == os.path.join(entry, os.path.basename(artifact))
+    assert os.path.exists(os.path.join(entry, analysis_cache.META_FILE))
+    assert not os.path.exists(staging)
+    assert analysis_cache.has_video(sha256)
+    assert not analysis_cache.has_video(sha256, stages=("face",))
+
+    assert run_stage(video) == (committed, True)
+    assert analysis_cache.lookup(video, "pose", PARAMS, os.path.basename(committed)) == committed
+
+
+def test_same_content_under_another_name_hits(cache_dir, tmp_path):
+    first = write_video(tmp_path / "first.mp4")
+    second = write_video(tmp_path / "second.mp4")
+    artifact, hit = run_stage(first)
+    assert not hit
+    assert run_stage(second) == (artifact, True)
+
+
+def test_other_params_or_content_miss(cache_dir, tmp_path):
+    video = write_video(tmp_path / "a.mp4")
+    other = write_video(tmp_path / "b.mp4", b"other content")
+    run_stage(video)
+    assert not run_stage(video, {**PARAMS, "conf": 0.6})[1]
+    assert not run_stage(other)[1]
+
+
+def test_second_commit_keeps_first_entry(cache_dir, tmp_path):
+    video = write_video(tmp_path / "a.mp4")
+    _, first_missing = analysis_cache.split_cached([video], "pose", PARAMS, artifact_name)
+    _, second_missing = analysis_cache.split_cached([video], "pose", PARAMS, artifact_name)
+    artifacts = []
+    for staging, payload in ((first_missing[video], b"first"), (second_missing[video], b"second")):
+        artifact = os.path.join(staging, artifact_name(analysis_cache.cache_name(video)))
+        with open(artifact, "wb") as f:
+            f.write(payload)
+        artifacts.append(artifact)
+
+    committed, = analysis_cache.commit(video, "pose", PARAMS, [artifacts[0]])
+    assert analysis_cache.commit(video, "pose", PARAMS, [artifacts[1]]) == [committed]
+    with open(committed, "rb") as f:
+        assert f.read() == b"first"
+    assert not os.path.exists(second_missing[video])
+
+
+def test_registered_hash_skips_reading(cache_dir, tmp_path):
+    video = write_video(tmp_path / "upload.mp4")
+    analysis_cache.register_hash(video, "f" * 64)
+    assert analysis_cache.file_hash(video) == "f" * 64
+    assert analysis_cache.cache_name(video) == "f" * 16
+
+
+def test_cancelled_run_discards_uncommitted_staging(cache_dir, tmp_path):
+    videos = [write_video(tmp_path / "a.mp4"), write_video(tmp_path / "b.mp4", b"other content")]
+    halfway = threading.Event()
+
+    def run():
+        # like main.run_analysis: the first video is committed, the second is still running when the job is cancelled
+        staging = []
+        try:
+            _, missing = analysis_cache.split_cached(videos, "pose", PARAMS, artifact_name)
+            staging.extend(missing.values())
+            artifacts = []
+            for video in videos:
+                artifacts.append(os.path.join(missing[video], artifact_name(analysis_cache.cache_name(video))))
+                with open(artifacts[-1], "wb") as f:
+                    f.write(b"keypoints")
+            analysis_cache.commit(videos[0], "pose", PARAMS, artifacts[:1])
+            halfway.set()
+            while True:
+                jobs.checkpoint()
+                time.sleep(0.01)
+        finally:
+            analysis_cache.discard(staging)
+
+    job = jobs.submit("analyze", run)
+    assert halfway.wait(5)
+    jobs.cancel(job.id)
+    job.future.result(timeout=5)
+
+    assert job.status == jobs.CANCELLED
+    assert run_stage(videos[0])[1]
+    entry = analysis_cache.entry_dir(videos[1], "pose", PARAMS)
+    assert not any(name.startswith(analysis_cache.STAGING_PREFIX) for name in os.listdir(entry))
+    assert not run_stage(videos[1])[1]
+
+
+def test_per_video_params(cache_dir, tmp_path):
+    proxied = write_video(tmp_path / "a.mp4")
+    source = write_video(tmp_path / "b.mp4", b"other content")
+    params = {proxied: {**PARAMS, "input": "proxy"}, source: {**PARAMS, "input": "source"}}
+    run_stage(proxied, params[proxied])
+    run_stage(source, params[source])
+
+    cached, missing = analysis_cache.split_cached([proxied, source], "pose", params.get, artifact_name)
+    assert set(cached) == {proxied, source} and not missing
+    cached, missing = analysis_cache.split_cached([proxied, source], "pose", {**PARAMS, "input": "proxy"}, artifact_name)
+    assert set(cached) == {proxied} and set(missing) == {source}
+    analysis_cache.discard(missing.values())
@@ -0,0 +1,52 @@
+import numpy as np
+from pose.keypoint_store import (
+    build_frame_index, export_csv, keypoint_store_path, load_keypoint_table, load_keypoints, person_counts,
+    save_keypoints,
+)
+
+
+def sample_frames():
+    rng = np.random.default_rng(0)
+    return [
+        (0, rng.uniform(0, 1000, (2, 16, 3))),
+        (1, np.zeros((0, 16, 3))),
+        (4, rng.uniform(0, 1000, (1, 16, 3))),
+        (5, rng.uniform(0, 1000, (3, 16, 3))),
+    ]
+
+
+def test_store_round_trip(tmp_path):
+    frame_data = sample_frames()
+    path = save_keypoints(keypoint_store_path("clip.mp4", str(tmp_path)), frame_data)
+    assert path.endswith("clip_keypoints.npy")
+
+    frame_numbers, offsets, keypoints = load_keypoints(path)
+    np.testing.assert_array_equal(frame_numbers, [0, 1, 4, 5])
+    np.testing.assert_array_equal(offsets, [0, 2, 2, 3, 6])
+    assert keypoints.dtype == np.float32
+    for k, (_, expected) in enumerate(frame_data):
+        np.testing.assert_array_equal(keypoints[offsets[k]:offsets[k + 1]], expected.astype(np.float32))
+
+    counts_frames, counts = person_counts(path)
+    np.testing.assert_array_equal(counts_frames, [0, 1, 4, 5])
+    np.testing.assert_array_equal(counts, [2, 0, 1, 3])
+
+
+def test_csv_export_loads_back(tmp_path):
+    frame_data = sample_frames()
+    path = save_keypoints(keypoint_store_path("clip.mp4", str(tmp_path)), frame_data)
+    csv_path = export_csv(path)
+
+    # CSV 에는 사람이 없는 프레임의 행이 없음
+    frame_numbers, offsets, keypoints = load_keypoint_table(csv_path)
+    np.testing.assert_array_equal(frame_numbers, [0, 4, 5])
+    np.testing.assert_array_equal(offsets, [0, 2, 3, 6])
+    expected = np.concatenate([block for _, block in frame_data]).astype(np.float32)
+    np.testing.assert_allclose(keypoints, expected, rtol=1e-6)
+
+
+def test_build_frame_index_keeps_row_order():
+    order, frame_numbers, offsets = build_frame_index([3, 1, 3, 1, 2])
+    np.testing.assert_array_equal(frame_numbers, [1, 2, 3])
+    np.testing.assert_array_equal(offsets, [0, 2, 3, 5])
+    np.testing.assert_array_equal(order, [1, 3, 4, 0, 2])
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import pytest
+
+pytest.importorskip("fastapi")
+from fastapi import HTTPException
+import media
+
+DATA = os.urandom(300_000)
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {name.replace("_", "-"): value for name, value in headers.items()}
+
+
+def body(response):
+    async def collect():
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def test_full_response(video):
+    response = media.file_response(FakeRequest(), video)
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-length"] == str(len(DATA))
+    assert body(response) == DATA
+
+
+def test_not_modified(video):
+    response = media.file_response(FakeRequest(), video)
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+    assert media.file_response(FakeRequest(if_none_match=etag), video).status_code == 304
+    assert media.file_response(FakeRequest(if_none_match=f'"other", W/{etag}'), video).status_code == 304
+    assert media.file_response(FakeRequest(if_modified_since=last_modified), video).status_code == 304
+    assert media.file_response(FakeRequest(if_none_match='"other"'), video).status_code == 200
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=100-199", 100, 199),
+    ("bytes=-10", len(DATA) - 10, len(DATA) - 1),
+    ("bytes=299990-", 299990, len(DATA) - 1),
+    ("bytes=0-99999999", 0, len(DATA) - 1),
+])
+def test_range(video, header, start, end):
+    response = media.file_response(FakeRequest(range=header), video)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+    assert body(response) == DATA[start:end + 1]
+
+
+def test_if_range(video):
+    etag = media.file_response(FakeRequest(), video).headers["etag"]
+    assert media.file_response(FakeRequest(range="bytes=0-9", if_range=etag), video).status_code == 206
+    # 바뀐 파일이면 범위 대신 전체 파일
+    assert media.file_response(FakeRequest(range="bytes=0-9", if_range='"old"'), video).status_code == 200
+
+
+def test_unsatisfiable_range(video):
+    with pytest.raises(HTTPException) as error:
+        media.file_response(FakeRequest(range=f"bytes={len(DATA)}-"), video)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == f"bytes */{len(DATA)}"
+
+
+def test_missing_file(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        media.file_response(FakeRequest(), str(tmp_path / "missing.mp4"))
+    assert error.value.status_code == 404
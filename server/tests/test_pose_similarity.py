@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+from pose.pose_similarity import batch_pose_similarity, load_keypoint_array
+
+fastdtw = pytest.importorskip("fastdtw").fastdtw
+distance = pytest.importorskip("scipy.spatial.distance")
+
+WIDTH = 1920
+HEIGHT = 1080
+POSITION_THRESHOLD = 0.05
+SIZE_THRESHOLD = 0.05
+
+
+def reference_similarity(keypoints1, keypoints2, width, height, position_threshold, size_threshold, frame_size2=None):
+    """The former per-pair implementation (fastdtw + scipy, one person pair at a time)."""
+    width2, height2 = frame_size2 or (width, height)
+    keypoints1 = [(0.0 if not np.isfinite(x) else x, 0.0 if not np.isfinite(y) else y) for x, y in keypoints1]
+    keypoints2 = [(0.0 if not np.isfinite(x) else x, 0.0 if not np.isfinite(y) else y) for x, y in keypoints2]
+
+    def centroid(keypoints, w, h):
+        return (sum(x for x, _ in keypoints) / len(keypoints) / w, sum(y for _, y in keypoints) / len(keypoints) / h)
+
+    def size(keypoints, w, h):
+        xs = [x for x, _ in keypoints]
+        ys = [y for _, y in keypoints]
+        return ((max(xs) - min(xs)) / w, (max(ys) - min(ys)) / h)
+
+    position_diff = distance.euclidean(centroid(keypoints1, width, height), centroid(keypoints2, width2, height2))
+    size_diff = distance.euclidean(size(keypoints1, width, height), size(keypoints2, width2, height2))
+    if not (position_diff < position_threshold and size_diff < size_threshold):
+        return float('inf'), position_diff, size_diff
+
+    def cosine(part1, part2):
+        flat1 = np.array(part1).flatten()
+        flat2 = np.array(part2).flatten()
+        if np.dot(flat1, flat1) == 0 or np.dot(flat2, flat2) == 0:
+            return 1.0
+        return distance.cosine(flat1, flat2)
+
+    scores = []
+    for start, count in ((0, 5), (5, 7), (12, 4)):
+        part1 = [(x / width, y / height) for x, y in keypoints1[start:start + count]]
+        part2 = [(x / width2, y / height2) for x, y in keypoints2[start:start + count]]
+        dtw_distance, _ = fastdtw(part1, part2, dist=distance.euclidean)
+        scores.append(dtw_distance + cosine(part1, part2))
+    return sum(scores) / 3, position_diff, size_diff
+
+
+def random_pairs(rng, count):
+    # 대부분은 필터를 통과하는 비슷한 자세, 일부는 멀리 떨어진 사람 / 누락된 키포인트
+    keypoints1 = rng.uniform(0, 1, (count, 16, 2)) * 150 + rng.uniform(200, 1500, (count, 1, 2))
+    keypoints2 = keypoints1 + rng.normal(0, 4, (count, 16, 2))
+    keypoints2[::5] += 600
+    keypoints1[1::7, 3] = np.nan
+    keypoints2[2::9, :5] = 0.0
+    return keypoints1, keypoints2
+
+
+def assert_matches_reference(result, keypoints1, keypoints2, width, height, frame_size2=None):
+    similarity, position_diff, size_diff = result
+    for k in range(len(keypoints1)):
+        expected = reference_similarity(keypoints1[k], keypoints2[k], width, height,
+                                        POSITION_THRESHOLD, SIZE_THRESHOLD, frame_size2)
+        np.testing.assert_allclose([similarity[k], position_diff[k], size_diff[k]], expected, rtol=1e-9, atol=1e-12)
+
+
+def test_batch_matches_per_pair_reference():
+    keypoints1, keypoints2 = random_pairs(np.random.default_rng(0), 60)
+    result = batch_pose_similarity(keypoints1, keypoints2, WIDTH, HEIGHT, POSITION_THRESHOLD, SIZE_THRESHOLD)
+    assert np.isfinite(result[0]).any() and np.isinf(result[0]).any()
+    assert_matches_reference(result, keypoints1, keypoints2, WIDTH, HEIGHT)
+
+
+def test_batch_with_second_frame_size():
+    keypoints1, keypoints2 = random_pairs(np.random.default_rng(1), 40)
+    keypoints2 = keypoints2 * (1280 / WIDTH)
+    result = batch_pose_similarity(keypoints1, keypoints2, WIDTH, HEIGHT, POSITION_THRESHOLD, SIZE_THRESHOLD,
+                                   frame_size2=(1280, 720))
+    assert np.isfinite(result[0]).any()
+    assert_matches_reference(result, keypoints1, keypoints2, WIDTH, HEIGHT, (1280, 720))
+
+
+def test_per_pair_frame_sizes_equal_scalar():
+    keypoints1, keypoints2 = random_pairs(np.random.default_rng(2), 30)
+    scalar = batch_pose_similarity(keypoints1, keypoints2, WIDTH, HEIGHT, POSITION_THRESHOLD, SIZE_THRESHOLD)
+    per_pair = batch_pose_similarity(keypoints1, keypoints2, np.full(30, WIDTH), np.full(30, HEIGHT),
+                                     POSITION_THRESHOLD, SIZE_THRESHOLD)
+    for expected, actual in zip(scalar, per_pair):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_load_keypoint_array_pads_persons():
+    keypoints = np.arange(3 * 16 * 3, dtype=np.float32).reshape(3, 16, 3)
+    tables = [
+        (np.array([0, 2]), np.array([0, 2, 3]), keypoints),
+        (np.array([1, 2]), np.array([0, 0, 1]), keypoints[:1]),
+    ]
+    array, person_counts, frame_numbers = load_keypoint_array(tables)
+    np.testing.assert_array_equal(frame_numbers, [0, 2])
+    np.testing.assert_array_equal(person_counts, [[2, 1], [0, 1]])
+    np.testing.assert_array_equal(array[0, 0, :2], keypoints[:2, :, :2])
+    np.testing.assert_array_equal(array[0, 1, 0], keypoints[2, :, :2])
+    assert np.isnan(array[0, 1, 1]).all() and np.isnan(array[1, 0]).all()
+    np.testing.assert_array_equal(array[1, 1, 0], keypoints[0, :, :2])
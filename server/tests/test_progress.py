@@ -0,0 +1,23 @@
+import pytest
+from pose import progress
+
+
+@pytest.fixture
+def scope():
+    progress.set_scope("job-1")
+    yield "job-1"
+    progress.set_scope(None)
+
+
+def test_snapshot_sums_chunks_and_hides_directories(scope):
+    video = "/srv/sessions/abc/data/clip.mp4"
+    progress.report("pose", video, 10, 50, chunk=0)
+    progress.report("pose", video, 20, 50, chunk=1)
+    progress.report("render", None, 1, 4)
+
+    stages = progress.snapshot(scope)
+    assert [(item["stage"], item["video"], item["done"], item["total"]) for item in stages] == [
+        ("pose", "clip.mp4", 30, 100),
+        ("render", None, 1, 4),
+    ]
+    assert progress.snapshot(None, [video])[0]["video"] == "clip.mp4"
@@ -0,0 +1,25 @@
+import pytest
+from pose import proxy
+
+SIZES = {"source.mp4": (1920, 1080), "proxy.mp4": (640, 360)}
+
+
+@pytest.fixture
+def fake_proxy(monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_ANALYSIS", True)
+    monkeypatch.setattr(proxy, "_frame_size", SIZES.get)
+    monkeypatch.setattr(proxy, "proxy_path", lambda video_path: "proxy.mp4")
+
+
+def test_proxy_input_is_keyed_by_proxy_params(fake_proxy):
+    assert proxy.analysis_input("source.mp4") == ("proxy.mp4", (3.0, 3.0), proxy.PROXY_PARAMS)
+
+
+def test_failed_proxy_falls_back_to_source_key(fake_proxy, monkeypatch):
+    monkeypatch.setattr(proxy, "proxy_path", lambda video_path: None)
+    assert proxy.analysis_input("source.mp4") == ("source.mp4", None, proxy.SOURCE_INPUT)
+
+
+def test_disabled_proxy_uses_source_key(fake_proxy, monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_ANALYSIS", False)
+    assert proxy.analysis_input("source.mp4") == ("source.mp4", None, proxy.SOURCE_INPUT)
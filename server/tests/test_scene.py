@@ -0,0 +1,19 @@
+import numpy as np
+from pose import analysis_cache, scene
+
+
+def test_scene_params_follow_runtime_settings(monkeypatch):
+    before = analysis_cache.params_digest(scene.scene_params("source"))
+    monkeypatch.setattr(scene, "SCENE_METHOD", "histogram")
+    params = scene.scene_params("source")
+    assert params["method"] == "histogram"
+    assert params["threshold"] == scene.SCENE_THRESHOLDS["histogram"]
+    assert analysis_cache.params_digest(params) != before
+
+
+def test_frame_scores_mark_the_cut():
+    frames = np.zeros((4, 8, 8), dtype=np.uint8)
+    frames[2:] = 200
+    for method in scene.SCENE_THRESHOLDS:
+        scores = scene.frame_scores(frames, method)
+        assert np.flatnonzero(scores > scene.SCENE_THRESHOLDS[method]).tolist() == [1]
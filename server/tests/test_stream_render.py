@@ -0,0 +1,78 @@
+import random
+import pytest
+from stream_render import incompatibility, segment_pieces, timeline
+
+FPS = 30.0
+KEYFRAMES = [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def edit(cross_points):
+    return {
+        "streams": [{"file": "a.mp4"}, {"file": "b.mp4"}],
+        "cross_points": [{"time_stamp": time_stamp, "next_stream": stream} for time_stamp, stream in cross_points],
+    }
+
+
+def test_timeline():
+    assert timeline(edit([])) == [("a.mp4", 0.0, None)]
+    assert timeline(edit([(1.0, 1), (2.5, 0)])) == [("a.mp4", 0.0, 1.0), ("b.mp4", 1.0, 2.5), ("a.mp4", 2.5, None)]
+    # 같은 시각의 전환은 길이 0 구간을 남기지 않음
+    assert timeline(edit([(1.0, 1), (1.0, 0)])) == [("a.mp4", 0.0, 1.0), ("a.mp4", 1.0, None)]
+
+
+@pytest.mark.parametrize("start, end, pieces", [
+    (0.0, 2.0, [("copy", 0.0, 2.0)]),
+    (0.5, 2.5, [("encode", 0.5, 1.0), ("copy", 1.0, 2.0), ("encode", 2.0, 2.5)]),
+    (0.2, 0.8, [("encode", 0.2, 0.8)]),
+    (0.5, 1.5, [("encode", 0.5, 1.5)]),
+    (2.5, None, [("encode", 2.5, 3.0), ("copy", 3.0, None)]),
+    (1.0, None, [("copy", 1.0, None)]),
+])
+def test_segment_pieces_smart(start, end, pieces):
+    assert segment_pieces(KEYFRAMES, start, end, FPS, "smart") == pieces
+
+
+def test_segment_pieces_keyframe_mode():
+    assert segment_pieces(KEYFRAMES, 0.4, 2.6, FPS, "keyframe") == [("copy", 0.0, 3.0)]
+    assert segment_pieces(KEYFRAMES, 0.4, None, FPS, "keyframe") == [("copy", 0.0, None)]
+    assert segment_pieces(KEYFRAMES, 0.4, 0.45, FPS, "keyframe") == []
+
+
+def test_segment_pieces_cover_segment():
+    rng = random.Random(0)
+    half = 0.5 / FPS
+    for _ in range(500):
+        keyframes = sorted({round(rng.uniform(0, 10), 3) for _ in range(rng.randint(0, 6))})
+        start = rng.uniform(0, 9)
+        end = rng.choice([None, start + rng.uniform(2 * half, 4)])
+        pieces = segment_pieces(keyframes, start, end, FPS, "smart")
+
+        # a keyframe less than half a frame from a cut is the cut
+        assert abs(pieces[0][1] - start) <= half
+        assert pieces[-1][2] == end if end is None else abs(pieces[-1][2] - end) <= half
+        for (_, _, previous_end), (_, next_start, _) in zip(pieces, pieces[1:]):
+            assert previous_end == next_start
+        for kind, piece_start, piece_end in pieces:
+            if kind == "copy":
+                # copied pieces start and end on keyframes (or at the end of the stream)
+                assert piece_start in keyframes
+                assert piece_end is None or piece_end in keyframes
+
+
+def stream(**changes):
+    info = {"codec": "h264", "profile": "High", "level": 40, "width": 1920, "height": 1080,
+            "pix_fmt": "yuv420p", "fps": 30.0, "audio": {"codec": "aac", "sample_rate": "48000", "channels": 2}}
+    return {**info, **changes}
+
+
+def test_incompatibility():
+    assert incompatibility([stream(), stream()]) is None
+    assert incompatibility([stream(), stream(audio={"codec": "opus", "sample_rate": "48000", "channels": 2})]) is not None
+    assert incompatibility([stream(), stream(level=41)]) is not None
+    assert incompatibility([stream(), stream(fps=25.0)]) is not None
+    assert incompatibility([stream(), None]) is not None
+    # smart 모드는 소스 프로파일로 다시 인코딩할 수 있어야 함
+    assert incompatibility([stream(profile="High 4:4:4 Intra")]) is not None
+    assert incompatibility([stream(profile="High 4:4:4 Intra")], "keyframe") is None
+    assert incompatibility([stream(codec="hevc", profile="Main")]) is not None
+    assert incompatibility([stream(audio={"codec": "mp3", "sample_rate": "44100", "channels": 2})]) is None
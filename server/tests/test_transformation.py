@@ -0,0 +1,120 @@
+import itertools
+import random
+from pose.transformation import find_max_transformation_order, find_weighted_transformation_order, transition_quality
+
+STREAMS = ("a.csv", "b.csv", "c.csv")
+
+
+def random_frame_similarities(rng, frame_count=40, density=0.4):
+    frame_similarities = {}
+    for frame in range(frame_count):
+        if rng.random() < density:
+            pairs = [pair for pair in itertools.permutations(STREAMS, 2) if rng.random() < 0.35]
+            if pairs:
+                frame_similarities[frame] = pairs
+    return frame_similarities
+
+
+def quadratic_max_order(frame_similarities, random_point):
+    """The former O(frames^2) DP, kept as the reference of the linear one."""
+    frames = sorted(frame_similarities.keys())
+    dp = [0] * len(frames)
+    path = [None] * len(frames)
+    for i in range(len(frames)):
+        for j in range(i):
+            if frames[i] - frames[j] >= random_point:
+                for transition in frame_similarities[frames[i]]:
+                    if transition[0] in [pair[1] for pair in frame_similarities[frames[j]]]:
+                        if dp[i] < dp[j] + 1:
+                            dp[i] = dp[j] + 1
+                            path[i] = (frames[j], transition[0], transition[1])
+    if not frames:
+        return []
+    index = max(range(len(frames)), key=dp.__getitem__)
+    optimal_path = []
+    while index is not None and path[index] is not None:
+        optimal_path.append((frames[index], path[index][1], path[index][2]))
+        index = frames.index(path[index][0])
+    optimal_path.reverse()
+    return optimal_path
+
+
+def test_linear_dp_matches_quadratic_reference():
+    rng = random.Random(0)
+    for _ in range(200):
+        frame_similarities = random_frame_similarities(rng)
+        random_point = rng.randint(1, 8)
+        assert find_max_transformation_order(frame_similarities, 40, random_point) == \
+            quadratic_max_order(frame_similarities, random_point)
+
+
+def test_linear_dp_empty():
+    assert find_max_transformation_order({}, 0, 5) == []
+
+
+def chain_value(chain, transition_scores):
+    return sum(transition_quality(transition_scores.get(transition)) for transition in chain)
+
+
+def is_valid_start(transition, min_gap, max_gap, first_stream):
+    # the first segment runs from the start of the video
+    frame, start, _ = transition
+    return ((first_stream is None or start == first_stream) and frame >= max(min_gap, 1)
+            and (max_gap is None or frame <= max_gap))
+
+
+def is_valid_step(transition1, transition2, min_gap, max_gap):
+    (frame1, _, end), (frame2, start, _) = transition1, transition2
+    gap = frame2 - frame1
+    return start == end and gap >= max(min_gap, 1) and (max_gap is None or gap <= max_gap)
+
+
+def is_valid_chain(chain, min_gap, max_gap, first_stream):
+    if chain and not is_valid_start(chain[0], min_gap, max_gap, first_stream):
+        return False
+    return all(is_valid_step(transition1, transition2, min_gap, max_gap) for transition1, transition2 in zip(chain, chain[1:]))
+
+
+def brute_force_best(frame_similarities, transition_scores, min_gap, max_gap, first_stream):
+    transitions = [(frame, start, end) for frame in sorted(frame_similarities)
+                   for start, end in dict.fromkeys(frame_similarities[frame])]
+    best = 0.0
+
+    def extend(chain):
+        nonlocal best
+        best = max(best, chain_value(chain, transition_scores))
+        for transition in transitions:
+            if is_valid_step(chain[-1], transition, min_gap, max_gap):
+                extend(chain + [transition])
+
+    for transition in transitions:
+        if is_valid_start(transition, min_gap, max_gap, first_stream):
+            extend([transition])
+    return best
+
+
+def test_weighted_planner_matches_brute_force():
+    rng = random.Random(1)
+    for _ in range(150):
+        frame_similarities = random_frame_similarities(rng, frame_count=14, density=0.5)
+        transition_scores = {
+            (frame, start, end): {"similarity": rng.random(), "position": rng.random(), "face": rng.choice([0.0, rng.random()])}
+            for frame, pairs in frame_similarities.items() for start, end in pairs
+        }
+        min_gap = rng.randint(1, 4)
+        max_gap = rng.choice([None, min_gap + rng.randint(0, 4)])
+        first_stream = rng.choice([None, *STREAMS])
+
+        chain = find_weighted_transformation_order(frame_similarities, transition_scores, min_gap, max_gap, first_stream)
+        expected = brute_force_best(frame_similarities, transition_scores, min_gap, max_gap, first_stream)
+        assert is_valid_chain(chain, min_gap, max_gap, first_stream)
+        assert abs(chain_value(chain, transition_scores) - expected) < 1e-9
+
+
+def test_weighted_chain_starts_within_max_gap():
+    frame_similarities = {2: [("a", "b")], 20: [("b", "a")], 30: [("a", "b")]}
+    # the longer chain from frame 20 would leave the first 20 frames without a cut
+    assert find_weighted_transformation_order(frame_similarities, {}, 1, 10) == [(2, "a", "b")]
+    assert find_weighted_transformation_order(frame_similarities, {}, 1, None) == [(2, "a", "b"), (20, "b", "a"), (30, "a", "b")]
+    # nor may it start before min_gap frames
+    assert find_weighted_transformation_order(frame_similarities, {}, 5, 25) == [(20, "b", "a"), (30, "a", "b")]
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import pytest
+import sessions
+import uploads
+from pose import analysis_cache
+
+EXTENSIONS = ["mp4", "avi", "mkv", "mov"]
+
+
+@pytest.fixture
+def session_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "SESSIONS_DIR", str(tmp_path / "sessions"))
+    monkeypatch.setattr(analysis_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    # no proxy encode / probing in the background
+    monkeypatch.setattr(uploads, "proxy_path", lambda path: None)
+    monkeypatch.setattr(uploads, "video_metadata", lambda path: None)
+    session_id = sessions.create_session()
+    yield session_id
+    uploads.discard_session(session_id)
+
+
+def upload_file(session_id, filename, content=b"video"):
+    async def run():
+        upload = uploads.create(session_id, filename, EXTENSIONS, len(content))
+
+        async def chunks():
+            yield content
+
+        await uploads.append(upload, 0, chunks())
+        return await uploads.complete(upload)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("filename, stored", [
+    ("clip.mp4", "clip.mp4"),
+    ("../../clip.mov", "clip.mov"),
+    ("IMG_0001.MOV", "IMG_0001.mov"),
+])
+def test_check_filename(filename, stored):
+    assert uploads.check_filename(filename, EXTENSIONS) == stored
+
+
+@pytest.mark.parametrize("filename", ["", ".", "..", "dir/", ".mp4", "notes.txt", "clip"])
+def test_invalid_names_are_rejected(filename):
+    with pytest.raises(uploads.UploadError) as e:
+        uploads.check_filename(filename, EXTENSIONS)
+    assert e.value.status_code == 400
+
+
+def test_duplicate_name_does_not_overwrite(session_id):
+    assert upload_file(session_id, "clip.mp4", b"first")["file"] == "clip.mp4"
+    with pytest.raises(uploads.UploadError) as e:
+        upload_file(session_id, "clip.mp4", b"second")
+    assert e.value.status_code == 409
+    with open(os.path.join(sessions.upload_dir(session_id), "clip.mp4"), "rb") as f:
+        assert f.read() == b"first"
+
+
+def test_name_is_reserved_while_uploading(session_id):
+    uploads.create(session_id, "clip.mp4", EXTENSIONS)
+    with pytest.raises(uploads.UploadError) as e:
+        uploads.create(session_id, "clip.mp4", EXTENSIONS)
+    assert e.value.status_code == 409
+    assert upload_file(session_id, "other.mp4")["file"] == "other.mp4"
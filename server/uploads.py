@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import os
+import threading
+import uuid
+import sessions
+from pose import analysis_cache
+from pose.video_io import probe_metadata, video_metadata
+from pose.proxy import proxy_path
+
+# Resumable uploads: a client creates an upload, sends the file as byte ranges in
+# order (any chunk size, retried from the offset the server reports) and completes
+# it. The content is hashed while it arrives, so the analysis cache recognises the
+# video without reading it again.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# try to read the video headers once this much of the file has arrived
+PROBE_AFTER_BYTES = 4 * 1024 * 1024
+PARTIAL_DIR = ".partial"
+
+_uploads = {}
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _partial_path(session_id, upload_id):
+    return os.path.join(sessions.upload_dir(session_id), PARTIAL_DIR, f"{upload_id}.part")
+
+
+def check_filename(filename, extensions):
+    """
+    Name an upload is stored under: the base name, with a lower-case extension
+    (get_video_files only globs those). UploadError(400) for names that cannot be
+    stored or are not one of extensions.
+    """
+    name = os.path.basename(filename or "")
+    stem, extension = os.path.splitext(name)
+    if not stem or name in (".", ".."):
+        raise UploadError(400, f"Invalid file name '{filename}'")
+    extension = extension[1:].lower()
+    if extension not in extensions:
+        raise UploadError(400, f"Unsupported file type '{filename}', expected one of {list(extensions)}")
+    return f"{stem}.{extension}"
+
+
+def _name_taken(session_id, filename):
+    # a finished file or another upload of the session that will be completed under this name
+    if os.path.exists(os.path.join(sessions.upload_dir(session_id), filename)):
+        return True
+    return any(upload["session_id"] == session_id and upload["filename"] == filename for upload in _uploads.values())
+
+
+def create(session_id, filename, extensions, size=None):
+    """
+    Start an upload of filename (see check_filename). A name that is already used
+    in the session is rejected with 409 instead of overwriting the other file.
+    """
+    filename = check_filename(filename, extensions)
+    upload_id = uuid.uuid4().hex
+    path = _partial_path(session_id, upload_id)
+    upload = {
+        "upload_id": upload_id,
+        "session_id": session_id,
+        "filename": filename,
+        "size": size,
+        "offset": 0,
+        "path": path,
+        "hasher": hashlib.sha256(),
+        "metadata": None,
+        "probing": False,
+        "lock": asyncio.Lock(),
+    }
+    with _lock:
+        if _name_taken(session_id, filename):
+            raise UploadError(409, f"A file named '{filename}' was already uploaded")
+        _uploads[upload_id] = upload
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    return upload
+
+
+def get(session_id, upload_id):
+    with _lock:
+        upload = _uploads.get(upload_id)
+    if upload is None or upload["session_id"] != session_id:
+        raise UploadError(404, "Upload not found")
+    return upload
+
+
+def status(upload):
+    return {
+        "upload_id": upload["upload_id"],
+        "filename": upload["filename"],
+        "size": upload["size"],
+        "offset": upload["offset"],
+        "metadata": upload["metadata"],
+    }
+
+
+def _write(path, chunk, hasher):
+    with open(path, "ab") as f:
+        f.write(chunk)
+    hasher.update(chunk)
+
+
+def _probe(upload):
+    # runs on a worker thread; the partial file is readable while more chunks arrive
+    upload["metadata"] = probe_metadata(upload["path"])
+    upload["probing"] = False
+
+
+async def append(upload, offset, chunks):
+    """
+    Append the byte stream chunks (an async iterator) at offset. The offset must
+    equal the bytes received so far; otherwise the client resumes from status().
+    """
+    async with upload["lock"]:
+        if offset != upload["offset"]:
+            raise UploadError(409, f"Expected offset {upload['offset']}")
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if upload["size"] is not None and upload["offset"] + len(chunk) > upload["size"]:
+                raise UploadError(400, "More data than the declared size")
+            await asyncio.to_thread(_write, upload["path"], chunk, upload["hasher"])
+            upload["offset"] += len(chunk)
+
+        # read the headers early (mp4 files with the moov atom in front can be probed long before the end)
+        if upload["metadata"] is None and not upload["probing"] and upload["offset"] >= PROBE_AFTER_BYTES:
+            upload["probing"] = True
+            asyncio.get_running_loop().run_in_executor(None, _probe, upload)
+    return status(upload)
+
+
+async def complete(upload):
+    """Move the finished upload into the session's upload directory and register its hash."""
+    async with upload["lock"]:
+        if upload["size"] is not None and upload["offset"] != upload["size"]:
+            raise UploadError(409, f"Upload incomplete: {upload['offset']} of {upload['size']} bytes")
+        destination = os.path.join(sessions.upload_dir(upload["session_id"]), upload["filename"])
+        # create() reserved the name; this only catches a file put there by other means
+        if os.path.exists(destination):
+            raise UploadError(409, f"A file named '{upload['filename']}' was already uploaded")
+        os.replace(upload["path"], destination)
+        sha256 = upload["hasher"].hexdigest()
+        # before the metadata / proxy entries below are written for this hash
+        cached = analysis_cache.has_video(sha256)
+        analysis_cache.register_hash(destination, sha256)
+        with _lock:
+            _uploads.pop(upload["upload_id"], None)
+
+    # the proxy (preview and analysis input) is encoded in the background right away
+    asyncio.get_running_loop().run_in_executor(None, proxy_path, destination)
+
+    # probed from the complete file once more and cached; every later stage reads this
+    metadata = await asyncio.to_thread(video_metadata, destination)
+    return {
+        "file": upload["filename"],
+        "size": upload["offset"],
+        "sha256": sha256,
+        "cached": cached,
+        "metadata": metadata,
+    }
+
+
+async def save_stream(session_id, filename, read, extensions):
+    """Store one multipart file of the plain /upload endpoint, hashing it on the way."""
+    upload = create(session_id, filename, extensions)
+
+    async def chunks():
+        while True:
+            chunk = await read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    await append(upload, 0, chunks())
+    return await complete(upload)
+
+
+def discard_session(session_id):
+    with _lock:
+        for upload_id in [upload_id for upload_id, upload in _uploads.items() if upload["session_id"] == session_id]:
+            del _uploads[upload_id]